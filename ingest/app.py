@@ -1,9 +1,10 @@
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 from uuid import uuid4
 from pydantic import UUID4
 
 from ingest.pipeline import Pipeline
+from ingest.step import step_resources
 
 
 class IngestApp:
@@ -25,12 +26,41 @@ class IngestApp:
         self.pipelines = pipelines
         self.code_dir = code_dir
         self.requirements_path = requirements_path
+        for pipeline in pipelines:
+            pipeline.app = self
+        self.validate()
 
-    def synth(self):
-        """Synthesize the CDK App"""
+    def get_pipeline(self, name: str) -> Pipeline:
+        for pipeline in self.pipelines:
+            if pipeline.name == name:
+                return pipeline
+        raise KeyError(f"No pipeline named {name}")
+
+    def validate(self):
+        """Ensure that steps only emit to pipelines within the app, which
+        start a run per item. Pipelines triggered by batches of objects
+        (an S3Buffer or S3ScanTrigger) run a Map over each batch, which
+        emitted items don't fit."""
+        pipelines = {pipeline.name: pipeline for pipeline in self.pipelines}
+        for pipeline in self.pipelines:
+            for step in pipeline.iter_steps():
+                for target in step_resources(step)["emits"]:
+                    if target not in pipelines:
+                        raise ValueError(
+                            f"{step.__name__} in {pipeline.name} emits to unknown pipeline {target}"
+                        )
+                    trigger = pipelines[target].trigger
+                    if getattr(trigger, "map_concurrency", None) is not None:
+                        raise ValueError(
+                            f"{step.__name__} in {pipeline.name} emits to {target}, which is triggered by batches of objects"
+                        )
+
+    def synth(self, outdir: Optional[str] = None):
+        """Synthesize the CDK App. Assets staged by a previous synth
+        into the same outdir are reused."""
         from aws_cdk import core
 
-        app = core.App()
+        app = core.App(outdir=outdir)
         for pipeline in self.pipelines:
             pipeline.create_stack(
                 app, code_dir=self.code_dir, requirements_path=self.requirements_path
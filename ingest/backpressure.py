@@ -0,0 +1,476 @@
+import json
+import logging
+import math
+import random
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from pydantic import BaseModel
+
+from ingest.batching import AdaptiveBatching, BatchController
+from ingest.data_types import S3Object, objects_from_s3_event
+from ingest.packing import message_partition_key
+from ingest.tracing import TraceContext, current_context, get_tracer, inject
+
+logger = logging.getLogger(__name__)
+
+# Step Functions limits execution input to 256KB
+MAX_INPUT_BYTES = 250_000
+
+ADAPTIVE_BATCHING_ENV = "ADAPTIVE_BATCHING"
+MAX_OBJECTS_ENV = "MAX_OBJECTS_PER_EXECUTION"
+
+
+def split_items(
+    name: str,
+    items: Iterable[Any],
+    trace: Optional[TraceContext] = None,
+    max_items: Optional[int] = None,
+) -> List[List[Any]]:
+    """
+    Split items into the contents of execution inputs of the form
+    {name: [...]}, each within the payload limit and holding at most
+    `max_items`. An item too large to share an input has one of its own.
+    """
+    chunks: List[List[Any]] = []
+    batch: List[Any] = []
+    size = len(json.dumps(inject({name: []}, trace)))
+    empty = size
+    for item in items:
+        item_size = len(json.dumps(item)) + 2
+        if batch and (
+            size + item_size > MAX_INPUT_BYTES
+            or (max_items is not None and len(batch) >= max_items)
+        ):
+            chunks.append(batch)
+            batch, size = [], empty
+        batch.append(item)
+        size += item_size
+    if batch:
+        chunks.append(batch)
+    return chunks
+
+
+def split_inputs(
+    name: str,
+    items: Iterable[Any],
+    trace: Optional[TraceContext] = None,
+    max_items: Optional[int] = None,
+) -> List[str]:
+    """Execution inputs of the form {name: [...]}, split by `split_items`"""
+    return [
+        json.dumps(inject({name: chunk}, trace))
+        for chunk in split_items(name, items, trace=trace, max_items=max_items)
+    ]
+
+
+def object_items(
+    objects: Iterable[S3Object], trace: Optional[TraceContext] = None
+) -> List[Dict]:
+    """
+    The items of objects in a Map's input. When traced, each object starts
+    a run of its own, linked to the trigger's trace, and carries its
+    context, as the Map state runs the steps on the objects alone.
+    """
+    tracer = get_tracer()
+    items: List[Dict] = []
+    for obj in objects:
+        with tracer.span(
+            "run", root=True, links=[trace] if trace else [], kind="run", key=obj.key
+        ) as span:
+            items.append(inject(obj.dict(), span.context if span else None))
+    return items
+
+
+def object_inputs(
+    objects: Iterable[S3Object],
+    trace: Optional[TraceContext] = None,
+    max_objects: Optional[int] = None,
+) -> List[str]:
+    """
+    Execution inputs of the form {"objects": [...]}, splitting the objects
+    across as many inputs as needed to stay within the payload limit, and
+    to hold at most `max_objects`.
+    """
+    return split_inputs(
+        "objects", object_items(objects, trace=trace), max_items=max_objects
+    )
+
+
+class ExecutionInput(NamedTuple):
+    """An execution's input, and the SQS records it was made from"""
+
+    input: str
+    records: List[Dict]
+
+
+class StepFunctionThrottled(Exception):
+    pass
+
+
+class StepFunctionValidationException(Exception):
+    pass
+
+
+class BackpressureConfig(BaseModel):
+    # upper bound on RUNNING executions of the downstream state machine
+    max_running_executions: Optional[int] = None
+    # attempts to start an execution before deferring the batch
+    throttle_retries: int = 5
+    base_delay: float = 0.2
+    max_delay: float = 5.0
+    # how long deferred messages stay invisible before being retried
+    defer_seconds: int = 30
+    max_defer_seconds: int = 600
+    # how long a running-execution count is trusted before being refreshed
+    running_count_ttl: float = 5.0
+
+    # start one execution per partition of a batch
+    partition_by: Optional[str] = None
+    # "records" starts executions with the batch's SQS records, and
+    # "s3_objects" with the objects of the S3 notifications they carry
+    input_format: str = "records"
+    # objects run through the Map of each execution, which is bounded by
+    # the workflow's execution history limit
+    max_objects_per_execution: Optional[int] = None
+    # group each batch's records into executions of an adaptive size
+    adaptive_batching: Optional[AdaptiveBatching] = None
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str]) -> "BackpressureConfig":
+        max_running = environ.get("MAX_RUNNING_EXECUTIONS")
+        adaptive = environ.get(ADAPTIVE_BATCHING_ENV)
+        max_objects = environ.get(MAX_OBJECTS_ENV)
+        return cls(
+            max_running_executions=int(max_running) if max_running else None,
+            partition_by=environ.get("PARTITION_BY"),
+            input_format=environ.get("INPUT_FORMAT", "records"),
+            max_objects_per_execution=int(max_objects) if max_objects else None,
+            adaptive_batching=AdaptiveBatching.parse_raw(adaptive)
+            if adaptive
+            else None,
+        )
+
+
+def record_age(record: Dict, now: float) -> float:
+    """Seconds since an SQS record was sent"""
+    sent = record.get("attributes", {}).get("SentTimestamp")
+    return max(now - int(sent) / 1000, 0.0) if sent else 0.0
+
+
+class ExecutionStarter:
+    """
+    Starts state machine executions from batches of SQS records,
+    applying backpressure when the downstream is saturated.
+
+    - Throttled `StartExecution` calls are retried with exponential
+      backoff and full jitter.
+    - When `max_running_executions` is configured, a batch's executions
+      are started while there is headroom for them; the records of the
+      rest are deferred.
+    - Deferred records are handed back to the queue (as partial batch
+      failures) with a visibility timeout that grows while the
+      downstream stays saturated.
+    - With `adaptive_batching`, each partition's records are split into
+      executions of the size a `BatchController` chooses, and a final
+      partial execution is held back on the queue until its oldest
+      record has waited for the controller's window.
+
+    An instance is expected to live for the lifetime of a container, so
+    that throttle history and running-execution counts carry over
+    between invocations.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        state_machine_arn: str,
+        config: Optional[BackpressureConfig] = None,
+        sqs_client: Any = None,
+        queue_url: Optional[str] = None,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.client = client
+        self.state_machine_arn = state_machine_arn
+        self.config = config or BackpressureConfig()
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.sleep = sleep
+        self.clock = clock
+        self.consecutive_throttles = 0
+        self._running_count: Optional[Tuple[float, int]] = None
+        self.batching: Optional[BatchController] = None
+        if self.config.adaptive_batching:
+            self.batching = BatchController(
+                self.config.adaptive_batching, max_bytes=MAX_INPUT_BYTES
+            )
+
+    def running_executions(self) -> int:
+        """Number of RUNNING executions, capped at `max_running_executions`"""
+        limit = self.config.max_running_executions
+        if limit is None:
+            return 0
+        now = self.clock()
+        if self._running_count and now - self._running_count[0] < (
+            self.config.running_count_ttl
+        ):
+            return self._running_count[1]
+        response = self.client.list_executions(
+            stateMachineArn=self.state_machine_arn,
+            statusFilter="RUNNING",
+            maxResults=min(limit, 1000),
+        )
+        count = len(response.get("executions", []))
+        if response.get("nextToken"):
+            count = limit
+        self._running_count = (now, count)
+        return count
+
+    def admit(
+        self, executions: Sequence[Tuple[str, ExecutionInput]]
+    ) -> Tuple[List[Tuple[str, ExecutionInput]], List[Tuple[str, ExecutionInput]]]:
+        """
+        Split named executions into those which can be started now, one per
+        execution of headroom, and those to defer. Executions are admitted
+        whole, as shrinking them would only start more executions once
+        their remainder is redelivered.
+        """
+        limit = self.config.max_running_executions
+        if limit is None or not executions:
+            return list(executions), []
+        headroom = limit - self.running_executions()
+        if headroom <= 0:
+            logger.info(f"{limit - headroom} executions running, deferring batch")
+        headroom = max(headroom, 0)
+        return list(executions[:headroom]), list(executions[headroom:])
+
+    def start(self, name: str, input: str) -> Dict:
+        """Start an execution, backing off while throttled"""
+        attempt = 0
+        while True:
+            try:
+                response = self.client.start_execution(
+                    stateMachineArn=self.state_machine_arn, name=name, input=input
+                )
+                self.consecutive_throttles = 0
+                if self._running_count:
+                    self._running_count = (
+                        self._running_count[0],
+                        self._running_count[1] + 1,
+                    )
+                return response
+            except self.client.exceptions.ClientError as e:
+                code = e.response["Error"]["Code"]
+                if code == "ValidationException":
+                    raise StepFunctionValidationException(str(e)) from e
+                elif code != "ThrottlingException":
+                    raise e
+                attempt += 1
+                self.consecutive_throttles += 1
+                if attempt >= self.config.throttle_retries:
+                    raise StepFunctionThrottled(str(e)) from e
+                delay = min(
+                    self.config.max_delay, self.config.base_delay * 2**attempt
+                )
+                self.sleep(random.uniform(0, delay))
+
+    def defer(self, records: Sequence[Dict], timeout: Optional[int] = None) -> None:
+        """Delay the redelivery of deferred records, backing off further
+        the longer the downstream remains saturated, unless given a timeout"""
+        if not records or not (self.sqs_client and self.queue_url):
+            return
+        timeouts = [timeout] * len(records)
+        if timeout is None:
+            timeout = min(
+                self.config.max_defer_seconds,
+                self.config.defer_seconds * 2 ** min(self.consecutive_throttles, 5),
+            )
+            # jittered, so that deferred records aren't all redelivered at once
+            timeouts = [int(timeout * random.uniform(0.8, 1.2)) for _ in records]
+        for i in range(0, len(records), 10):
+            self.sqs_client.change_message_visibility_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {
+                        "Id": str(j),
+                        "ReceiptHandle": record["receiptHandle"],
+                        "VisibilityTimeout": timeouts[i + j],
+                    }
+                    for j, record in enumerate(records[i : i + 10])
+                ],
+            )
+
+    def partition(self, records: Sequence[Dict]) -> List[List[Dict]]:
+        """Group records by the partition key of their message body"""
+        if self.config.partition_by is None:
+            return [list(records)] if records else []
+        groups: Dict[str, List[Dict]] = {}
+        for record in records:
+            key = message_partition_key(
+                json.loads(record["body"]), self.config.partition_by
+            )
+            groups.setdefault(key, []).append(record)
+        return list(groups.values())
+
+    def batch(
+        self, groups: Sequence[List[Dict]]
+    ) -> Tuple[List[List[Dict]], List[Dict], int]:
+        """
+        Split groups of records into batches of the adaptive batch size,
+        or fewer records where they would exceed the payload limit.
+        Returns the batches, the records of partial batches whose window
+        hasn't expired, and how long until the earliest of those does.
+        """
+        controller = self.batching
+        # only called when adaptive batching is configured
+        assert controller is not None
+        # the controller's clock tells the time records were sent by
+        now = controller.clock()
+        received = sum(len(group) for group in groups)
+        # only count each message's arrival once, not its redeliveries
+        controller.arrived(
+            sum(
+                1
+                for group in groups
+                for record in group
+                if record.get("attributes", {}).get("ApproximateReceiveCount", "1")
+                == "1"
+            )
+        )
+        batches: List[List[Dict]] = []
+        held: List[Dict] = []
+        wait = math.inf
+        for group in groups:
+            size = controller.batch_size
+            start = 0
+            while start < len(group):
+                batch: List[Dict] = []
+                batch_bytes = 0
+                for record in group[start : start + size]:
+                    record_bytes = len(json.dumps(record)) + 2
+                    if batch and batch_bytes + record_bytes > MAX_INPUT_BYTES:
+                        break
+                    batch.append(record)
+                    batch_bytes += record_bytes
+                start += len(batch)
+                # batches cut short by the payload limit are full
+                full = len(batch) == size or start < len(group)
+                oldest = max(record_age(record, now) for record in batch)
+                if not full and oldest < controller.window:
+                    held.extend(batch)
+                    wait = min(wait, controller.window - oldest)
+                    continue
+                batches.append(batch)
+                received -= len(batch)
+                controller.observe(
+                    depth=received,
+                    batch_size=len(batch),
+                    oldest_age=oldest,
+                    batch_bytes=batch_bytes,
+                )
+        return batches, held, max(1, math.ceil(wait)) if held else 0
+
+    def execution_inputs(self, records: Sequence[Dict]) -> List[ExecutionInput]:
+        """
+        Inputs for the executions started for a group of records, each with
+        the records it holds. Records, or the objects of the S3
+        notifications they carry, are split across executions, so that
+        each input stays within the Step Functions payload limit. Inputs
+        carry the current trace context.
+        """
+        trace = current_context()
+        if self.config.input_format != "s3_objects":
+            return [
+                ExecutionInput(json.dumps(inject({"Records": chunk}, trace)), chunk)
+                for chunk in split_items("Records", records, trace=trace)
+            ]
+        sources: List[Dict] = []
+        objects: List[S3Object] = []
+        for record in records:
+            for obj in objects_from_s3_event(json.loads(record["body"])):
+                sources.append(record)
+                objects.append(obj)
+        inputs = []
+        offset = 0
+        for chunk in split_items(
+            "objects",
+            object_items(objects, trace=trace),
+            max_items=self.config.max_objects_per_execution,
+        ):
+            held = {
+                id(record): record for record in sources[offset : offset + len(chunk)]
+            }
+            inputs.append(
+                ExecutionInput(json.dumps({"objects": chunk}), list(held.values()))
+            )
+            offset += len(chunk)
+        return inputs
+
+    def process(self, records: Sequence[Dict], name: str) -> Dict:
+        """
+        Start the admitted executions of a batch (one per partition, or per
+        adaptive batch, split within the payload limit) and return an SQS
+        partial batch response listing deferred and held records, and
+        records whose execution input was invalid. Each execution starts
+        a trace.
+        """
+        groups = self.partition(records)
+        held: List[Dict] = []
+        failed: List[Dict] = []
+        if self.batching:
+            groups, held, wait = self.batch(groups)
+            self.defer(held, timeout=wait)
+        tracer = get_tracer()
+        executions: List[Tuple[str, ExecutionInput]] = []
+        for i, group in enumerate(groups):
+            with tracer.span("trigger", kind="trigger", records=len(group)):
+                inputs = self.execution_inputs(group)
+            for j, execution in enumerate(inputs):
+                suffix = (f"-{i}" if len(groups) > 1 else "") + (
+                    f"-{j}" if len(inputs) > 1 else ""
+                )
+                executions.append((f"{name}{suffix}", execution))
+        # headroom is checked against the executions the batch really
+        # starts, once it has been batched and split
+        executions, over = self.admit(executions)
+        deferred = [record for _, execution in over for record in execution.records]
+        for k, (execution_name, execution) in enumerate(executions):
+            try:
+                response = self.start(name=execution_name, input=execution.input)
+                logger.debug(response)
+            except StepFunctionThrottled:
+                logger.warning("Throttled starting execution, deferring batch")
+                # only the records of executions which didn't start are
+                # deferred, so that none is started again
+                deferred.extend(
+                    record
+                    for _, unstarted in executions[k:]
+                    for record in unstarted.records
+                )
+                break
+            except StepFunctionValidationException:
+                logger.exception(f"Failed to start {execution_name}")
+                failed.extend(execution.records)
+        self.defer(deferred)
+        # a record whose objects are split across executions may be both
+        # failed and deferred
+        identifiers = dict.fromkeys(
+            record["messageId"] for record in held + deferred + failed
+        )
+        return {
+            "batchItemFailures": [
+                {"itemIdentifier": identifier} for identifier in identifiers
+            ]
+        }
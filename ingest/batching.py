@@ -0,0 +1,146 @@
+"""
+Adaptive sizing of collector batches.
+
+A collector with `adaptive_batching` adjusts its batch size and batching
+window, within the configured bounds, to what it observes: large batches
+while a backlog builds, for throughput, and short windows while items
+trickle in, for latency.
+"""
+import math
+import time
+from typing import Callable, Optional
+
+from pydantic import BaseModel, Field, root_validator
+
+
+class AdaptiveBatching(BaseModel):
+    min_batch_size: int = Field(1, ge=1)
+    # up to the batch size SQS event sources support
+    max_batch_size: int = Field(1000, ge=1, le=10000)
+    # bounds of the batching window, in seconds
+    min_window: int = Field(1, ge=0)
+    max_window: int = Field(60, ge=0, le=300)
+    # target time from an item's arrival to the end of its batch's execution
+    latency_target: float = Field(120, gt=0)
+    # weight of each observation in the moving averages
+    smoothing: float = Field(0.3, gt=0, le=1)
+
+    @root_validator(skip_on_failure=True)
+    def check_bounds(cls, values):
+        if values["min_batch_size"] > values["max_batch_size"]:
+            raise ValueError("min_batch_size is larger than max_batch_size")
+        if values["min_window"] > values["max_window"]:
+            raise ValueError("min_window is longer than max_window")
+        # min_window is the event source's batching window, which SQS
+        # requires for batches of more than 10
+        if values["max_batch_size"] > 10 and values["min_window"] < 1:
+            raise ValueError("min_window must be at least 1 for batches of over 10")
+        return values
+
+
+def clamp(value: float, low: float, high: float) -> float:
+    return min(max(value, low), high)
+
+
+class BatchController:
+    """
+    Chooses the batch size and window of a collector from observations
+    of its batches.
+
+    - A backlog (as many items still waiting as the batch holds, or items
+      older than the latency target) doubles the batch size.
+    - Otherwise the batch size follows the number of items which arrive
+      within the window, halving at most at each batch.
+    - The window leaves the time a batch takes to execute within the
+      latency target, and the batch size is capped so that it can.
+    - Given `max_bytes`, the batch size is also capped so that batches of
+      items of the observed size stay within it.
+
+    Executions are estimated to take time in proportion to their size, once
+    any have been observed.
+    """
+
+    def __init__(
+        self,
+        config: AdaptiveBatching,
+        clock: Callable[[], float] = time.time,
+        max_bytes: Optional[int] = None,
+    ):
+        self.config = config
+        self.clock = clock
+        self.max_bytes = max_bytes
+        self.batch_size = config.min_batch_size
+        self.window = float(config.max_window)
+        # items per second, and seconds of execution per item
+        self.arrival_rate: Optional[float] = None
+        self.seconds_per_item: Optional[float] = None
+        self.bytes_per_item: Optional[float] = None
+        self._arrivals = 0
+        self._since = clock()
+        self.update_window()
+
+    def average(self, current: Optional[float], sample: float) -> float:
+        if current is None:
+            return sample
+        return current + self.config.smoothing * (sample - current)
+
+    def arrived(self, count: int = 1) -> None:
+        self._arrivals += count
+
+    def max_size(self) -> int:
+        """The largest batch which executes within the latency target, and
+        fits within `max_bytes`"""
+        size = float(self.config.max_batch_size)
+        if self.seconds_per_item:
+            budget = self.config.latency_target - self.config.min_window
+            size = min(size, budget / self.seconds_per_item)
+        if self.max_bytes and self.bytes_per_item:
+            size = min(size, self.max_bytes / self.bytes_per_item)
+        return int(clamp(size, 1, self.config.max_batch_size))
+
+    def update_window(self) -> None:
+        execution = (self.seconds_per_item or 0) * self.batch_size
+        self.window = clamp(
+            self.config.latency_target - execution,
+            self.config.min_window,
+            self.config.max_window,
+        )
+
+    def observe(
+        self,
+        depth: int,
+        batch_size: int,
+        execute_seconds: Optional[float] = None,
+        oldest_age: Optional[float] = None,
+        batch_bytes: Optional[int] = None,
+    ) -> None:
+        """
+        Record a batch: the items still waiting once it was taken, its size,
+        how long it took to execute, how long its oldest item had waited
+        and its size in bytes, where known.
+        """
+        now = self.clock()
+        elapsed = now - self._since
+        if elapsed > 0:
+            self.arrival_rate = self.average(
+                self.arrival_rate, self._arrivals / elapsed
+            )
+            self._arrivals, self._since = 0, now
+        if execute_seconds is not None and batch_size:
+            self.seconds_per_item = self.average(
+                self.seconds_per_item, execute_seconds / batch_size
+            )
+        if batch_bytes is not None and batch_size:
+            self.bytes_per_item = self.average(
+                self.bytes_per_item, batch_bytes / batch_size
+            )
+        backlog = depth >= self.batch_size or (
+            oldest_age is not None and oldest_age >= self.config.latency_target
+        )
+        if backlog:
+            size = self.batch_size * 2
+        else:
+            filled = math.ceil((self.arrival_rate or 0) * self.window)
+            size = max(filled, self.batch_size // 2)
+        self.batch_size = int(clamp(size, self.config.min_batch_size, self.max_size()))
+        self.update_window()
@@ -1,6 +1,6 @@
 from collections import deque
 from datetime import datetime
-from typing import Any, Deque
+from typing import Any, Deque, Optional
 
 
 class BatchCache:
@@ -12,8 +12,8 @@ class BatchCache:
     def fetch(self, num_items: int):
         return [self.cache.popleft()[1] for _ in range(min(num_items, self.queue_size))]
 
-    def queue_data(self, data: Any):
-        self.cache.append((datetime.now(), data))
+    def queue_data(self, data: Any, queued_at: Optional[datetime] = None):
+        self.cache.append((queued_at or datetime.now(), data))
 
     @property
     def queue_size(self):
@@ -21,3 +21,6 @@ class BatchCache:
 
     def time_since_first_item(self):
         return datetime.now() - self.cache[0][0]
+
+    def first_queued_at(self) -> datetime:
+        return self.cache[0][0]
@@ -0,0 +1,130 @@
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional, Protocol, Tuple
+
+
+class CheckpointStore(Protocol):
+    """
+    Persists the progress of local pipeline runs, so that an interrupted
+    run can be resumed. Items are identified by a digest of the input
+    which produced them.
+    """
+
+    def get_output(self, pipeline: str, step: int, key: str) -> Optional[str]:
+        ...
+
+    def put_output(self, pipeline: str, step: int, key: str, output: str) -> None:
+        ...
+
+    def buffer(
+        self, pipeline: str, step: int, key: str, item: str, queued_at: float
+    ) -> bool:
+        """Record an item as collected. Returns False if the item
+        had already been collected."""
+        ...
+
+    def buffered(self, pipeline: str, step: int) -> List[Tuple[str, str, float]]:
+        """Return (key, item, queued_at) for items collected but not yet flushed"""
+        ...
+
+    def flush(
+        self, pipeline: str, step: int, keys: List[str], batch_key: str, output: str
+    ) -> None:
+        """Record a batch of buffered items as executed, with its output"""
+        ...
+
+    def complete_batch(self, pipeline: str, step: int, batch_key: str) -> None:
+        ...
+
+    def incomplete_batches(self, pipeline: str) -> List[Tuple[int, str, str]]:
+        """Return (step, batch_key, output) for flushed batches whose
+        downstream steps did not complete"""
+        ...
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    def __init__(self, path: Path):
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS outputs (
+                    pipeline TEXT, step INTEGER, key TEXT, output TEXT,
+                    PRIMARY KEY (pipeline, step, key)
+                );
+                CREATE TABLE IF NOT EXISTS buffered (
+                    pipeline TEXT, step INTEGER, key TEXT, item TEXT,
+                    queued_at REAL, flushed INTEGER DEFAULT 0,
+                    PRIMARY KEY (pipeline, step, key)
+                );
+                CREATE TABLE IF NOT EXISTS batches (
+                    pipeline TEXT, step INTEGER, key TEXT, output TEXT,
+                    completed INTEGER DEFAULT 0,
+                    PRIMARY KEY (pipeline, step, key)
+                );
+                """
+            )
+
+    def get_output(self, pipeline: str, step: int, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT output FROM outputs WHERE pipeline=? AND step=? AND key=?",
+                (pipeline, step, key),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_output(self, pipeline: str, step: int, key: str, output: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)",
+                (pipeline, step, key, output),
+            )
+
+    def buffer(
+        self, pipeline: str, step: int, key: str, item: str, queued_at: float
+    ) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO buffered (pipeline, step, key, item, queued_at) VALUES (?, ?, ?, ?, ?)",
+                (pipeline, step, key, item, queued_at),
+            )
+        return cursor.rowcount > 0
+
+    def buffered(self, pipeline: str, step: int) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, item, queued_at FROM buffered WHERE pipeline=? AND step=? AND flushed=0 ORDER BY queued_at",
+                (pipeline, step),
+            ).fetchall()
+
+    def flush(
+        self, pipeline: str, step: int, keys: List[str], batch_key: str, output: str
+    ) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE buffered SET flushed=1 WHERE pipeline=? AND step=? AND key=?",
+                [(pipeline, step, key) for key in keys],
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO batches (pipeline, step, key, output) VALUES (?, ?, ?, ?)",
+                (pipeline, step, batch_key, output),
+            )
+
+    def complete_batch(self, pipeline: str, step: int, batch_key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE batches SET completed=1 WHERE pipeline=? AND step=? AND key=?",
+                (pipeline, step, batch_key),
+            )
+
+    def incomplete_batches(self, pipeline: str) -> List[Tuple[int, str, str]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT step, key, output FROM batches WHERE pipeline=? AND completed=0",
+                (pipeline,),
+            ).fetchall()
+
+    def close(self) -> None:
+        self._conn.close()
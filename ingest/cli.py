@@ -0,0 +1,306 @@
+"""
+The `ingest` command line interface.
+
+Only `synth` imports the CDK, so that local runs start quickly.
+"""
+import argparse
+import contextlib
+import glob
+import importlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Any, Iterator, List, Optional, Sequence
+
+from pydantic import BaseModel
+
+DEFAULT_APP = "app:app"
+BUILD_DIR = ".ingest-build"
+
+
+def load_app(spec: str) -> Any:
+    """Import an IngestApp from a `module:attribute` spec. Without an
+    attribute, the module's only IngestApp is used."""
+    from ingest.app import IngestApp
+
+    module_name, _, attribute = spec.partition(":")
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    module = importlib.import_module(module_name)
+    if attribute:
+        return getattr(module, attribute)
+    apps = [value for value in vars(module).values() if isinstance(value, IngestApp)]
+    if len(apps) != 1:
+        raise SystemExit(f"Expected one IngestApp in {module_name}, found {len(apps)}")
+    return apps[0]
+
+
+def get_pipeline(app: Any, name: Optional[str]) -> Any:
+    if name is None:
+        if len(app.pipelines) != 1:
+            raise SystemExit(
+                "The app has several pipelines, choose one with --pipeline: "
+                + ", ".join(pipeline.name for pipeline in app.pipelines)
+            )
+        return app.pipelines[0]
+    try:
+        return app.get_pipeline(name)
+    except KeyError as e:
+        raise SystemExit(str(e))
+
+
+def parse_documents(text: str) -> Iterator[Any]:
+    """A JSON document, list of documents, or JSON lines"""
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        for line in text.splitlines():
+            if line.strip():
+                yield json.loads(line)
+        return
+    if isinstance(value, list):
+        yield from value
+    else:
+        yield value
+
+
+def read_inputs(sources: Sequence[str], stdin=None) -> Iterator[Any]:
+    """Inputs from files and globs, or from stdin when no sources are given"""
+    if not sources or list(sources) == ["-"]:
+        for line in stdin or sys.stdin:
+            if line.strip():
+                yield json.loads(line)
+        return
+    for source in sources:
+        paths = sorted(glob.glob(source)) if glob.has_magic(source) else [source]
+        if not paths:
+            raise SystemExit(f"No files match {source}")
+        for path in paths:
+            with open(path) as f:
+                yield from parse_documents(f.read())
+
+
+class BenchReport(BaseModel):
+    items: int
+    results: int
+    seconds: float
+    throughput: float
+    latency_p50: Optional[float]
+    latency_p90: Optional[float]
+    latency_p99: Optional[float]
+    latency_max: Optional[float]
+
+
+def bench(pipeline: Any, inputs: Sequence[Any], profiler: Optional[Any] = None):
+    """Run inputs through the local engine, timing each one. Batches
+    still buffered at the end are flushed, and included in the total time."""
+    from ingest.runner import LocalRunner
+    from ingest.simulator import percentile
+
+    latencies: List[float] = []
+    results: List[Any] = []
+    start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if profiler:
+            stack.enter_context(profiler)
+        runner = stack.enter_context(
+            LocalRunner(pipeline, on_result=results.append, profiler=profiler)
+        )
+        for input in inputs:
+            item_start = time.perf_counter()
+            result = runner.process(input)
+            latencies.append(time.perf_counter() - item_start)
+            if result is not None:
+                results.append(result)
+    seconds = time.perf_counter() - start
+    return BenchReport(
+        items=len(inputs),
+        results=len(results),
+        seconds=seconds,
+        throughput=len(inputs) / seconds if seconds else 0,
+        latency_p50=percentile(latencies, 0.5),
+        latency_p90=percentile(latencies, 0.9),
+        latency_p99=percentile(latencies, 0.99),
+        latency_max=max(latencies, default=None),
+    )
+
+
+def synth_command(args) -> int:
+    if args.force:
+        shutil.rmtree(BUILD_DIR, ignore_errors=True)
+        shutil.rmtree(args.output, ignore_errors=True)
+    app = load_app(args.app)
+    app.synth(outdir=args.output)
+    print(f"Synthesized {len(app.pipelines)} pipeline(s) to {args.output}")
+    return 0
+
+
+def run_command(args) -> int:
+    from ingest.checkpoint import SQLiteCheckpointStore
+    from ingest.runner import LocalRunner, serialize
+    from ingest.tracing import FileExporter, Tracer
+
+    pipeline = get_pipeline(load_app(args.app), args.pipeline)
+    input_type = pipeline.trigger.output_type
+    output_lock = threading.Lock()
+
+    def write(result: Any) -> None:
+        with output_lock:
+            print(serialize(result), flush=True)
+
+    checkpoint = SQLiteCheckpointStore(args.checkpoint) if args.checkpoint else None
+    tracer = Tracer(FileExporter(args.trace)) if args.trace else None
+    with LocalRunner(
+        pipeline, checkpoint=checkpoint, on_result=write, tracer=tracer
+    ) as runner:
+        for result in runner.resume():
+            write(result)
+        for document in read_inputs(args.inputs):
+            result = runner.process(input_type.parse_obj(document))
+            if result is not None:
+                write(result)
+    return 0
+
+
+def bench_command(args) -> int:
+    from ingest.profiling import StepProfiler
+
+    pipeline = get_pipeline(load_app(args.app), args.pipeline)
+    input_type = pipeline.trigger.output_type
+    inputs = [input_type.parse_obj(d) for d in read_inputs(args.inputs)]
+    profiler = StepProfiler() if args.profile else None
+    report = bench(pipeline, inputs * args.repeat, profiler=profiler)
+    if args.json:
+        print(report.json())
+        return 0
+    print(
+        f"{report.items} items in {report.seconds:.3f}s "
+        f"({report.throughput:.1f} items/s), {report.results} results"
+    )
+    if report.items:
+        print(
+            f"latency p50 {report.latency_p50:.4f}s  p90 {report.latency_p90:.4f}s  "
+            f"p99 {report.latency_p99:.4f}s  max {report.latency_max:.4f}s"
+        )
+    if profiler:
+        print(profiler.report().format())
+    return 0
+
+
+def load_command(args) -> int:
+    from ingest.loadgen import LoadGenerator
+    from ingest.simulator import Constant, ConstantArrivals, LogNormal, PoissonArrivals
+
+    pipeline = get_pipeline(load_app(args.app), args.pipeline)
+    input_type = pipeline.trigger.output_type
+    items = (
+        [input_type.parse_obj(d) for d in read_inputs(args.inputs)]
+        if args.inputs
+        else []
+    )
+    arrivals = (ConstantArrivals if args.constant else PoissonArrivals)(args.rate)
+    sizes = (
+        LogNormal(args.size, args.size_sigma)
+        if args.size_sigma
+        else Constant(args.size)
+    )
+    generator = LoadGenerator(
+        pipeline,
+        arrivals,
+        sizes=sizes,
+        items=items,
+        concurrency=args.concurrency,
+        max_starts_per_second=args.max_starts_per_second,
+    )
+    report = generator.run(args.duration, drain=args.drain)
+    print(report.json() if args.json else report.format())
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="ingest")
+    parser.add_argument(
+        "--app",
+        default=DEFAULT_APP,
+        help="module:attribute of the IngestApp (default: %(default)s)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    synth = commands.add_parser("synth", help="synthesize the CDK app")
+    synth.add_argument("--output", default="cdk.out")
+    synth.add_argument(
+        "--force",
+        action="store_true",
+        help="rebuild the dependency layer and all assets",
+    )
+    synth.set_defaults(func=synth_command)
+
+    for name, func, help in [
+        ("run", run_command, "run inputs through a pipeline locally"),
+        ("bench", bench_command, "measure a pipeline's local throughput"),
+    ]:
+        command = commands.add_parser(name, help=help)
+        command.add_argument("--pipeline", help="required if the app has several")
+        command.add_argument(
+            "inputs",
+            nargs="*",
+            help="JSON or JSON lines files, or globs. Reads JSON lines from stdin if omitted",
+        )
+        command.set_defaults(func=func)
+
+    commands.choices["run"].add_argument(
+        "--checkpoint", help="SQLite file in which to checkpoint progress"
+    )
+    commands.choices["run"].add_argument(
+        "--trace", help="file to which spans are written, as OTLP JSON lines"
+    )
+    commands.choices["bench"].add_argument(
+        "--repeat", type=int, default=1, help="run the inputs this many times"
+    )
+    commands.choices["bench"].add_argument(
+        "--profile", action="store_true", help="report per-step memory and time"
+    )
+    commands.choices["bench"].add_argument("--json", action="store_true")
+
+    load = commands.add_parser(
+        "load", help="drive generated events through the trigger handlers"
+    )
+    load.add_argument("--pipeline", help="required if the app has several")
+    load.add_argument(
+        "inputs",
+        nargs="*",
+        help="sample messages for SQS triggers, as JSON or JSON lines files",
+    )
+    load.add_argument("--rate", type=float, default=10, help="items per second")
+    load.add_argument(
+        "--constant", action="store_true", help="evenly spaced rather than Poisson"
+    )
+    load.add_argument("--duration", type=float, default=10, help="seconds")
+    load.add_argument("--drain", type=float, default=60, help="seconds")
+    load.add_argument(
+        "--size", type=int, default=1024, help="(median) object size in bytes"
+    )
+    load.add_argument(
+        "--size-sigma", type=float, help="log-normal spread of object sizes"
+    )
+    load.add_argument("--concurrency", type=int, default=10)
+    load.add_argument(
+        "--max-starts-per-second",
+        type=int,
+        help="throttle StartExecution calls beyond this rate",
+    )
+    load.add_argument("--json", action="store_true")
+    load.set_defaults(func=load_command)
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,40 @@
+from typing import Dict, List, Optional
+from urllib.parse import unquote_plus
+
 from pydantic import BaseModel
 
+from ingest.storage import DEFAULT_CHUNK_SIZE, ObjectStore, S3ObjectReader
+
 
 class S3Object(BaseModel):
     bucket: str
     key: str
+
+    def open(
+        self,
+        store: Optional[ObjectStore] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        prefetch: bool = True,
+    ) -> S3ObjectReader:
+        """Return a streaming reader for the object's contents"""
+        return S3ObjectReader(
+            bucket=self.bucket,
+            key=self.key,
+            store=store,
+            chunk_size=chunk_size,
+            prefetch=prefetch,
+        )
+
+
+def objects_from_s3_event(event: Dict) -> List[S3Object]:
+    """The objects in an S3 event notification. Test events, sent when
+    notifications are configured, have no records."""
+    return [
+        S3Object(
+            bucket=record["s3"]["bucket"]["name"],
+            # keys are URL encoded in notifications
+            key=unquote_plus(record["s3"]["object"]["key"]),
+        )
+        for record in event.get("Records", [])
+        if "s3" in record
+    ]
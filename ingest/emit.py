@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Protocol, Sequence, Union
+
+from pydantic import BaseModel
+
+from ingest.packing import MAX_MESSAGE_BYTES, pack_items
+from ingest.partitioning import partition_key, shard_for
+from ingest.tracing import current_context, inject
+
+# maps the names of pipelines a step emits to, to their state machine ARNs,
+# or to the QueueTarget of those whose first step is a collector
+EMIT_TARGETS_ENV = "INGEST_EMIT_TARGETS"
+
+# SQS sends at most 10 messages, of 256KB in all, per batch
+MAX_BATCH_MESSAGES = 10
+
+
+class QueueTarget(BaseModel):
+    """The queues of the collector a pipeline starts with, which emitted
+    items are sent to directly"""
+
+    queue_urls: List[str]
+    # spreads items across the queues, as the collector partitions them
+    partition_by: Optional[str] = None
+    compress_messages: bool = False
+
+
+class EmitFailed(Exception):
+    pass
+
+
+class Emitter(Protocol):
+    def emit(self, pipeline_name: str, items: Sequence[BaseModel]) -> None:
+        ...
+
+
+class LocalEmitter(Emitter):
+    """Runs target pipelines in-process, until closed"""
+
+    def __init__(self, pipelines: Sequence[Any]):
+        self.pipelines = {pipeline.name: pipeline for pipeline in pipelines}
+        # the pipelines items were emitted to
+        self.targets: Dict[str, Any] = {}
+
+    def emit(self, pipeline_name: str, items: Sequence[BaseModel]) -> None:
+        pipeline = self.pipelines[pipeline_name]
+        self.targets[pipeline_name] = pipeline
+        for item in items:
+            if not isinstance(item, pipeline.trigger.output_type):
+                raise TypeError(
+                    f"{pipeline_name} expects {pipeline.trigger.output_type}, not {type(item)}"
+                )
+            pipeline.run(item)
+
+    def close(self) -> None:
+        """Close the pipelines items were emitted to, flushing the batches
+        they hold and stopping their flush timers"""
+        while self.targets:
+            _, pipeline = self.targets.popitem()
+            pipeline.close()
+
+
+class StepFunctionsEmitter(Emitter):
+    """
+    Sends items to deployed pipelines.
+
+    Items for a pipeline whose first step is a collector are packed into
+    messages on that collector's queues, sent in batches, rather than each
+    starting a run only to be queued. Other pipelines are started once per
+    item, concurrently, with throttled starts backed off and retried.
+    Executions are named by a digest of the item and the emitting run's
+    trace, so that a step retried after some of its items were started
+    doesn't start them again.
+    """
+
+    def __init__(
+        self,
+        targets: Dict[str, Union[str, QueueTarget]],
+        client: Any = None,
+        max_workers: int = 16,
+        sqs_client: Any = None,
+    ):
+        self.targets = targets
+        self._client = client
+        self._sqs_client = sqs_client
+        self.max_workers = max_workers
+
+    @classmethod
+    def from_env(cls) -> "StepFunctionsEmitter":
+        targets = json.loads(os.environ.get(EMIT_TARGETS_ENV, "{}"))
+        return cls(
+            targets={
+                name: target if isinstance(target, str) else QueueTarget(**target)
+                for name, target in targets.items()
+            }
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            from ingest.resources import get_pool
+
+            self._client = get_pool().client(
+                "stepfunctions", max_pool_connections=self.max_workers
+            )
+        return self._client
+
+    @property
+    def sqs_client(self):
+        if self._sqs_client is None:
+            from ingest.resources import get_pool
+
+            self._sqs_client = get_pool().client("sqs")
+        return self._sqs_client
+
+    def emit(self, pipeline_name: str, items: Sequence[BaseModel]) -> None:
+        if pipeline_name not in self.targets:
+            raise KeyError(
+                f"{pipeline_name} is not a declared emit target of this step"
+            )
+        target = self.targets[pipeline_name]
+        if isinstance(target, QueueTarget):
+            self.send(target, items)
+        else:
+            self.start(target, items)
+
+    def start(self, state_machine_arn: str, items: Sequence[BaseModel]) -> None:
+        from ingest.backpressure import ExecutionStarter
+
+        trace = current_context()
+        starter = ExecutionStarter(self.client, state_machine_arn)
+
+        def start(item: BaseModel) -> None:
+            input = item.json(by_alias=True)
+            name = hashlib.sha256(
+                ((trace.trace_id if trace else "") + input).encode()
+            ).hexdigest()[:64]
+            try:
+                starter.start(name=name, input=input)
+            except self.client.exceptions.ClientError as e:
+                if e.response["Error"]["Code"] != "ExecutionAlreadyExists":
+                    raise
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # consume the results, so that failures are raised
+            list(executor.map(start, items))
+
+    def send(self, target: QueueTarget, items: Sequence[BaseModel]) -> None:
+        trace = current_context()
+        by_queue: Dict[str, List[Any]] = {}
+        for item in items:
+            body = inject(json.loads(item.json(by_alias=True)), trace)
+            url = target.queue_urls[0]
+            if len(target.queue_urls) > 1 and target.partition_by:
+                key = partition_key(body, target.partition_by)
+                url = target.queue_urls[shard_for(key, len(target.queue_urls))]
+            by_queue.setdefault(url, []).append(body)
+        for url, bodies in by_queue.items():
+            messages = pack_items(
+                bodies,
+                compress=target.compress_messages,
+                partition_by=target.partition_by,
+            )
+            batch: List[str] = []
+            for message in messages:
+                if batch and (
+                    len(batch) >= MAX_BATCH_MESSAGES
+                    or sum(map(len, batch)) + len(message) > MAX_MESSAGE_BYTES
+                ):
+                    self.send_batch(url, batch)
+                    batch = []
+                batch.append(message)
+            if batch:
+                self.send_batch(url, batch)
+
+    def send_batch(self, url: str, messages: Sequence[str]) -> None:
+        response = self.sqs_client.send_message_batch(
+            QueueUrl=url,
+            Entries=[
+                {"Id": str(i), "MessageBody": message}
+                for i, message in enumerate(messages)
+            ],
+        )
+        if response.get("Failed"):
+            raise EmitFailed(f"Failed to send to {url}: {response['Failed']}")
+
+
+_emitter: ContextVar[Optional[Emitter]] = ContextVar("emitter", default=None)
+_default_emitter: Optional[Emitter] = None
+
+
+@contextmanager
+def use_emitter(emitter: Emitter) -> Iterator[Emitter]:
+    token = _emitter.set(emitter)
+    try:
+        yield emitter
+    finally:
+        _emitter.reset(token)
+
+
+def emit(pipeline_name: str, items: Sequence[BaseModel]) -> None:
+    """
+    Send items to another pipeline in the same IngestApp, each item
+    starting a run of that pipeline. The emitting step must list the
+    target in its `emits`.
+    """
+    global _default_emitter
+    emitter = _emitter.get()
+    if emitter is None:
+        if _default_emitter is None:
+            _default_emitter = StepFunctionsEmitter.from_env()
+        emitter = _default_emitter
+    emitter.emit(pipeline_name, items)
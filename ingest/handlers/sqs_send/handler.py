@@ -1,24 +1,72 @@
-import boto3
 import json
 import logging
 import os
+from typing import Dict, List, Optional
+
+from ingest.log import configure_logging
+from ingest.packing import pack_items
+from ingest.partitioning import partition_key, shard_for
+from ingest.resources import get_pool
+from ingest.tracing import TRACE_KEY, extract, mark_sent, message_attributes
 
 
 class FailedToWriteToSQS(Exception):
     pass
 
 
-logger = logging.getLogger(__name__)
+configure_logging()
+logger = logging.getLogger("ingest.handlers.sqs_send")
 
 
-def handler(event, context) -> None:
-    sqs = boto3.client("sqs")
-    response = sqs.send_message(
-        QueueUrl=os.environ["QUEUE_URL"], MessageBody=json.dumps(event)
-    )
+def queue_url(event) -> str:
+    """Choose the queue for an item, spreading partitions across shards"""
+    queue_urls = json.loads(os.environ["QUEUE_URLS"])
+    if len(queue_urls) == 1:
+        return queue_urls[0]
+    key = partition_key(event, os.environ["PARTITION_BY"])
+    return queue_urls[shard_for(key, len(queue_urls))]
+
+
+def send(sqs, url: str, body: str, attributes: Optional[Dict] = None) -> str:
+    params = {"MessageAttributes": attributes} if attributes else {}
+    response = sqs.send_message(QueueUrl=url, MessageBody=body, **params)
     if response.get("Error"):
         logger.error(response.get("Error"))
         raise FailedToWriteToSQS(response.get("Error"))
-    else:
-        logger.info(f"Queued Item")
-        return response.get("MessageId")
+    return response.get("MessageId")
+
+
+def send_packed(sqs, event) -> List[str]:
+    """Pack an item, or the outputs of a Map state, into as few messages
+    as fit"""
+    items = event if isinstance(event, list) else [event]
+    # items discarded by a catch policy carry the caught error
+    items = [mark_sent(item) for item in items if "ingest_error" not in item]
+    partition_by = os.environ.get("PARTITION_BY")
+    by_queue: Dict[str, List] = {}
+    for item in items:
+        by_queue.setdefault(queue_url(item), []).append(item)
+    message_ids = []
+    for url, queue_items in by_queue.items():
+        for body in pack_items(
+            queue_items,
+            compress=bool(os.environ.get("COMPRESS_MESSAGES")),
+            partition_by=partition_by,
+        ):
+            message_ids.append(send(sqs, url, body))
+    logger.info("Queued %s items in %s messages", len(items), len(message_ids))
+    return message_ids
+
+
+def handler(event, context):
+    sqs = get_pool().client("sqs")
+    if os.environ.get("PACK_MESSAGES"):
+        return send_packed(sqs, event)
+    # the trace context travels as a message attribute
+    trace = extract(event)
+    event.pop(TRACE_KEY, None)
+    message_id = send(
+        sqs, queue_url(event), json.dumps(event), message_attributes(trace)
+    )
+    logger.debug("Queued item")
+    return message_id
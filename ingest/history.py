@@ -0,0 +1,485 @@
+"""
+A history of pipeline runs, for monitoring without listing executions.
+
+Runs are identified by their trace id, so the history is recorded from
+the spans of traced runs (see ingest.tracing): each step span writes a
+step record, and updates the record of its run. Handlers write to the
+DynamoDB table named by INGEST_HISTORY_TABLE (set on deployed functions by
+the Pipeline's `history_table`), and local runs to any store given to a
+`HistoryExporter`.
+"""
+import random
+import sqlite3
+import threading
+import time
+from enum import Enum
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Protocol, Union
+
+from pydantic import BaseModel
+
+from ingest.tracing import Span, SpanExporter
+
+HISTORY_TABLE_ENV = "INGEST_HISTORY_TABLE"
+# the pipeline a deployed function belongs to
+PIPELINE_ENV = "INGEST_PIPELINE"
+# set on the last step of each workflow: the status of a run it completes
+RUN_END_ENV = "INGEST_RUN_END"
+
+
+class RunStatus(str, Enum):
+    running = "running"
+    # handed on to a collector, whose batch is a run of its own
+    collected = "collected"
+    succeeded = "succeeded"
+    discarded = "discarded"
+    failed = "failed"
+
+
+FINAL_STATUSES = (RunStatus.succeeded, RunStatus.discarded, RunStatus.failed)
+# records may arrive out of order, so a run only moves up this order. A
+# failed step may yet be retried, or caught, so a run's failure is
+# superseded by a later success or discard.
+STATUS_ORDER = {
+    RunStatus.running: 0,
+    RunStatus.failed: 1,
+    RunStatus.collected: 2,
+    RunStatus.succeeded: 3,
+    RunStatus.discarded: 3,
+}
+
+
+class RunRecord(BaseModel):
+    run_id: str
+    pipeline: str
+    status: RunStatus
+    # the key (or id) of the input which started the run
+    input_key: Optional[str] = None
+    started_at: float
+    updated_at: float
+    ended_at: Optional[float] = None
+    error: Optional[str] = None
+
+
+class StepRecord(BaseModel):
+    run_id: str
+    span_id: str
+    pipeline: str
+    step: str
+    status: RunStatus
+    started_at: float
+    ended_at: float
+    input_bytes: Optional[int] = None
+    output_bytes: Optional[int] = None
+    error: Optional[str] = None
+
+
+def merge_runs(old: RunRecord, new: RunRecord) -> RunRecord:
+    """Combine records of the same run, which steps may write out of order"""
+    status = max(old.status, new.status, key=STATUS_ORDER.__getitem__)
+    ended = [r.ended_at for r in (old, new) if r.ended_at is not None]
+    return RunRecord(
+        run_id=old.run_id,
+        pipeline=old.pipeline,
+        status=status,
+        input_key=old.input_key or new.input_key,
+        started_at=min(old.started_at, new.started_at),
+        updated_at=max(old.updated_at, new.updated_at),
+        ended_at=max(ended) if ended and status in FINAL_STATUSES else None,
+        # the errors of attempts which were retried remain on their steps
+        error=(new.error or old.error) if status == RunStatus.failed else None,
+    )
+
+
+class HistoryStore(Protocol):
+    def put_run(self, record: RunRecord) -> None:
+        """Insert a run, or merge it into the existing record"""
+        ...
+
+    def put_step(self, record: StepRecord) -> None:
+        ...
+
+    def get_run(self, run_id: str) -> Optional[RunRecord]:
+        ...
+
+    def steps(self, run_id: str) -> List[StepRecord]:
+        ...
+
+    def query(
+        self,
+        pipeline: Optional[str] = None,
+        status: Optional[RunStatus] = None,
+        key_prefix: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 100,
+    ) -> List[RunRecord]:
+        """Runs matching every given criterion, most recently started first"""
+        ...
+
+
+def prefix_end(prefix: str) -> str:
+    """The smallest string greater than every string starting with prefix,
+    so that prefix matches are index range scans"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class SQLiteHistoryStore(HistoryStore):
+    def __init__(self, path: Union[Path, str] = ":memory:"):
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY, pipeline TEXT, status TEXT,
+                    input_key TEXT, started_at REAL, updated_at REAL,
+                    ended_at REAL, error TEXT
+                );
+                CREATE INDEX IF NOT EXISTS runs_by_status
+                    ON runs (pipeline, status, started_at);
+                CREATE INDEX IF NOT EXISTS runs_by_time ON runs (pipeline, started_at);
+                CREATE INDEX IF NOT EXISTS runs_by_key ON runs (pipeline, input_key);
+                CREATE INDEX IF NOT EXISTS runs_by_status_only
+                    ON runs (status, started_at);
+                CREATE TABLE IF NOT EXISTS steps (
+                    run_id TEXT, span_id TEXT, pipeline TEXT, step TEXT,
+                    status TEXT, started_at REAL, ended_at REAL,
+                    input_bytes INTEGER, output_bytes INTEGER, error TEXT,
+                    PRIMARY KEY (run_id, span_id)
+                );
+                """
+            )
+
+    def get_run(self, run_id: str) -> Optional[RunRecord]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM runs WHERE run_id=?", (run_id,)
+            ).fetchone()
+        return RunRecord(**row) if row else None
+
+    def put_run(self, record: RunRecord) -> None:
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT * FROM runs WHERE run_id=?", (record.run_id,)
+            ).fetchone()
+            if row:
+                record = merge_runs(RunRecord(**row), record)
+            values = record.dict()
+            values["status"] = record.status.value
+            self._conn.execute(
+                "INSERT OR REPLACE INTO runs VALUES (:run_id, :pipeline, :status, :input_key, :started_at, :updated_at, :ended_at, :error)",
+                values,
+            )
+
+    def put_step(self, record: StepRecord) -> None:
+        values = record.dict()
+        values["status"] = record.status.value
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO steps VALUES (:run_id, :span_id, :pipeline, :step, :status, :started_at, :ended_at, :input_bytes, :output_bytes, :error)",
+                values,
+            )
+
+    def steps(self, run_id: str) -> List[StepRecord]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM steps WHERE run_id=? ORDER BY started_at", (run_id,)
+            ).fetchall()
+        return [StepRecord(**row) for row in rows]
+
+    def query(
+        self,
+        pipeline: Optional[str] = None,
+        status: Optional[RunStatus] = None,
+        key_prefix: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 100,
+    ) -> List[RunRecord]:
+        clauses: List[str] = []
+        params: List[Any] = []
+        if pipeline is not None:
+            clauses.append("pipeline = ?")
+            params.append(pipeline)
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(RunStatus(status).value)
+        if key_prefix:
+            clauses.append("input_key >= ? AND input_key < ?")
+            params.extend([key_prefix, prefix_end(key_prefix)])
+        if since is not None:
+            clauses.append("started_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("started_at < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM runs {where} ORDER BY started_at DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [RunRecord(**row) for row in rows]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class DynamoDBHistoryStore(HistoryStore):
+    """
+    Stores runs and steps in one DynamoDB table, with a string partition
+    key `pk` and sort key `sk`. Queries need a pipeline, and two global
+    secondary indexes:
+
+    - `by_status`, partitioned by `pipeline_status` and sorted by
+      `started_at` (a number)
+    - `by_key`, partitioned by `pipeline` and sorted by `input_key`
+
+    Runs are written with conditional updates, so that a run which has
+    finished is not reopened by records arriving late. Conflicting
+    updates are retried with jittered backoff.
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        client: Any = None,
+        attempts: int = 5,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.table_name = table_name
+        self._client = client
+        self.attempts = attempts
+        self.sleep = sleep
+
+    @property
+    def client(self):
+        if self._client is None:
+            from ingest.resources import get_pool
+
+            self._client = get_pool().client("dynamodb")
+        return self._client
+
+    @staticmethod
+    def encode(values: Dict[str, Any]) -> Dict[str, Dict]:
+        item = {}
+        for name, value in values.items():
+            if value is None:
+                continue
+            if isinstance(value, Enum):
+                value = value.value
+            if isinstance(value, (int, float)):
+                item[name] = {"N": repr(value)}
+            else:
+                item[name] = {"S": str(value)}
+        return item
+
+    @staticmethod
+    def decode(item: Dict[str, Dict]) -> Dict[str, Any]:
+        values = {}
+        for name, value in item.items():
+            if "N" in value:
+                values[name] = float(value["N"])
+            else:
+                values[name] = value["S"]
+        return values
+
+    def get_run(self, run_id: str) -> Optional[RunRecord]:
+        item = self.client.get_item(
+            TableName=self.table_name,
+            Key={"pk": {"S": f"run#{run_id}"}, "sk": {"S": "run"}},
+            ConsistentRead=True,
+        ).get("Item")
+        return RunRecord(**self.decode(item)) if item else None
+
+    def put_run(self, record: RunRecord) -> None:
+        # merged with the stored record, under a condition that the stored
+        # record hasn't changed since it was read
+        for attempt in range(self.attempts):
+            if attempt:
+                self.sleep(random.uniform(0, 0.05 * 2**attempt))
+            existing = self.get_run(record.run_id)
+            merged = merge_runs(existing, record) if existing else record
+            item = self.encode(
+                {
+                    **merged.dict(),
+                    "pk": f"run#{record.run_id}",
+                    "sk": "run",
+                    "pipeline_status": f"{merged.pipeline}#{merged.status.value}",
+                }
+            )
+            if existing:
+                condition = {
+                    "ConditionExpression": "updated_at = :updated_at",
+                    "ExpressionAttributeValues": {
+                        ":updated_at": {"N": repr(existing.updated_at)}
+                    },
+                }
+            else:
+                condition = {"ConditionExpression": "attribute_not_exists(pk)"}
+            try:
+                self.client.put_item(TableName=self.table_name, Item=item, **condition)
+                return
+            except self.client.exceptions.ConditionalCheckFailedException:
+                continue
+        raise RuntimeError(f"Conflicting updates to run {record.run_id}")
+
+    def put_step(self, record: StepRecord) -> None:
+        self.client.put_item(
+            TableName=self.table_name,
+            Item=self.encode(
+                {
+                    **record.dict(),
+                    "pk": f"run#{record.run_id}",
+                    "sk": f"step#{record.started_at:017.6f}#{record.span_id}",
+                }
+            ),
+        )
+
+    def steps(self, run_id: str) -> List[StepRecord]:
+        items = self.paginate(
+            KeyConditionExpression="pk = :pk AND begins_with(sk, :step)",
+            ExpressionAttributeValues={
+                ":pk": {"S": f"run#{run_id}"},
+                ":step": {"S": "step#"},
+            },
+        )
+        return [StepRecord(**self.decode(item)) for item in items]
+
+    def paginate(self, limit: Optional[int] = None, **params) -> List[Dict]:
+        items: List[Dict] = []
+        while True:
+            response = self.client.query(TableName=self.table_name, **params)
+            items.extend(response.get("Items", []))
+            if "LastEvaluatedKey" not in response or (
+                limit is not None and len(items) >= limit
+            ):
+                return items
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def query(
+        self,
+        pipeline: Optional[str] = None,
+        status: Optional[RunStatus] = None,
+        key_prefix: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 100,
+    ) -> List[RunRecord]:
+        if pipeline is None:
+            raise ValueError("DynamoDB history queries need a pipeline")
+        since = since if since is not None else 0
+        until = until if until is not None else time.time() + 1
+        if key_prefix and status is None:
+            # without a status, the key prefix is the narrower range
+            queries: List[Dict[str, Any]] = [
+                {
+                    "IndexName": "by_key",
+                    "KeyConditionExpression": "pipeline = :pipeline AND begins_with(input_key, :prefix)",
+                    "FilterExpression": "started_at BETWEEN :since AND :until",
+                    "ExpressionAttributeValues": {
+                        ":pipeline": {"S": pipeline},
+                        ":prefix": {"S": key_prefix},
+                        ":since": {"N": repr(since)},
+                        ":until": {"N": repr(until)},
+                    },
+                }
+            ]
+        else:
+            # a query per status, as each partitions the index
+            statuses = [RunStatus(status)] if status is not None else list(RunStatus)
+            queries = []
+            for s in statuses:
+                values = {
+                    ":partition": {"S": f"{pipeline}#{s.value}"},
+                    ":since": {"N": repr(since)},
+                    ":until": {"N": repr(until)},
+                }
+                query = {
+                    "IndexName": "by_status",
+                    "KeyConditionExpression": "pipeline_status = :partition AND started_at BETWEEN :since AND :until",
+                    "ScanIndexForward": False,
+                    "ExpressionAttributeValues": values,
+                }
+                if key_prefix:
+                    query["FilterExpression"] = "begins_with(input_key, :prefix)"
+                    values[":prefix"] = {"S": key_prefix}
+                queries.append(query)
+        runs = [
+            RunRecord(**self.decode(item))
+            for query in queries
+            for item in self.paginate(limit=limit, **query)
+        ]
+        runs.sort(key=lambda run: run.started_at, reverse=True)
+        return runs[:limit]
+
+
+def input_key(input: Any) -> Optional[str]:
+    """The key (or id) of an input which starts a run, if it has one"""
+    for name in ("key", "id"):
+        value = getattr(input, name, None)
+        if isinstance(value, str):
+            return value
+    return None
+
+
+def span_status(span: Span) -> RunStatus:
+    if "error" in span.attributes:
+        return RunStatus.failed
+    return RunStatus(span.attributes.get("run_end", RunStatus.running))
+
+
+class HistoryExporter(SpanExporter):
+    """
+    Records runs and steps from spans. Spans of the kind "step" write a
+    step record; every span updates the record of its run, except
+    trigger spans of batches, which have no key: their runs are recorded
+    by the steps which continue them, or, for batches of objects, by the
+    run each object starts.
+    Spans without a pipeline, such as those of functions deployed without
+    one, are ignored.
+    """
+
+    def __init__(self, store: HistoryStore):
+        self.store = store
+
+    def export(self, span: Span) -> None:
+        pipeline = span.attributes.get("pipeline")
+        if pipeline is None:
+            return
+        status = span_status(span)
+        end = span.end or time.time()
+        if span.attributes.get("kind") == "step":
+            self.store.put_step(
+                StepRecord(
+                    run_id=span.trace_id,
+                    span_id=span.span_id,
+                    pipeline=pipeline,
+                    step=span.name,
+                    # steps complete, even when their run continues
+                    status=RunStatus.failed
+                    if status == RunStatus.failed
+                    else RunStatus.succeeded,
+                    started_at=span.start,
+                    ended_at=end,
+                    input_bytes=span.attributes.get("input_bytes"),
+                    output_bytes=span.attributes.get("output_bytes"),
+                    error=span.attributes.get("error"),
+                )
+            )
+        if span.attributes.get("kind") == "trigger" and "key" not in span.attributes:
+            return
+        self.store.put_run(
+            RunRecord(
+                run_id=span.trace_id,
+                pipeline=pipeline,
+                status=status,
+                input_key=span.attributes.get("key"),
+                started_at=span.started_at,
+                updated_at=end,
+                ended_at=end if status in FINAL_STATUSES else None,
+                error=span.attributes.get("error"),
+            )
+        )
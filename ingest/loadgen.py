@@ -0,0 +1,463 @@
+"""
+Synthetic load for a pipeline, driven through its real trigger handlers.
+
+Trigger events are generated at a configured rate and passed to the S3 or
+SQS trigger handler, running against in-process stand-ins for Step
+Functions and SQS. The executions the handlers start are run through the
+local runner. Unlike the Simulator, which models a deployed pipeline,
+this exercises the framework's own code and the pipeline's steps.
+"""
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote_plus
+from uuid import uuid4
+
+from pydantic import BaseModel
+
+from ingest.data_types import S3Object
+from ingest.packing import unpack_body
+from ingest.resources import use_pool
+from ingest.simulator import Arrivals, Constant, Distribution, percentile
+from ingest.storage import LOCAL_STORAGE_ROOT_ENV
+from ingest.stubs import SQSStub, StepFunctionsStub, StubResourcePool
+from ingest.trigger import S3Trigger, SQSTrigger
+
+logger = logging.getLogger(__name__)
+
+TRIGGERS_DIR = Path(__file__).parent / "stack" / "constructs" / "triggers"
+STATE_MACHINE_ARN = "arn:aws:states:us-east-1:123456789012:stateMachine:loadgen"
+# Lambda retries failed asynchronous invocations twice
+ASYNC_RETRIES = 2
+
+
+def load_handler(name: str) -> Any:
+    """Load a trigger handler module without importing the CDK constructs
+    its package lives in. Each load has its own module state."""
+    path = TRIGGERS_DIR / name / "handler" / "handler.py"
+    spec = importlib.util.spec_from_file_location(f"loadgen_{uuid4().hex}", path)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"Can't load the {name} handler from {path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@contextmanager
+def environ(variables: Dict[str, str]) -> Iterator[None]:
+    saved = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+class LoadStepFunctions(StepFunctionsStub):
+    """Hands each started execution to the load generator to run"""
+
+    def __init__(self, executions: "queue.Queue", **kwargs):
+        super().__init__(**kwargs)
+        self.started = executions
+        self._lock = threading.Lock()
+
+    def start_execution(self, stateMachineArn: str, name: str, input: str) -> Dict:
+        with self._lock:
+            response = super().start_execution(stateMachineArn, name, input)
+            self.started.put(self.executions[-1])
+        return response
+
+
+class LoadReport(BaseModel):
+    # trigger handler invocations
+    invocations: int
+    executions: int
+    items: int
+    items_completed: int
+    results: int
+    errors: int
+    seconds: float
+    offered_rate: float
+    throughput: float
+    latency_p50: Optional[float]
+    latency_p90: Optional[float]
+    latency_p99: Optional[float]
+    latency_max: Optional[float]
+    handler_latency_p50: Optional[float]
+    handler_latency_p99: Optional[float]
+    # StartExecution calls rejected by the Step Functions stand-in
+    throttled_starts: int
+    # trigger handler invocations which raised, and were retried
+    failed_invocations: int
+    # events dropped once their invocation's retries were exhausted
+    dropped_events: int
+    # SQS records returned to the queue by backpressure
+    deferred_records: int
+
+    def format(self) -> str:
+        lines = [
+            f"{self.items} items in {self.invocations} invocations over {self.seconds:.1f}s "
+            f"(offered {self.offered_rate:.1f} items/s)",
+            f"{self.items_completed} completed ({self.throughput:.1f} items/s) "
+            f"in {self.executions} executions, {self.results} results, "
+            f"{self.errors} errors",
+        ]
+        if self.latency_p50 is not None:
+            lines.append(
+                f"latency p50 {self.latency_p50:.3f}s  p90 {self.latency_p90:.3f}s  "
+                f"p99 {self.latency_p99:.3f}s  max {self.latency_max:.3f}s"
+            )
+        lines.append(
+            f"throttled starts {self.throttled_starts}, failed invocations "
+            f"{self.failed_invocations}, dropped events {self.dropped_events}, "
+            f"deferred records {self.deferred_records}"
+        )
+        return "\n".join(lines)
+
+
+class LoadGenerator:
+    """
+    Generates trigger events for a pipeline in real time.
+
+    - S3 triggers receive a notification per object, with objects of
+      sizes drawn from `sizes` written to a local bucket directory that
+      steps read through `S3Object.open`. Failed invocations are retried
+      as Lambda retries asynchronous invocations.
+    - Buffered S3 triggers and SQS triggers receive batches of queue
+      records, formed with the trigger's batch size and batching window.
+      SQS trigger messages carry `items`, cycled through in order.
+      Records deferred by backpressure are redelivered after
+      `redelivery_delay`.
+
+    Up to `concurrency` handler invocations run at once, or the trigger's
+    `max_concurrency`. Step Functions throttling is injected with
+    `max_starts_per_second`. As in `ingest bench`, an item is complete
+    once the runner has processed it, including when it is buffered by a
+    collector.
+    """
+
+    def __init__(
+        self,
+        pipeline: Any,
+        arrivals: Arrivals,
+        sizes: Distribution = Constant(1024),
+        items: Sequence[Any] = (),
+        concurrency: int = 10,
+        max_starts_per_second: Optional[int] = None,
+        redelivery_delay: float = 1.0,
+        tick: float = 0.005,
+        seed: Optional[int] = None,
+    ):
+        trigger = pipeline.trigger
+        if isinstance(trigger, SQSTrigger):
+            if not items:
+                raise ValueError("Loading an SQS trigger requires sample items")
+        elif not isinstance(trigger, S3Trigger):
+            raise ValueError(
+                f"Can't generate load for a {type(trigger).__name__}, "
+                "see ingest.simulator for other triggers"
+            )
+        self.pipeline = pipeline
+        self.arrivals = arrivals
+        self.sizes = sizes
+        self.items = list(items)
+        self.concurrency = concurrency
+        self.max_starts_per_second = max_starts_per_second
+        self.redelivery_delay = redelivery_delay
+        self.tick = tick
+        self.rng = random.Random(seed)
+
+    @property
+    def trigger(self) -> Any:
+        return self.pipeline.trigger
+
+    @property
+    def batched(self) -> bool:
+        """Whether events reach the trigger through a queue"""
+        return isinstance(self.trigger, SQSTrigger) or bool(self.trigger.buffer)
+
+    def batch_settings(self) -> Tuple[int, float, Optional[int]]:
+        settings = getattr(self.trigger, "buffer", None) or self.trigger
+        return (
+            settings.batch_size,
+            settings.max_batching_window,
+            settings.max_concurrency,
+        )
+
+    def handler_environment(self) -> Dict[str, str]:
+        variables = {"STATE_MACHINE_ARN": STATE_MACHINE_ARN}
+        if not self.batched:
+            return variables
+        settings = getattr(self.trigger, "buffer", None) or self.trigger
+        variables.update(
+            QUEUE_NAME=getattr(settings, "queue_name", "s3_buffer"),
+            QUEUE_URL="loadgen",
+            INPUT_FORMAT="records"
+            if isinstance(self.trigger, SQSTrigger)
+            else "s3_objects",
+        )
+        if settings.max_running_executions:
+            variables["MAX_RUNNING_EXECUTIONS"] = str(settings.max_running_executions)
+        if getattr(settings, "partition_by", None):
+            variables["PARTITION_BY"] = settings.partition_by
+        return variables
+
+    def run(self, duration: float, drain: float = 60) -> LoadReport:
+        """
+        Generate events for `duration` seconds, then wait up to `drain`
+        seconds for the pipeline to process them.
+        """
+        from ingest.runner import LocalRunner
+
+        self.reset()
+        times = list(self.arrivals.times(self.rng, duration))
+        handler = load_handler("sqs_trigger" if self.batched else "s3_trigger")
+        batch_size, window, max_concurrency = (
+            self.batch_settings() if self.batched else (1, 0, None)
+        )
+        workers = min(self.concurrency, max_concurrency or self.concurrency)
+        with tempfile.TemporaryDirectory() as root, environ(
+            {LOCAL_STORAGE_ROOT_ENV: root, **self.handler_environment()}
+        ), ThreadPoolExecutor(max_workers=workers) as pool, LocalRunner(
+            self.pipeline, on_result=self.record_result
+        ) as runner:
+            self.root = Path(root)
+            executor = threading.Thread(target=self.run_executions, args=(runner,))
+            executor.start()
+            self.started_at = time.perf_counter()
+            i = 0
+            while True:
+                now = self.elapsed()
+                while i < len(times) and times[i] <= now:
+                    self.arrive(i, times[i])
+                    i += 1
+                self.dispatch(pool, handler, now, batch_size, window, workers)
+                if i >= len(times) and self.idle():
+                    break
+                if now > duration + drain:
+                    logger.warning(
+                        "Load generation stopped before the pipeline drained"
+                    )
+                    break
+                time.sleep(self.tick)
+            self.executions.put(None)
+            executor.join()
+        seconds = self.elapsed()
+        return self.report(len(times), duration, seconds)
+
+    def reset(self) -> None:
+        self.executions: "queue.Queue" = queue.Queue()
+        self.sfn = LoadStepFunctions(
+            self.executions, max_starts_per_second=self.max_starts_per_second
+        )
+        self.sqs = SQSStub()
+        self.resources = StubResourcePool({"stepfunctions": self.sfn, "sqs": self.sqs})
+        self.lock = threading.Lock()
+        # arrival time of each item, by key or message id
+        self.arrived: Dict[str, float] = {}
+        # (visible at, event or record, attempt)
+        self.pending: List[Tuple[float, Any, int]] = []
+        self.in_flight: List[Future] = []
+        self.running_items = 0
+        self.invocations = 0
+        self.latencies: List[float] = []
+        self.handler_latencies: List[float] = []
+        self.results = 0
+        self.errors = 0
+        self.failed_invocations = 0
+        self.dropped_events = 0
+        self.deferred_records = 0
+        self.item_cycle = itertools.cycle(self.items) if self.items else None
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def arrive(self, i: int, arrived_at: float) -> None:
+        if isinstance(self.trigger, SQSTrigger):
+            # SQS triggers are required to have sample items
+            assert self.item_cycle is not None
+            item = next(self.item_cycle)
+            body = item.json() if isinstance(item, BaseModel) else json.dumps(item)
+            message = {"messageId": str(i), "receiptHandle": str(i), "body": body}
+            self.arrived[str(i)] = arrived_at
+            self.pending.append((arrived_at, message, 0))
+            return
+        key = self.object_key(i)
+        self.write_object(key, int(self.sizes.sample(self.rng)))
+        self.arrived[key] = arrived_at
+        event = {
+            "Records": [
+                {
+                    "eventName": "ObjectCreated:Put",
+                    "s3": {
+                        "bucket": {"name": self.trigger.bucket_name},
+                        "object": {"key": quote_plus(key)},
+                    },
+                }
+            ]
+        }
+        if self.batched:
+            message = {
+                "messageId": key,
+                "receiptHandle": key,
+                "body": json.dumps(event),
+            }
+            self.pending.append((arrived_at, message, 0))
+        else:
+            self.pending.append((arrived_at, event, 0))
+
+    def object_key(self, i: int) -> str:
+        object_filter = self.trigger.object_filter
+        return (
+            f"{object_filter.prefix or ''}loadgen/{i:08d}{object_filter.suffix or ''}"
+        )
+
+    def write_object(self, key: str, size: int) -> None:
+        path = self.root / self.trigger.bucket_name / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"0" * size)
+
+    def dispatch(
+        self,
+        pool: ThreadPoolExecutor,
+        handler: Any,
+        now: float,
+        batch_size: int,
+        window: float,
+        workers: int,
+    ) -> None:
+        """Invoke the handler with the events which are due, as an SQS event
+        source would for queued records"""
+        self.in_flight = [f for f in self.in_flight if not f.done()]
+        with self.lock:
+            self.pending.sort(key=lambda entry: entry[0])
+            visible = sum(1 for entry in self.pending if entry[0] <= now)
+            while visible and len(self.in_flight) < workers:
+                if (
+                    self.batched
+                    and visible < batch_size
+                    and now < self.pending[0][0] + window
+                ):
+                    return
+                size = min(batch_size, visible)
+                batch, self.pending = self.pending[:size], self.pending[size:]
+                visible -= size
+                self.invocations += 1
+                self.in_flight.append(pool.submit(self.invoke, handler, batch))
+
+    def invoke(self, handler: Any, batch: List[Tuple[float, Any, int]]) -> None:
+        event = (
+            {"Records": [entry[1] for entry in batch]} if self.batched else batch[0][1]
+        )
+        start = time.perf_counter()
+        try:
+            with use_pool(self.resources):
+                response = handler.handler(event, None)
+        except Exception:
+            logger.debug("Trigger handler failed", exc_info=True)
+            with self.lock:
+                self.failed_invocations += 1
+                retry_at = self.elapsed() + self.redelivery_delay
+                for _, message, attempt in batch:
+                    if attempt < ASYNC_RETRIES or self.batched:
+                        self.pending.append((retry_at, message, attempt + 1))
+                    else:
+                        self.dropped_events += 1
+            return
+        finally:
+            with self.lock:
+                self.handler_latencies.append(time.perf_counter() - start)
+        if self.batched:
+            failed = {f["itemIdentifier"] for f in response["batchItemFailures"]}
+            with self.lock:
+                self.deferred_records += len(failed)
+                retry_at = self.elapsed() + self.redelivery_delay
+                for _, message, attempt in batch:
+                    if message["messageId"] in failed:
+                        self.pending.append((retry_at, message, attempt + 1))
+
+    def idle(self) -> bool:
+        with self.lock:
+            pending = bool(self.pending)
+        return (
+            not pending
+            and all(f.done() for f in self.in_flight)
+            and self.executions.unfinished_tasks == 0
+        )
+
+    def execution_items(self, input: Dict) -> List[Tuple[str, Any]]:
+        """The items an execution carries, with the id of each"""
+        if "Records" in input:
+            output_type = self.trigger.output_type
+            return [
+                (record["messageId"], output_type.parse_obj(item))
+                for record in input["Records"]
+                for item in unpack_body(record["body"])
+            ]
+        objects = input["objects"] if "objects" in input else [input]
+        return [(o["key"], S3Object.parse_obj(o)) for o in objects]
+
+    def run_executions(self, runner: Any) -> None:
+        """Run each started execution's items through the local runner"""
+        while True:
+            execution = self.executions.get()
+            if execution is None:
+                self.executions.task_done()
+                return
+            for id, item in self.execution_items(execution["input"]):
+                try:
+                    result = runner.process(item)
+                except Exception:
+                    logger.debug("Item failed", exc_info=True)
+                    with self.lock:
+                        self.errors += 1
+                    continue
+                with self.lock:
+                    if result is not None:
+                        self.results += 1
+                    self.latencies.append(self.elapsed() - self.arrived[id])
+            execution["status"] = "SUCCEEDED"
+            self.executions.task_done()
+
+    def record_result(self, result: Any) -> None:
+        with self.lock:
+            self.results += 1
+
+    def report(self, items: int, duration: float, seconds: float) -> LoadReport:
+        completed = len(self.latencies)
+        return LoadReport(
+            invocations=self.invocations,
+            executions=len(self.sfn.executions),
+            items=items,
+            items_completed=completed,
+            results=self.results,
+            errors=self.errors,
+            seconds=seconds,
+            offered_rate=items / duration if duration else 0,
+            throughput=completed / seconds if seconds else 0,
+            latency_p50=percentile(self.latencies, 0.5),
+            latency_p90=percentile(self.latencies, 0.9),
+            latency_p99=percentile(self.latencies, 0.99),
+            latency_max=max(self.latencies, default=None),
+            handler_latency_p50=percentile(self.handler_latencies, 0.5),
+            handler_latency_p99=percentile(self.handler_latencies, 0.99),
+            throttled_starts=self.sfn.throttled,
+            failed_invocations=self.failed_invocations,
+            dropped_events=self.dropped_events,
+            deferred_records=self.deferred_records,
+        )
@@ -0,0 +1,175 @@
+"""
+Structured logging for steps and framework handlers.
+
+Records are written as JSON lines. Payloads (events, inputs, outputs) are
+only serialized when a record is actually emitted, are truncated, and
+are logged at DEBUG, or at INFO for a sampled share of invocations, so
+that large batches don't pay for logging they don't need.
+
+Configured through the environment:
+
+- INGEST_LOG_LEVEL: level of the framework's loggers (default INFO)
+- INGEST_STEP_LOG_LEVELS: per-step levels, e.g. "S3ToStac=DEBUG,Publish=WARNING",
+  taking precedence over a step's `log_level`
+- INGEST_LOG_SAMPLE_RATE: share of invocations whose payloads are logged
+  at INFO (default 0)
+- INGEST_LOG_MAX_PAYLOAD: characters of a payload logged (default 2000)
+"""
+import json
+import logging
+import os
+import random
+import sys
+import threading
+from typing import Any, Dict, Mapping, Optional
+
+from pydantic import BaseModel
+
+ROOT_LOGGER = "ingest"
+
+# attributes of every LogRecord, anything else was passed as `extra`
+STANDARD_ATTRIBUTES = set(
+    vars(logging.LogRecord("", 0, "", 0, "", (), None)).keys()
+) | {"message", "asctime"}
+
+
+class LogConfig(BaseModel):
+    level: str = "INFO"
+    step_levels: Dict[str, str] = {}
+    payload_sample_rate: float = 0.0
+    max_payload_chars: int = 2000
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str]) -> "LogConfig":
+        step_levels = {}
+        for entry in environ.get("INGEST_STEP_LOG_LEVELS", "").split(","):
+            if "=" in entry:
+                name, level = entry.split("=", 1)
+                step_levels[name.strip()] = level.strip().upper()
+        return cls(
+            level=environ.get("INGEST_LOG_LEVEL", "INFO").upper(),
+            step_levels=step_levels,
+            payload_sample_rate=float(environ.get("INGEST_LOG_SAMPLE_RATE", 0)),
+            max_payload_chars=int(environ.get("INGEST_LOG_MAX_PAYLOAD", 2000)),
+        )
+
+
+def truncate(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}... ({len(text) - max_chars} more characters)"
+
+
+class Payload:
+    """A value to log, serialized and truncated only if the record is
+    emitted"""
+
+    def __init__(self, value: Any, max_chars: Optional[int] = None):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        max_chars = self.max_chars or get_config().max_payload_chars
+        if isinstance(self.value, BaseModel):
+            text = self.value.json()
+        else:
+            try:
+                text = json.dumps(self.value, default=str)
+            except (TypeError, ValueError):
+                text = repr(self.value)
+        return truncate(text, max_chars)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "timestamp": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in STANDARD_ATTRIBUTES and not name.startswith("_"):
+                entry[name] = str(value) if isinstance(value, Payload) else value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class StdoutHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is when a record is emitted"""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.stream = sys.stdout
+        super().emit(record)
+
+    def flush(self) -> None:
+        self.stream = sys.stdout
+        super().flush()
+
+
+_config: Optional[LogConfig] = None
+_lock = threading.Lock()
+
+
+def get_config() -> LogConfig:
+    config = _config
+    if config is None:
+        config = configure_logging()
+    return config
+
+
+def configure_logging(
+    config: Optional[LogConfig] = None, stream: Any = None
+) -> LogConfig:
+    """Write the framework's logs as JSON lines. Reads the configuration
+    from the environment unless one is given."""
+    global _config
+    with _lock:
+        _config = config or LogConfig.from_env(os.environ)
+        logger = logging.getLogger(ROOT_LOGGER)
+        for handler in list(logger.handlers):
+            if isinstance(handler.formatter, JsonFormatter):
+                logger.removeHandler(handler)
+        handler = logging.StreamHandler(stream) if stream else StdoutHandler()
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        # Lambda's root handler would log every record a second time
+        logger.propagate = False
+        logger.setLevel(_config.level)
+        return _config
+
+
+def step_logger(step: Any) -> logging.Logger:
+    """The logger of a step, at the level configured for it"""
+    name = step.__name__
+    logger = logging.getLogger(f"{ROOT_LOGGER}.steps.{name}")
+    level = get_config().step_levels.get(name) or getattr(step, "log_level", None)
+    if level:
+        logger.setLevel(level)
+    return logger
+
+
+def log_invocation(step: Any, event: Any, context: Any, records: Optional[int] = None):
+    """Log a step's invocation in Lambda. Its event is logged at DEBUG,
+    or at INFO for a sampled share of invocations."""
+    logger = step_logger(step)
+    extra: Dict[str, Any] = {"step": step.__name__}
+    request_id = getattr(context, "aws_request_id", None)
+    if request_id:
+        extra["request_id"] = request_id
+    if records is not None:
+        extra["records"] = records
+    sampled = random.random() < get_config().payload_sample_rate
+    level = logging.INFO if sampled else logging.DEBUG
+    if logger.isEnabledFor(level):
+        logger.log(
+            level,
+            "Invoked",
+            extra={**extra, "payload": Payload(event), "sampled": sampled},
+        )
+    elif logger.isEnabledFor(logging.INFO):
+        logger.info("Invoked", extra=extra)
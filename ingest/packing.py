@@ -0,0 +1,116 @@
+"""
+Packing of several items into one SQS message.
+
+A packed message body is an envelope holding a list of items, optionally
+gzipped and base64 encoded, so that collectors receive many items per
+message. Unpacked messages hold a single item, as before, and collectors
+read either.
+"""
+import base64
+import gzip
+import json
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from ingest.partitioning import partition_key
+
+# SQS limits messages to 256KB, leaving room for attributes
+MAX_MESSAGE_BYTES = 250_000
+# packed messages are kept well within the 256KB limit on Step Functions
+# execution inputs, so that an execution started with a batch of records
+# holds several
+MAX_PACKED_BYTES = 100_000
+PACKED_KEY = "ingest_packed"
+
+
+class MessageTooLarge(ValueError):
+    pass
+
+
+def encode(items: Sequence[Any], compress: bool, partition: Optional[str]) -> str:
+    envelope: Dict[str, Any] = {PACKED_KEY: 1}
+    if partition is not None:
+        envelope["partition"] = partition
+    if compress:
+        data = gzip.compress(json.dumps(items).encode())
+        envelope["gzip"] = base64.b64encode(data).decode()
+    else:
+        envelope["items"] = list(items)
+    return json.dumps(envelope)
+
+
+def pack_chunk(
+    items: Sequence[Any], compress: bool, partition: Optional[str], max_bytes: int
+) -> Iterator[str]:
+    """Encode items into as few messages as fit, halving chunks which
+    don't. Items are sized individually, so only compression can leave a
+    chunk too large."""
+    body = encode(items, compress, partition)
+    if len(body) <= max_bytes:
+        yield body
+    elif len(items) == 1:
+        raise MessageTooLarge(f"An item of {len(body)} bytes can't fit in a message")
+    else:
+        middle = len(items) // 2
+        yield from pack_chunk(items[:middle], compress, partition, max_bytes)
+        yield from pack_chunk(items[middle:], compress, partition, max_bytes)
+
+
+def pack_items(
+    items: Sequence[Any],
+    compress: bool = False,
+    partition_by: Optional[str] = None,
+    max_bytes: int = MAX_PACKED_BYTES,
+) -> List[str]:
+    """
+    Message bodies holding the (JSON serializable) items, each within
+    `max_bytes`. With `partition_by`, each message only holds items of one
+    partition. Compressed messages are filled with up to ten times their
+    limit of uncompressed items before being split.
+    """
+    groups: Dict[Optional[str], List[Any]] = {}
+    for item in items:
+        key = partition_key(item, partition_by) if partition_by else None
+        groups.setdefault(key, []).append(item)
+    bodies: List[str] = []
+    for partition, group in groups.items():
+        if compress:
+            budget = max_bytes * 10
+        else:
+            budget = max_bytes - len(encode([], compress, partition))
+        chunk: List[Any] = []
+        size = 0
+        for item in group:
+            item_size = len(json.dumps(item)) + 2
+            if chunk and size + item_size > budget:
+                bodies.extend(pack_chunk(chunk, compress, partition, max_bytes))
+                chunk, size = [], 0
+            chunk.append(item)
+            size += item_size
+        if chunk:
+            bodies.extend(pack_chunk(chunk, compress, partition, max_bytes))
+    return bodies
+
+
+def is_packed(message: Any) -> bool:
+    return isinstance(message, dict) and PACKED_KEY in message
+
+
+def unpack_message(message: Any) -> List[Any]:
+    """The items of a decoded message body, packed or not"""
+    if not is_packed(message):
+        return [message]
+    if "gzip" in message:
+        return json.loads(gzip.decompress(base64.b64decode(message["gzip"])))
+    return message["items"]
+
+
+def unpack_body(body: str) -> List[Any]:
+    return unpack_message(json.loads(body))
+
+
+def message_partition_key(message: Any, path: str) -> str:
+    """The partition key of a decoded message body. Packed messages only
+    hold items of one partition."""
+    if is_packed(message):
+        return message["partition"]
+    return partition_key(message, path)
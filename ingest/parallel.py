@@ -0,0 +1,83 @@
+from typing import Iterator, Optional, Sequence, Type
+
+from ingest.registry import types_compatible
+from ingest.step import Join, Step, is_collector
+
+
+class Parallel:
+    """
+    Runs several branches of steps on the same input, in parallel.
+
+    The first step of every branch receives the output of the preceding
+    step. Without a `join` step, the branches run for their side effects
+    and the input passes through unchanged to the following step. With a
+    `join`, the outputs of the branches are passed to it as a list, and
+    its output continues down the pipeline.
+
+    Branches may not contain Collectors.
+    """
+
+    branches: Sequence[Sequence[Type[Step]]]
+    join: Optional[Type[Join]]
+    retry: Sequence = []
+    catch: Sequence = []
+
+    def __init__(
+        self,
+        branches: Sequence[Sequence[Type[Step]]],
+        join: Optional[Type[Join]] = None,
+    ):
+        if len(branches) < 2:
+            raise ValueError("Parallel requires at least two branches")
+        if any(len(branch) == 0 for branch in branches):
+            raise ValueError("Parallel branches must contain at least one step")
+        self.branches = branches
+        self.join = join
+        self.validate()
+
+    @property
+    def __name__(self) -> str:
+        return f"Parallel{len(self.branches)}"
+
+    def iter_steps(self) -> Iterator[Type[Step]]:
+        """All steps within the branches, and the join"""
+        for branch in self.branches:
+            for step in branch:
+                if isinstance(step, Parallel):
+                    yield from step.iter_steps()
+                else:
+                    yield step
+        if self.join:
+            yield self.join
+
+    def get_input(self):
+        return self.branches[0][0].get_input()
+
+    def get_output(self):
+        return self.join.get_output() if self.join else self.get_input()
+
+    def validate(self):
+        """Ensure that the types of every edge in the branches match"""
+        input_type = self.get_input()
+        for b, branch in enumerate(self.branches):
+            if not types_compatible(input_type, branch[0].get_input()):
+                raise TypeError(
+                    f"Input of branch {b} ({branch[0].get_input()}) is not compatible with input of branch 0 ({input_type})"
+                )
+            for i, step in enumerate(branch):
+                if is_collector(step):
+                    raise TypeError(
+                        f"Branch {b} contains a Collector ({step.__name__})"
+                    )
+                if i < len(branch) - 1 and not types_compatible(
+                    step.get_output(), branch[i + 1].get_input()
+                ):
+                    raise TypeError(
+                        f"Output of step {i} in branch {b} ({step.get_output()}) is not compatible with input of step {i+1} ({branch[i + 1].get_input()})"
+                    )
+            if self.join and not types_compatible(
+                branch[-1].get_output(), self.join.get_input()
+            ):
+                raise TypeError(
+                    f"Output of branch {b} ({branch[-1].get_output()}) is not compatible with input of join ({self.join.get_input()})"
+                )
@@ -0,0 +1,23 @@
+import zlib
+from typing import Any
+
+from pydantic import BaseModel
+
+
+def partition_key(value: Any, path: str) -> str:
+    """
+    Resolve a dotted field path (e.g. "properties.collection") against a
+    model or its serialized form. Models are resolved through their
+    serialized (aliased) form, so that the same path gives the same key
+    locally and against a queued message body.
+    """
+    if isinstance(value, BaseModel):
+        value = value.dict(by_alias=True)
+    for part in path.split("."):
+        value = value[part]
+    return str(value)
+
+
+def shard_for(key: str, shards: int) -> int:
+    """Stable assignment of a partition key to one of `shards` shards"""
+    return zlib.crc32(key.encode()) % shards
@@ -1,10 +1,12 @@
 from pathlib import Path
-from typing import Any, Sequence, Type
+from typing import Any, Iterator, List, Optional, Sequence, Type, Union
 from uuid import uuid4
 from pydantic import UUID4
 
 
-from ingest.step import Collector, Step
+from ingest.parallel import Parallel
+from ingest.registry import types_compatible
+from ingest.step import Collector, Step, is_collector, step_resources
 from ingest.trigger import Trigger
 
 
@@ -20,34 +22,87 @@ class Pipeline:
 
     uuid: str
     name: str
-    steps: Sequence[Type[Step]]
+    steps: Sequence[Union[Type[Step], Step, Parallel]]
     trigger: Trigger
 
-    def __init__(self, name: str, trigger: Trigger, steps: Sequence[Type[Step]]):
+    def __init__(
+        self,
+        name: str,
+        trigger: Trigger,
+        steps: Sequence[Union[Type[Step], Step, Parallel]],
+        rate_limit_table: Optional[str] = None,
+        history_table: Union[bool, str] = False,
+    ):
         self.uuid = "testuuid"  # uuid4()
         self.name = name
         self.trigger = trigger
         self.steps = steps
+        # The DynamoDB table deployed steps share their rate limits through.
+        # A table is created for pipelines with rate limited steps, unless
+        # the name of an existing one is given.
+        self.rate_limit_table = rate_limit_table
+        # Record the history of deployed runs in a DynamoDB table: True
+        # creates one, or give the name of an existing table.
+        self.history_table = history_table
+        self._runner = None
+        # results of batches flushed by the runner's timer, until closed
+        self._flushed: List[Any] = []
+        # set when the pipeline is added to an IngestApp
+        self.app: Optional[Any] = None
         self.validate()
 
     def run(self, input):
+        """Run an input through the pipeline locally. Batches which are
+        flushed once their window expires, rather than by an input, have
+        their results returned by `close`."""
+        from ingest.runner import LocalRunner
+
+        if self._runner is None:
+            self._runner = LocalRunner(self, on_result=self._flushed.append)
+        return self._runner.run(input)
+
+    def close(self) -> List[Any]:
+        """Flush the batches still buffered by `run`. Returns the results
+        of every batch flushed without an input since the last close."""
+        if self._runner is not None:
+            self._runner.close()
+            self._runner = None
+        results, self._flushed = self._flushed, []
+        return results
+
+    def profile(self, inputs: Sequence[Any], profiler: Optional[Any] = None):
+        """Run a sample of inputs through the pipeline locally, recording
+        the resource usage of each step. Returns a report recommending a
+        memory size for each step."""
+        from ingest.profiling import StepProfiler
+        from ingest.runner import LocalRunner
+
+        profiler = profiler or StepProfiler()
+        with profiler, LocalRunner(self, profiler=profiler) as runner:
+            runner.run_all(inputs)
+        return profiler.report()
+
+    def iter_steps(self) -> Iterator[Union[Type[Step], Step]]:
+        """All steps in the pipeline, including those within Parallel
+        branches and fallback steps"""
         for step in self.steps:
-            if isinstance(step, Collector):
-                step.collect_input(input)
-                if step.ready():
-                    step.execute(input=step.fetch_batch())
-                else:
-                    return input
-            else:
-                input = step.execute(input)
-        return input
+            nested = step.iter_steps() if isinstance(step, Parallel) else [step]
+            for nested_step in nested:
+                yield nested_step
+                for catcher in nested_step.catch:
+                    if catcher.fallback:
+                        yield catcher.fallback
+
+    @property
+    def rate_limited(self) -> bool:
+        return any(step_resources(step)["rate_limit"] for step in self.iter_steps())
 
     def validate(self):
         """Ensure that each step passes the correct data type
         to the following step."""
-        if self.trigger.output_type != self.steps[0].get_input():
+        if not types_compatible(self.trigger.output_type, self.steps[0].get_input()):
             raise TypeError(
-                f"Output of trigger ({self.trigger.output_type} is not equal to input of first step ({self.steps[0].get_input()})"
+                f"Output of trigger ({self.trigger.output_type} is not compatible with input of first step ({self.steps[0].get_input()})"
             )
 
         # check output of each step against input of the following step
@@ -55,12 +110,50 @@ class Pipeline:
         while i < len(self.steps) - 1:
             output_type = self.steps[i].get_output()
             input_type = self.steps[i + 1].get_input()
-            if output_type != input_type:
+            if not types_compatible(output_type, input_type):
                 raise TypeError(
-                    f"Output of step {i} ({output_type} is not equal to input of step {i+1} ({input_type})"
+                    f"Output of step {i} ({output_type} is not compatible with input of step {i+1} ({input_type})"
                 )
             i += 1
 
+        collectors = [
+            (i, step, step_resources(step))
+            for i, step in enumerate(self.steps)
+            if is_collector(step)
+        ]
+        # partition keys must name a field of the collector's input
+        for i, step, config in collectors:
+            if config["partition_by"]:
+                field = config["partition_by"].split(".")[0]
+                aliases = {f.alias for f in step.get_input().__fields__.values()}
+                if field not in aliases:
+                    raise TypeError(
+                        f"Partition key {config['partition_by']} of step {i} is not a field of {step.get_input()}"
+                    )
+
+        # the native SQS integration sends each item to a single queue
+        for i, step, config in collectors:
+            if not config["native_send"]:
+                continue
+            if config["partition_by"] and config["partition_shards"] > 1:
+                raise ValueError(
+                    f"Step {i} can't use native_send with several partition shards"
+                )
+            if config["pack_messages"] or config["compress_messages"]:
+                raise ValueError(f"Step {i} can't use native_send with packing")
+
+        # fallback steps stand in for the step they catch errors from
+        for i, step in enumerate(self.steps):
+            for catcher in step.catch:
+                fallback = catcher.fallback
+                if fallback and (
+                    not types_compatible(step.get_input(), fallback.get_input())
+                    or not types_compatible(fallback.get_output(), step.get_output())
+                ):
+                    raise TypeError(
+                        f"Fallback {fallback.__name__} of step {i} must accept the step's input and produce its output type"
+                    )
+
     def create_stack(self, app: Any, code_dir: Path, requirements_path: Path):
         from ingest.stack.pipeline_stack import PipelineStack
 
@@ -75,4 +168,6 @@ class Pipeline:
 
     @property
     def resource_name(self):
-        return self.name.replace(" ", "_")
+        from ingest.stack.naming import pipeline_resource_name
+
+        return pipeline_resource_name(self.name)
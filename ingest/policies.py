@@ -0,0 +1,95 @@
+import random
+import time
+from typing import Any, Callable, Optional, Sequence
+
+from pydantic import BaseModel
+
+# Step Functions error names which match any error raised by a step
+CATCH_ALL_ERRORS = {"States.ALL", "States.TaskFailed"}
+
+
+def matches_error(errors: Sequence[str], error: BaseException) -> bool:
+    """Mirror Step Functions error matching, where a Lambda error
+    is named after the class of the exception it raised."""
+    return bool(CATCH_ALL_ERRORS.intersection(errors)) or (
+        type(error).__name__ in errors
+    )
+
+
+class RetryPolicy(BaseModel):
+    """
+    Retry a step in place when it raises one of `errors`.
+
+    As in Step Functions, `max_attempts` is the number of retries
+    after the initial attempt, and the delay before retry n is
+    `interval * backoff_rate ** (n - 1)` seconds.
+    """
+
+    errors: Sequence[str] = ["States.ALL"]
+    interval: int = 1
+    backoff_rate: float = 2.0
+    max_attempts: int = 3
+    # randomise each delay between 0 and its computed value
+    jitter: bool = False
+    max_delay: Optional[int] = None
+
+    def matches(self, error: BaseException) -> bool:
+        return matches_error(self.errors, error)
+
+    def delay(self, attempt: int) -> float:
+        delay = self.interval * self.backoff_rate ** (attempt - 1)
+        if self.max_delay is not None:
+            delay = min(delay, self.max_delay)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+
+class CatchPolicy(BaseModel):
+    """
+    Route a step's failure, once retries are exhausted.
+
+    When a `fallback` step is provided it receives the failed step's
+    input, and its output continues down the pipeline in place of the
+    failed step's output. It must therefore have the same input and
+    output types as the step it replaces. Without a fallback the
+    item is discarded and the run ends successfully.
+    """
+
+    errors: Sequence[str] = ["States.ALL"]
+    # a step class or instance
+    fallback: Optional[Any] = None
+
+    def matches(self, error: BaseException) -> bool:
+        return matches_error(self.errors, error)
+
+
+def run_with_policies(
+    step: Any,
+    input: Any,
+    execute: Optional[Callable[[Any], Any]] = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> Any:
+    """
+    Execute a step locally, honouring its retry and catch policies.
+    Returns None when a catch policy discards the item.
+    """
+    execute = execute or step.invoke
+    attempts = {id(policy): 0 for policy in step.retry}
+    while True:
+        try:
+            return execute(input)
+        except Exception as e:
+            # as in Step Functions, the first matching retrier applies
+            policy = next((p for p in step.retry if p.matches(e)), None)
+            if policy is not None and attempts[id(policy)] < policy.max_attempts:
+                attempts[id(policy)] += 1
+                sleep(policy.delay(attempts[id(policy)]))
+                continue
+
+            catcher = next((c for c in step.catch if c.matches(e)), None)
+            if catcher is None:
+                raise
+            if catcher.fallback is None:
+                return None
+            return run_with_policies(catcher.fallback, input, sleep=sleep)
@@ -0,0 +1,199 @@
+import math
+import resource
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from pydantic import BaseModel
+
+from ingest.result_cache import canonical_json
+
+MB = 1024 * 1024
+# Lambda memory is configurable between these bounds
+MIN_MEMORY_MB = 128
+MAX_MEMORY_MB = 10240
+MEMORY_INCREMENT_MB = 64
+
+
+def rss_high_water_mark() -> int:
+    """Peak resident set size of this process, in bytes"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and kilobytes elsewhere
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class Sample(NamedTuple):
+    input_bytes: int
+    # peak Python heap allocated while the step ran
+    peak_bytes: int
+    # growth of the process RSS high-water mark while the step ran, which
+    # captures native allocations that tracemalloc can't see
+    rss_growth_bytes: int
+    wall_seconds: float
+    cpu_seconds: float
+
+
+class StepReport(BaseModel):
+    step: str
+    samples: int
+    max_input_bytes: int
+    max_peak_mb: float
+    max_rss_growth_mb: float
+    mean_wall_seconds: float
+    max_wall_seconds: float
+    mean_cpu_seconds: float
+    configured_memory_mb: Optional[int]
+    recommended_memory_mb: int
+    # peak memory correlates with input size, so larger inputs than
+    # those sampled may need more memory than recommended
+    grows_with_input: bool
+
+
+class ProfileReport(BaseModel):
+    steps: List[StepReport]
+
+    def format(self) -> str:
+        rows = [
+            (
+                "step",
+                "samples",
+                "peak MB",
+                "wall s",
+                "cpu s",
+                "configured MB",
+                "recommended MB",
+                "",
+            )
+        ]
+        for s in self.steps:
+            rows.append(
+                (
+                    s.step,
+                    str(s.samples),
+                    f"{max(s.max_peak_mb, s.max_rss_growth_mb):.1f}",
+                    f"{s.mean_wall_seconds:.3f}",
+                    f"{s.mean_cpu_seconds:.3f}",
+                    str(s.configured_memory_mb or "-"),
+                    str(s.recommended_memory_mb),
+                    "grows with input" if s.grows_with_input else "",
+                )
+            )
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        return "\n".join(
+            "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+            for row in rows
+        )
+
+
+class StepProfiler:
+    """
+    Records the peak memory, wall time and CPU time of each step execution
+    in a local run, and recommends a Lambda memory size per step.
+
+    Memory is measured for the whole process, so steps running concurrently
+    (such as the branches of a Parallel step) inflate each other's peaks.
+    """
+
+    def __init__(
+        self,
+        headroom: float = 1.5,
+        runtime_overhead_mb: int = 64,
+        growth_correlation: float = 0.8,
+    ):
+        self.headroom = headroom
+        # memory used by the Lambda runtime and imported modules
+        self.runtime_overhead_mb = runtime_overhead_mb
+        self.growth_correlation = growth_correlation
+        self.samples: Dict[str, List[Sample]] = defaultdict(list)
+        self.configured: Dict[str, Optional[int]] = {}
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    def __enter__(self) -> "StepProfiler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self) -> None:
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def measure(self, step: Any, input: Any, execute: Callable[[Any], Any]) -> Any:
+        """Execute a step on an input, recording its resource usage"""
+        self.start()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        rss = rss_high_water_mark()
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            return execute(input)
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            _, peak = tracemalloc.get_traced_memory()
+            sample = Sample(
+                input_bytes=len(canonical_json(input)),
+                peak_bytes=max(peak - current, 0),
+                rss_growth_bytes=rss_high_water_mark() - rss,
+                wall_seconds=wall,
+                cpu_seconds=cpu,
+            )
+            with self._lock:
+                self.samples[step.__name__].append(sample)
+                self.configured[step.__name__] = getattr(step, "memory_size", None)
+
+    def recommend(self, samples: List[Sample]) -> int:
+        peak = max(max(s.peak_bytes, s.rss_growth_bytes) for s in samples) / MB
+        memory = self.runtime_overhead_mb + peak * self.headroom
+        memory = math.ceil(memory / MEMORY_INCREMENT_MB) * MEMORY_INCREMENT_MB
+        return min(max(memory, MIN_MEMORY_MB), MAX_MEMORY_MB)
+
+    def grows_with_input(self, samples: List[Sample]) -> bool:
+        sizes = [s.input_bytes for s in samples]
+        peaks = [max(s.peak_bytes, s.rss_growth_bytes) for s in samples]
+        if len(samples) < 3 or len(set(sizes)) < 2 or len(set(peaks)) < 2:
+            return False
+        mean_size, mean_peak = statistics.mean(sizes), statistics.mean(peaks)
+        covariance = sum(
+            (x - mean_size) * (y - mean_peak) for x, y in zip(sizes, peaks)
+        )
+        correlation = covariance / math.sqrt(
+            sum((x - mean_size) ** 2 for x in sizes)
+            * sum((y - mean_peak) ** 2 for y in peaks)
+        )
+        # ignore noise in steps whose memory use barely changes
+        varies = max(peaks) >= 1.25 * min(peaks)
+        return varies and correlation >= self.growth_correlation
+
+    def report(self) -> ProfileReport:
+        with self._lock:
+            samples = {step: list(s) for step, s in self.samples.items()}
+        return ProfileReport(
+            steps=[
+                StepReport(
+                    step=step,
+                    samples=len(s),
+                    max_input_bytes=max(x.input_bytes for x in s),
+                    max_peak_mb=max(x.peak_bytes for x in s) / MB,
+                    max_rss_growth_mb=max(x.rss_growth_bytes for x in s) / MB,
+                    mean_wall_seconds=statistics.mean(x.wall_seconds for x in s),
+                    max_wall_seconds=max(x.wall_seconds for x in s),
+                    mean_cpu_seconds=statistics.mean(x.cpu_seconds for x in s),
+                    configured_memory_mb=self.configured[step],
+                    recommended_memory_mb=self.recommend(s),
+                    grows_with_input=self.grows_with_input(s),
+                )
+                for step, s in samples.items()
+            ]
+        )
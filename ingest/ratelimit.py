@@ -0,0 +1,387 @@
+"""
+Rate limits on the executions of steps which call fragile downstreams.
+
+A step's `rate_limit` bounds the rate at which it executes (a token
+bucket), and how many of its executions run at once, across every
+concurrent invocation which shares the limit's backend. Deployed steps
+share a DynamoDB table, named by INGEST_RATE_LIMIT_TABLE, which the
+pipeline's stack creates (or is given, as the pipeline's
+`rate_limit_table`); without one, limits only apply within a process, as
+in local runs.
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Protocol, Tuple, Union
+from uuid import uuid4
+
+from pydantic import BaseModel, Field
+
+RATE_LIMIT_TABLE_ENV = "INGEST_RATE_LIMIT_TABLE"
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a step waits longer than its limit's `max_wait`, so that
+    retry policies can back off"""
+
+
+class RateLimitBackend(Protocol):
+    def take(self, key: str, rate: float, burst: int, now: float) -> float:
+        """Take a token from a bucket. Returns 0 if one was taken, or how
+        many seconds until one is available."""
+        ...
+
+    def acquire_slot(
+        self, key: str, limit: int, lease_seconds: float, now: float
+    ) -> Optional[str]:
+        """Hold one of `limit` slots, until released or until the lease
+        expires. Returns the holder's token, or None if every slot is held."""
+        ...
+
+    def release_slot(self, key: str, token: str) -> None:
+        ...
+
+
+def refill(
+    tokens: float, updated: float, rate: float, burst: int, now: float
+) -> Tuple[float, float]:
+    """Take a token from a bucket, returning its remaining tokens and the
+    seconds to wait, which are 0 if a token was taken"""
+    tokens = min(float(burst), tokens + max(now - updated, 0) * rate)
+    # tolerate rounding, or a caller which slept for exactly the wait
+    # could be told to wait an instant longer, forever
+    if tokens >= 1 - 1e-9:
+        return max(tokens - 1, 0.0), 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """Limits shared by the threads of one process"""
+
+    def __init__(self):
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        self.slots: Dict[str, Dict[int, Tuple[str, float]]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> float:
+        with self._lock:
+            tokens, updated = self.buckets.get(key, (float(burst), now))
+            tokens, wait = refill(tokens, updated, rate, burst, now)
+            self.buckets[key] = (tokens, now)
+            return wait
+
+    def acquire_slot(
+        self, key: str, limit: int, lease_seconds: float, now: float
+    ) -> Optional[str]:
+        with self._lock:
+            slots = self.slots.setdefault(key, {})
+            for slot in range(limit):
+                held = slots.get(slot)
+                if held is None or held[1] <= now:
+                    token = f"{slot}:{uuid4().hex}"
+                    slots[slot] = (token, now + lease_seconds)
+                    return token
+            return None
+
+    def release_slot(self, key: str, token: str) -> None:
+        slot = int(token.split(":")[0])
+        with self._lock:
+            slots = self.slots.get(key, {})
+            if slots.get(slot, (None,))[0] == token:
+                del slots[slot]
+
+
+class SQLiteRateLimitBackend(RateLimitBackend):
+    """Limits shared by the processes using one SQLite file, a local
+    stand-in for a shared backend"""
+
+    def __init__(self, path: Union[Path, str], timeout: float = 30):
+        self._conn = sqlite3.connect(
+            str(path), timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY, tokens REAL, updated REAL
+            );
+            CREATE TABLE IF NOT EXISTS slots (
+                key TEXT, slot INTEGER, token TEXT, expires_at REAL,
+                PRIMARY KEY (key, slot)
+            );
+            """
+        )
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        # IMMEDIATE takes the write lock up front, so that concurrent
+        # processes serialize rather than deadlock
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> float:
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE key=?", (key,)
+            ).fetchone()
+            tokens, updated = row if row else (float(burst), now)
+            tokens, wait = refill(tokens, updated, rate, burst, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (key, tokens, now)
+            )
+            return wait
+
+    def acquire_slot(
+        self, key: str, limit: int, lease_seconds: float, now: float
+    ) -> Optional[str]:
+        with self.transaction() as conn:
+            held = {
+                slot
+                for (slot,) in conn.execute(
+                    "SELECT slot FROM slots WHERE key=? AND expires_at > ?",
+                    (key, now),
+                )
+            }
+            free = next((slot for slot in range(limit) if slot not in held), None)
+            if free is None:
+                return None
+            token = f"{free}:{uuid4().hex}"
+            conn.execute(
+                "INSERT OR REPLACE INTO slots VALUES (?, ?, ?, ?)",
+                (key, free, token, now + lease_seconds),
+            )
+            return token
+
+    def release_slot(self, key: str, token: str) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                "DELETE FROM slots WHERE key=? AND slot=? AND token=?",
+                (key, int(token.split(":")[0]), token),
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class DynamoDBRateLimitBackend(RateLimitBackend):
+    """
+    Limits shared through a DynamoDB table with a string partition key
+    `pk`. Buckets and slots are items updated conditionally, so concurrent
+    invocations never take the same token or slot. Slots are leased, so
+    that those held by invocations which time out are reclaimed.
+    """
+
+    def __init__(self, table_name: str, client: Any = None, attempts: int = 5):
+        self.table_name = table_name
+        self._client = client
+        self.attempts = attempts
+
+    @property
+    def client(self):
+        if self._client is None:
+            from ingest.resources import get_pool
+
+            self._client = get_pool().client("dynamodb")
+        return self._client
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> float:
+        pk = {"S": f"bucket#{key}"}
+        for _ in range(self.attempts):
+            item = self.client.get_item(
+                TableName=self.table_name, Key={"pk": pk}, ConsistentRead=True
+            ).get("Item")
+            if item:
+                tokens, updated = float(item["tokens"]["N"]), item["updated"]["N"]
+                condition = {
+                    "ConditionExpression": "updated = :updated",
+                    "ExpressionAttributeValues": {":updated": {"N": updated}},
+                }
+            else:
+                tokens, updated = float(burst), repr(now)
+                condition = {"ConditionExpression": "attribute_not_exists(pk)"}
+            tokens, wait = refill(tokens, float(updated), rate, burst, now)
+            if wait:
+                return wait
+            try:
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        "pk": pk,
+                        "tokens": {"N": repr(tokens)},
+                        "updated": {"N": repr(now)},
+                    },
+                    **condition,
+                )
+                return 0.0
+            except self.client.exceptions.ConditionalCheckFailedException:
+                # another invocation took a token meanwhile
+                continue
+        # contended, so back off as if the bucket were empty
+        return 1 / rate
+
+    def acquire_slot(
+        self, key: str, limit: int, lease_seconds: float, now: float
+    ) -> Optional[str]:
+        # start at a random slot, so that invocations don't all contend
+        # for the first
+        offset = random.randrange(limit)
+        for i in range(limit):
+            slot = (offset + i) % limit
+            token = f"{slot}:{uuid4().hex}"
+            try:
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        "pk": {"S": f"slot#{key}#{slot}"},
+                        "token": {"S": token},
+                        "expires_at": {"N": repr(now + lease_seconds)},
+                    },
+                    ConditionExpression="attribute_not_exists(pk) OR expires_at <= :now",
+                    ExpressionAttributeValues={":now": {"N": repr(now)}},
+                )
+                return token
+            except self.client.exceptions.ConditionalCheckFailedException:
+                continue
+        return None
+
+    def release_slot(self, key: str, token: str) -> None:
+        try:
+            self.client.delete_item(
+                TableName=self.table_name,
+                Key={"pk": {"S": f"slot#{key}#{token.split(':')[0]}"}},
+                ConditionExpression="#token = :token",
+                ExpressionAttributeNames={"#token": "token"},
+                ExpressionAttributeValues={":token": {"S": token}},
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            # the lease expired, and the slot was taken by another invocation
+            pass
+
+
+_default_backend: Optional[RateLimitBackend] = None
+_default_lock = threading.Lock()
+
+
+def default_backend() -> RateLimitBackend:
+    """The shared table when deployed with one, otherwise this process"""
+    global _default_backend
+    with _default_lock:
+        if _default_backend is None:
+            table = os.environ.get(RATE_LIMIT_TABLE_ENV)
+            _default_backend = (
+                DynamoDBRateLimitBackend(table) if table else MemoryRateLimitBackend()
+            )
+        return _default_backend
+
+
+class RateLimit(BaseModel):
+    """
+    Limit the executions of a step, across all of its concurrent
+    invocations. Each execution (of a single input, or of a collector's
+    batch) counts as one request.
+    """
+
+    # sustained executions per second, and how many may run back to back
+    per_second: Optional[float] = Field(None, gt=0)
+    burst: Optional[int] = Field(None, ge=1)
+    # executions running at once
+    max_in_flight: Optional[int] = Field(None, ge=1)
+    # steps with the same key share the limit, e.g. the downstream's name.
+    # Defaults to the step's name.
+    key: Optional[str] = None
+    # how long an execution waits to be admitted before RateLimitExceeded
+    # is raised
+    max_wait: float = 60
+    # how long a slot is held by an execution that never releases it
+    lease_seconds: float = 900
+    # defaults to default_backend()
+    backend: Optional[Any] = None
+
+    @property
+    def bucket_size(self) -> int:
+        return self.burst or max(1, int(self.per_second or 1))
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        limit: RateLimit,
+        key: str,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.limit = limit
+        self.key = limit.key or key
+        self.backend: RateLimitBackend = limit.backend or default_backend()
+        self.sleep = sleep
+        self.clock = clock
+
+    def wait(self, seconds: float, deadline: float) -> None:
+        if self.clock() + seconds > deadline:
+            raise RateLimitExceeded(
+                f"Waited over {self.limit.max_wait}s for the {self.key} rate limit"
+            )
+        self.sleep(seconds)
+
+    def acquire_slot(self, max_in_flight: int, deadline: float) -> str:
+        delay = 0.05
+        while True:
+            token = self.backend.acquire_slot(
+                self.key,
+                max_in_flight,
+                self.limit.lease_seconds,
+                self.clock(),
+            )
+            if token is not None:
+                return token
+            # polled with jittered backoff, as slots free up unannounced
+            self.wait(random.uniform(delay / 2, delay), deadline)
+            delay = min(delay * 2, 1.0)
+
+    def take(self, per_second: float, deadline: float) -> None:
+        while True:
+            wait = self.backend.take(
+                self.key, per_second, self.limit.bucket_size, self.clock()
+            )
+            if not wait:
+                return
+            self.wait(wait, deadline)
+
+    @contextmanager
+    def acquire(self) -> Iterator[None]:
+        """Wait until an execution is admitted, holding an in-flight slot
+        while it runs"""
+        deadline = self.clock() + self.limit.max_wait
+        token = None
+        if self.limit.max_in_flight:
+            token = self.acquire_slot(self.limit.max_in_flight, deadline)
+        try:
+            if self.limit.per_second:
+                self.take(self.limit.per_second, deadline)
+            yield
+        finally:
+            if token is not None:
+                self.backend.release_slot(self.key, token)
+
+
+def rate_limited(step: Any, execute: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    """Wrap a step's execution in its rate limit, if it has one"""
+    if step.rate_limit is None:
+        return execute
+    limiter = RateLimiter(step.rate_limit, key=step.__name__)
+
+    def limited(input: Any) -> Any:
+        with limiter.acquire():
+            return execute(input)
+
+    return limited
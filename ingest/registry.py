@@ -0,0 +1,144 @@
+import hashlib
+import inspect
+import json
+import threading
+from enum import Enum
+from typing import Any, Dict, Iterator, Optional, Tuple, Type, TypeVar, get_args
+
+from pydantic import BaseModel
+
+
+class StepKind(Enum):
+    transformer = "transformer"
+    collector = "collector"
+    join = "join"
+
+
+class StepMetadata(BaseModel):
+    name: str
+    qualname: str
+    module: str
+    input_type: Any
+    output_type: Any
+    kind: StepKind
+    # the configuration attributes the step is deployed with, such as its
+    # permissions, memory size and batching, see ingest.step.step_resources
+    resources: Dict[str, Any]
+    # changes when the step's identity, version or data types change
+    version_hash: str
+    # whether `execute` takes a StepContext as its `context` argument
+    accepts_context: bool = False
+
+    @property
+    def identity(self) -> str:
+        return f"{self.module}.{self.qualname}"
+
+
+def get_base(cls):
+    """Utility for retrieving the base class"""
+    if hasattr(cls, "__orig_bases__"):
+        return get_base(cls.__orig_bases__[0])
+    else:
+        return cls
+
+
+def resolve_types(step: Type) -> Optional[Tuple[Any, Any]]:
+    """The input and output types of a step, or None for generic
+    base classes whose types are not yet bound"""
+    args = get_args(get_base(step))
+    if len(args) != 2 or any(isinstance(arg, TypeVar) for arg in args):
+        return None
+    return args[0], args[1]
+
+
+def type_schema(type_: Any) -> Any:
+    if isinstance(type_, type) and issubclass(type_, BaseModel):
+        try:
+            return type_.schema()
+        except Exception:
+            # e.g. models with unresolved forward references
+            pass
+    return repr(type_)
+
+
+def version_hash(step: Type, input_type: Any, output_type: Any) -> str:
+    description = {
+        "identity": f"{step.__module__}.{step.__qualname__}",
+        "version": getattr(step, "version", None),
+        "input": type_schema(input_type),
+        "output": type_schema(output_type),
+    }
+    return hashlib.sha256(
+        json.dumps(description, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def accepts_context(step: Type) -> bool:
+    try:
+        return "context" in inspect.signature(step.execute).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def types_compatible(provided: Any, expected: Any) -> bool:
+    """Whether a value of the provided type may be passed where the expected
+    type is required. Subclasses of the expected type are accepted."""
+    if provided == expected:
+        return True
+    return (
+        isinstance(provided, type)
+        and isinstance(expected, type)
+        and issubclass(provided, expected)
+    )
+
+
+class StepRegistry:
+    """
+    Metadata of every concrete step, resolved once when the step's class is
+    defined rather than each time it is needed.
+    """
+
+    def __init__(self):
+        self._steps: Dict[Type, StepMetadata] = {}
+        self._lock = threading.Lock()
+
+    def register(
+        self, step: Type, kind: StepKind, resources: Dict[str, Any]
+    ) -> Optional[StepMetadata]:
+        types = resolve_types(step)
+        if types is None:
+            return None
+        input_type, output_type = types
+        metadata = StepMetadata(
+            name=step.__name__,
+            qualname=step.__qualname__,
+            module=step.__module__,
+            input_type=input_type,
+            output_type=output_type,
+            kind=kind,
+            resources=resources,
+            version_hash=version_hash(step, input_type, output_type),
+            accepts_context=accepts_context(step),
+        )
+        with self._lock:
+            self._steps[step] = metadata
+        return metadata
+
+    def get(self, step: Type) -> Optional[StepMetadata]:
+        return self._steps.get(step)
+
+    def find(self, identity: str) -> Type:
+        """Look up a step by its module and qualified name"""
+        for step, metadata in self._steps.items():
+            if metadata.identity == identity:
+                return step
+        raise KeyError(f"No step registered as {identity}")
+
+    def __contains__(self, step: Type) -> bool:
+        return step in self._steps
+
+    def __iter__(self) -> Iterator[StepMetadata]:
+        return iter(list(self._steps.values()))
+
+
+registry = StepRegistry()
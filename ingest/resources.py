@@ -0,0 +1,135 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+
+class ResourcePool:
+    """
+    Clients and connection pools shared by everything running in a process.
+
+    boto3 clients are created once per service and configuration, with
+    enough pooled connections for concurrent use and TCP keep-alive, so
+    that warm invocations and parallel requests reuse open connections
+    rather than paying for a TLS handshake each time. Other resources,
+    such as database pools, are registered with a factory and created on
+    first use.
+    """
+
+    def __init__(
+        self,
+        max_pool_connections: int = 50,
+        tcp_keepalive: bool = True,
+        region_name: Optional[str] = None,
+    ):
+        self.max_pool_connections = max_pool_connections
+        self.tcp_keepalive = tcp_keepalive
+        self.region_name = region_name
+        self._clients: Dict[Tuple, Any] = {}
+        self._session: Any = None
+        self._http: Any = None
+        self._factories: Dict[str, Tuple[Callable[[], Any], Optional[Callable]]] = {}
+        self._resources: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+
+    def config(self, **options):
+        from botocore.config import Config
+
+        options.setdefault("max_pool_connections", self.max_pool_connections)
+        # older versions of botocore don't support keep-alive
+        if "tcp_keepalive" in Config.OPTION_DEFAULTS:
+            options.setdefault("tcp_keepalive", self.tcp_keepalive)
+        return Config(**options)
+
+    def client(self, service: str, **options) -> Any:
+        """A boto3 client for a service. Options are passed to the client's
+        botocore Config, and clients with different options are kept apart."""
+        key = (service, repr(sorted(options.items())))
+        with self._lock:
+            if key not in self._clients:
+                if self._session is None:
+                    import boto3
+
+                    # sessions aren't thread safe, but the clients they create are
+                    self._session = boto3.session.Session(region_name=self.region_name)
+                self._clients[key] = self._session.client(
+                    service, config=self.config(**options)
+                )
+            return self._clients[key]
+
+    def http(self) -> Any:
+        """A urllib3 PoolManager, keeping connections to each host open"""
+        with self._lock:
+            if self._http is None:
+                import urllib3
+
+                self._http = urllib3.PoolManager(
+                    maxsize=self.max_pool_connections, block=False
+                )
+            return self._http
+
+    def register(
+        self,
+        name: str,
+        factory: Callable[[], Any],
+        close: Optional[Callable[[Any], None]] = None,
+    ) -> None:
+        """Register a resource, created by the factory on first use"""
+        with self._lock:
+            self._factories[name] = (factory, close)
+
+    def get(self, name: str) -> Any:
+        with self._lock:
+            if name not in self._resources:
+                if name not in self._factories:
+                    raise KeyError(f"No resource registered as {name}")
+                self._resources[name] = self._factories[name][0]()
+            return self._resources[name]
+
+    def close(self) -> None:
+        with self._lock:
+            for name, resource in self._resources.items():
+                close = self._factories[name][1]
+                if close:
+                    close(resource)
+            self._resources = {}
+            if self._http is not None:
+                self._http.clear()
+                self._http = None
+
+
+class StepContext:
+    """Passed to steps whose `execute` accepts a `context` argument"""
+
+    def __init__(
+        self, resources: Optional[ResourcePool] = None, lambda_context: Any = None
+    ):
+        self.resources = resources or get_pool()
+        # the Lambda context, when running in Lambda
+        self.lambda_context = lambda_context
+
+
+_pool: ContextVar[Optional[ResourcePool]] = ContextVar("resource_pool", default=None)
+_default_pool: Optional[ResourcePool] = None
+_default_lock = threading.Lock()
+
+
+def get_pool() -> ResourcePool:
+    """The resource pool in use, which defaults to one per process"""
+    global _default_pool
+    pool = _pool.get()
+    if pool is not None:
+        return pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = ResourcePool()
+        return _default_pool
+
+
+@contextmanager
+def use_pool(pool: ResourcePool) -> Iterator[ResourcePool]:
+    token = _pool.set(pool)
+    try:
+        yield pool
+    finally:
+        _pool.reset(token)
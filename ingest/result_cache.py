@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Protocol, Tuple
+
+from pydantic import BaseModel
+
+
+def canonical_json(value: Any) -> str:
+    """Serialize a model (or sequence of models) such that equal
+    values always produce identical output"""
+    if isinstance(value, BaseModel):
+        value = value.dict(by_alias=True)
+    elif isinstance(value, (list, tuple)):
+        value = [
+            v.dict(by_alias=True) if isinstance(v, BaseModel) else v for v in value
+        ]
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def input_digest(value: Any) -> str:
+    return hashlib.sha256(canonical_json(value).encode()).hexdigest()
+
+
+def result_key(step: Any, input: Any) -> str:
+    """Key a step's result by its identity, version, data types, parameters
+    and input"""
+    from ingest.step import step_metadata
+
+    identity = step_metadata(step).version_hash
+    if step.params():
+        identity = f"{identity}:{canonical_json(step.params())}"
+    return hashlib.sha256(f"{identity}:{canonical_json(input)}".encode()).hexdigest()
+
+
+class ResultCache(Protocol):
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    def set(self, key: str, value: str) -> None:
+        ...
+
+
+class MemoryResultCache(ResultCache):
+    """An in-process cache with LRU and TTL eviction"""
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[Optional[float], str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskResultCache(ResultCache):
+    """
+    A cache stored as one file per entry in a local directory, so that
+    results survive between local runs. Recency is tracked through file
+    modification times, which are refreshed on each hit.
+    """
+
+    def __init__(
+        self, directory: Path, max_entries: int = 10000, ttl: Optional[float] = None
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.path(key)
+        try:
+            entry = json.loads(path.read_text())
+        except FileNotFoundError:
+            return None
+        if entry["expires_at"] is not None and entry["expires_at"] <= time.time():
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)
+        return entry["value"]
+
+    def set(self, key: str, value: str) -> None:
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"expires_at": expires_at, "value": value}, f)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        entries = [
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(".json")
+        ]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[: len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+class KeyValueStore(Protocol):
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    def put(self, key: str, value: str, expires_at: Optional[int] = None) -> None:
+        ...
+
+
+class InMemoryKeyValueStore(KeyValueStore):
+    """A local stand-in for a shared key-value store"""
+
+    def __init__(self):
+        self.items: Dict[str, Tuple[Optional[int], str]] = {}
+
+    def get(self, key: str) -> Optional[str]:
+        expires_at, value = self.items.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self.items[key]
+            return None
+        return value
+
+    def put(self, key: str, value: str, expires_at: Optional[int] = None) -> None:
+        self.items[key] = (expires_at, value)
+
+
+class DynamoDBKeyValueStore(KeyValueStore):
+    """
+    Stores entries in a DynamoDB table with a string partition key `key`.
+    Expiry is delegated to the table's TTL, which should be enabled on the
+    `expires_at` attribute.
+    """
+
+    def __init__(self, table_name: str, client: Any = None):
+        self.table_name = table_name
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from ingest.resources import get_pool
+
+            self._client = get_pool().client("dynamodb")
+        return self._client
+
+    def get(self, key: str) -> Optional[str]:
+        item = self.client.get_item(
+            TableName=self.table_name, Key={"key": {"S": key}}
+        ).get("Item")
+        if not item:
+            return None
+        # TTL deletion is lazy, so check expiry here too
+        if "expires_at" in item and int(item["expires_at"]["N"]) <= time.time():
+            return None
+        return item["value"]["S"]
+
+    def put(self, key: str, value: str, expires_at: Optional[int] = None) -> None:
+        item = {"key": {"S": key}, "value": {"S": value}}
+        if expires_at is not None:
+            item["expires_at"] = {"N": str(expires_at)}
+        self.client.put_item(TableName=self.table_name, Item=item)
+
+
+class KeyValueResultCache(ResultCache):
+    """Adapts a shared key-value store, so results can be reused
+    across Lambda containers"""
+
+    def __init__(self, store: KeyValueStore, ttl: Optional[int] = None):
+        self.store = store
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[str]:
+        return self.store.get(key)
+
+    def set(self, key: str, value: str) -> None:
+        expires_at = int(time.time()) + self.ttl if self.ttl is not None else None
+        self.store.put(key, value, expires_at=expires_at)
+
+
+# used by cacheable steps which don't configure their own cache
+default_cache = MemoryResultCache()
+
+
+def cached_execute(step: Any, input: Any, execute: Callable[[Any], Any]) -> Any:
+    """Execute a step, skipping execution when the step is cacheable
+    and a result for the same input is already cached"""
+    if not step.cacheable:
+        return execute(input)
+    cache = step.result_cache or default_cache
+    key = result_key(step, input)
+    cached = cache.get(key)
+    if cached is not None:
+        return step.get_output().parse_raw(cached)
+    result = execute(input)
+    if result is not None:
+        cache.set(key, result.json(by_alias=True))
+    return result
@@ -0,0 +1,483 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from contextvars import copy_context
+from datetime import datetime
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from ingest.batching import BatchController
+from ingest.cache import BatchCache
+from ingest.checkpoint import CheckpointStore
+from ingest.emit import LocalEmitter, use_emitter
+from ingest.resources import ResourcePool, use_pool
+from ingest.policies import run_with_policies
+from ingest.profiling import StepProfiler
+from ingest.result_cache import input_digest
+from ingest.parallel import Parallel
+from ingest.step import is_collector
+from ingest.history import RunStatus, input_key
+from ingest.tracing import (
+    TraceContext,
+    Tracer,
+    batch_attributes,
+    current_context,
+    get_tracer,
+    payload_bytes,
+    use_tracer,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def serialize(output: Any) -> str:
+    return "null" if output is None else output.json(by_alias=True)
+
+
+def deserialize(step: Any, output: str) -> Any:
+    return None if output == "null" else step.get_output().parse_raw(output)
+
+
+class Buffered(NamedTuple):
+    """Returned in place of a result when an input waits in a collector"""
+
+    input: Any
+
+
+def unwrap(result: Any) -> Any:
+    return result.input if isinstance(result, Buffered) else result
+
+
+def run_status(result: Any) -> RunStatus:
+    if isinstance(result, Buffered):
+        return RunStatus.collected
+    return RunStatus.discarded if result is None else RunStatus.succeeded
+
+
+class FlushScheduler:
+    """
+    Fires a callback when collector batching windows expire, using a
+    single timer heap shared by every collector. The timer thread is
+    started when the first deadline is scheduled, and outlives callbacks
+    which fail (they are logged).
+    """
+
+    def __init__(self, callback: Callable[[Any], None]):
+        self.callback = callback
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def schedule(self, deadline: float, target: Any) -> None:
+        with self._condition:
+            if self._closed:
+                return
+            heapq.heappush(self._heap, (deadline, next(self._counter), target))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _loop(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed and (
+                    not self._heap or self._heap[0][0] > time.time()
+                ):
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._condition.wait(timeout=timeout)
+                if self._closed:
+                    return
+                _, _, target = heapq.heappop(self._heap)
+            try:
+                self.callback(target)
+            except Exception:
+                logger.exception("Failed to flush %s", target)
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+
+class LocalRunner:
+    """
+    Runs a pipeline in-process, one input at a time.
+
+    Collector steps buffer their inputs until a batch is ready. A batch
+    is ready when it is full, or once its oldest item has waited for the
+    collector's `max_batching_window`, even if no further input arrives.
+    Batches flushed by the timer (or when the runner is closed) have
+    their results passed to `on_result`.
+
+    With a
+    checkpoint store, the output of every step and the contents of every
+    collector buffer are persisted, keyed by the identity of the input
+    that produced them. A new runner over the same store then skips any
+    work already done and restores partially filled batches.
+
+    Collectors with `adaptive_batching` have their batch size and window
+    chosen by a `BatchController`, from their arrivals, the depth of their
+    buffers and the duration of their executions.
+
+    With a profiler, the resource usage of every step execution is recorded.
+
+    With a tracer, each input starts a trace with a span per step. Each
+    collector batch starts a trace of its own, linked to the traces of its
+    items, with the time they spent buffered. A tracer exporting to a
+    `HistoryExporter` records the history of the runs.
+
+    Each step's `setup` hook runs before the runner first executes a step,
+    and its `teardown` hook when the runner is closed.
+    """
+
+    def __init__(
+        self,
+        pipeline: Any,
+        checkpoint: Optional[CheckpointStore] = None,
+        on_result: Optional[Callable[[Any], None]] = None,
+        profiler: Optional[StepProfiler] = None,
+        resources: Optional[ResourcePool] = None,
+        tracer: Optional[Tracer] = None,
+    ):
+        self.pipeline = pipeline
+        self.checkpoint = checkpoint
+        self.on_result = on_result
+        self.profiler = profiler
+        self.resources = resources
+        self.tracer = tracer
+        # trace contexts of buffered items, by key
+        self.trace_contexts: Dict[str, TraceContext] = {}
+        # one buffer per partition of each collector
+        self.buffers: Dict[int, Dict[Optional[str], BatchCache]] = {
+            i: defaultdict(BatchCache)
+            for i, step in enumerate(pipeline.steps)
+            if is_collector(step)
+        }
+        self.controllers: Dict[int, BatchController] = {
+            i: BatchController(step.adaptive_batching)
+            for i, step in enumerate(pipeline.steps)
+            if is_collector(step) and step.adaptive_batching
+        }
+        # guards the buffers, which the flush timer also drains
+        self.lock = threading.RLock()
+        self.scheduler = FlushScheduler(self.flush_expired)
+        self._setup_lock = threading.Lock()
+        self._emitter: Optional[LocalEmitter] = None
+        self._set_up: Optional[List[Any]] = None
+        if checkpoint:
+            self.restore(checkpoint)
+
+    def __enter__(self) -> "LocalRunner":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def steps(self) -> Sequence[Any]:
+        return self.pipeline.steps
+
+    def restore(self, checkpoint: CheckpointStore) -> None:
+        """Refill collector buffers from the checkpoint store"""
+        for i, buffers in self.buffers.items():
+            step = self.steps[i]
+            for key, item, queued_at in checkpoint.buffered(self.pipeline.name, i):
+                input = step.get_input().parse_raw(item)
+                buffers[step.partition_key(input)].queue_data(
+                    (key, input), queued_at=datetime.fromtimestamp(queued_at)
+                )
+            for partition in buffers:
+                self.schedule_flush(i, partition)
+
+    def resume(self) -> List[Any]:
+        """Complete the downstream steps of any batches which were
+        executed before the previous run was interrupted"""
+        if not self.checkpoint:
+            return []
+        results = []
+        for i, batch_key, output in self.checkpoint.incomplete_batches(
+            self.pipeline.name
+        ):
+            output = deserialize(self.steps[i], output)
+            if output is not None:
+                results.append(unwrap(self.run_from(i + 1, output, batch_key)))
+            self.checkpoint.complete_batch(self.pipeline.name, i, batch_key)
+        return results
+
+    def run(self, input: Any) -> Any:
+        """
+        Run an input through the pipeline. Returns the output of the final
+        step, the input itself if it is waiting in a collector's buffer, or
+        None if it was discarded.
+        """
+        return unwrap(self.submit(input))
+
+    def process(self, input: Any) -> Optional[Any]:
+        """Run an input through the pipeline, returning the output of the
+        final step, or None if the input was buffered or discarded"""
+        result = self.submit(input)
+        return None if isinstance(result, Buffered) else result
+
+    def submit(self, input: Any) -> Any:
+        with self.lock, self.scope():
+            with get_tracer().span(
+                "run",
+                root=True,
+                kind="run",
+                pipeline=self.pipeline.name,
+                key=input_key(input),
+            ) as span:
+                result = self.run_from(0, input, input_digest(input))
+                if span is not None:
+                    span.attributes["run_end"] = run_status(result).value
+                return result
+
+    @contextmanager
+    def scope(self) -> Iterator[None]:
+        """Steps emitting to other pipelines in the app run them in-process,
+        and steps share the runner's resource pool if it has one"""
+        app = self.pipeline.app
+        if self._emitter is None:
+            self._emitter = LocalEmitter(app.pipelines if app else [self.pipeline])
+        with ExitStack() as stack:
+            stack.enter_context(use_emitter(self._emitter))
+            if self.resources:
+                stack.enter_context(use_pool(self.resources))
+            if self.tracer:
+                stack.enter_context(use_tracer(self.tracer))
+            yield
+
+    def run_all(self, inputs: Sequence[Any]) -> List[Any]:
+        return [self.run(input) for input in inputs]
+
+    def run_from(self, start: int, input: Any, key: str) -> Any:
+        for i in range(start, len(self.steps)):
+            step = self.steps[i]
+            if i in self.buffers:
+                partition = step.partition_key(input)
+                if not self.collect(i, input, key) or not self.ready(i, partition):
+                    return Buffered(input)
+                return self.flush(i, partition)
+            input = self.execute(i, input, key)
+            if input is None:
+                # discarded by a catch policy
+                return None
+        return input
+
+    def execute(self, i: int, input: Any, key: str) -> Any:
+        step = self.steps[i]
+        if self.checkpoint:
+            output = self.checkpoint.get_output(self.pipeline.name, i, key)
+            if output is not None:
+                return deserialize(step, output)
+        output = self.run_step(step, input)
+        if self.checkpoint:
+            self.checkpoint.put_output(self.pipeline.name, i, key, serialize(output))
+        return output
+
+    def run_step(self, step: Any, input: Any) -> Any:
+        if isinstance(step, Parallel):
+            return self.run_parallel(step, input)
+        return self.invoke(step, input)
+
+    def setup(self) -> None:
+        """Set up every step in the pipeline, once"""
+        with self._setup_lock:
+            if self._set_up is not None:
+                return
+            self._set_up = []
+            for step in self.pipeline.iter_steps():
+                if not any(step is other for other in self._set_up):
+                    step.setup()
+                    self._set_up.append(step)
+
+    def teardown(self) -> None:
+        with self._setup_lock:
+            for step in reversed(self._set_up or []):
+                step.teardown()
+            self._set_up = None
+
+    def invoke(self, step: Any, input: Any) -> Any:
+        self.setup()
+        execute = None
+        if self.profiler:
+            execute = lambda i: self.profiler.measure(step, i, step.invoke)
+        with get_tracer().span(
+            step.__name__, kind="step", pipeline=self.pipeline.name
+        ) as span:
+            output = run_with_policies(step, input, execute=execute)
+            if span is not None:
+                span.attributes["input_bytes"] = payload_bytes(input)
+                span.attributes["output_bytes"] = payload_bytes(output)
+            return output
+
+    def run_branch(self, branch: Sequence[Any], input: Any) -> Any:
+        for step in branch:
+            input = self.run_step(step, input)
+            if input is None:
+                return None
+        return input
+
+    def run_parallel(self, step: Parallel, input: Any) -> Any:
+        """Run each branch concurrently on the same input, then join"""
+        with ThreadPoolExecutor(max_workers=len(step.branches)) as executor:
+            futures = [
+                executor.submit(copy_context().run, self.run_branch, branch, input)
+                for branch in step.branches
+            ]
+            outputs = [future.result() for future in futures]
+        if step.join is None:
+            return input
+        # branches which discarded the item don't contribute to the join
+        return self.invoke(
+            step.join, [output for output in outputs if output is not None]
+        )
+
+    def collect(self, i: int, input: Any, key: str) -> bool:
+        """Buffer an input for a collector. Returns False if the input
+        had already been collected by a previous run."""
+        if self.checkpoint and not self.checkpoint.buffer(
+            self.pipeline.name, i, key, input.json(by_alias=True), time.time()
+        ):
+            return False
+        step = self.steps[i]
+        context = current_context()
+        if context is not None:
+            self.trace_contexts[key] = context.copy(update={"sent_at": time.time()})
+        partition = step.partition_key(input)
+        step.collect_input(self.buffers[i][partition], (key, input))
+        if i in self.controllers:
+            self.controllers[i].arrived()
+        if self.buffers[i][partition].queue_size == 1:
+            self.schedule_flush(i, partition)
+        return True
+
+    def batching_window(self, i: int) -> float:
+        if i in self.controllers:
+            return self.controllers[i].window
+        return self.steps[i].max_batching_window
+
+    def ready(self, i: int, partition: Optional[str]) -> bool:
+        """Whether a collector's buffer holds a batch ready to flush"""
+        buffer = self.buffers[i][partition]
+        controller = self.controllers.get(i)
+        if controller is None:
+            return self.steps[i].ready(buffer)
+        return buffer.queue_size > 0 and (
+            buffer.queue_size >= controller.batch_size
+            or buffer.time_since_first_item().total_seconds() >= controller.window
+        )
+
+    def fetch_batch(self, i: int, partition: Optional[str]) -> Sequence[Any]:
+        buffer = self.buffers[i][partition]
+        if i in self.controllers:
+            return buffer.fetch(self.controllers[i].batch_size)
+        return self.steps[i].fetch_batch(buffer)
+
+    def queue_size(self, i: int) -> int:
+        """Number of items buffered across all partitions of a collector"""
+        return sum(buffer.queue_size for buffer in self.buffers[i].values())
+
+    def schedule_flush(self, i: int, partition: Optional[str]) -> None:
+        """Schedule a flush for when the oldest buffered item's window expires"""
+        buffer = self.buffers[i][partition]
+        if buffer.queue_size:
+            self.scheduler.schedule(
+                buffer.first_queued_at().timestamp() + self.batching_window(i),
+                (i, partition),
+            )
+
+    def flush_expired(self, target: Tuple[int, Optional[str]]) -> None:
+        i, partition = target
+        with self.lock, self.scope():
+            buffer = self.buffers[i][partition]
+            if not buffer.queue_size:
+                return
+            if not self.ready(i, partition):
+                # the batch this deadline was set for has already been
+                # flushed, and its successor has a deadline of its own
+                return
+            result = self.flush(i, partition)
+        if result is not None and not isinstance(result, Buffered) and self.on_result:
+            self.on_result(result)
+
+    def close(self) -> List[Any]:
+        """Stop the flush timer and flush all partially filled batches,
+        in pipeline order, then close the pipelines steps emitted to.
+        Returns the results of the flushed batches."""
+        self.scheduler.close()
+        results = []
+        with self.lock, self.scope():
+            for i in sorted(self.buffers):
+                for partition, buffer in list(self.buffers[i].items()):
+                    while buffer.queue_size:
+                        result = self.flush(i, partition)
+                        # results buffered by a later collector are
+                        # flushed in turn
+                        if result is not None and not isinstance(result, Buffered):
+                            results.append(result)
+        if self._emitter:
+            # items emitted by the flushed batches are flushed in turn
+            self._emitter.close()
+        self.teardown()
+        if self.on_result:
+            for result in results:
+                self.on_result(result)
+        return results
+
+    def flush(self, i: int, partition: Optional[str] = None) -> Any:
+        """Execute a collector on a batch from one of its buffers and run
+        the result through the remaining steps"""
+        step = self.steps[i]
+        entries = self.fetch_batch(i, partition)
+        keys = [key for key, _ in entries]
+        batch_key = input_digest(keys)
+        contexts = [
+            self.trace_contexts.pop(key) for key in keys if key in self.trace_contexts
+        ]
+        with get_tracer().span(
+            "batch",
+            root=True,
+            links=contexts,
+            kind="batch",
+            pipeline=self.pipeline.name,
+            **batch_attributes(contexts),
+        ) as span:
+            started = time.monotonic()
+            output = self.invoke(step, [item for _, item in entries])
+            if i in self.controllers:
+                self.controllers[i].observe(
+                    depth=self.queue_size(i),
+                    batch_size=len(entries),
+                    execute_seconds=time.monotonic() - started,
+                )
+            if self.checkpoint:
+                self.checkpoint.flush(
+                    self.pipeline.name, i, keys, batch_key, serialize(output)
+                )
+            self.schedule_flush(i, partition)
+            result = None if output is None else self.run_from(i + 1, output, batch_key)
+            if span is not None:
+                span.attributes["run_end"] = run_status(result).value
+        if self.checkpoint:
+            self.checkpoint.complete_batch(self.pipeline.name, i, batch_key)
+        return result
@@ -0,0 +1,381 @@
+"""
+Incremental bucket listing for the S3ScanTrigger.
+
+Each scan lists the trigger's prefix, or each of its shards in parallel,
+from a saved watermark, and hands the objects it discovers to a callback
+in batches. The watermark advances after every batch, so a scan that is
+interrupted resumes where it left off.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Protocol,
+)
+from uuid import uuid4
+
+from pydantic import BaseModel, Field
+
+from ingest.data_types import S3Object
+
+logger = logging.getLogger(__name__)
+
+
+class WatermarkKind(str, Enum):
+    # lists after the last key seen, which suits keys that increase over
+    # time (e.g. dated paths)
+    key = "key"
+    # lists the whole prefix on each scan, emitting objects modified since
+    # the last one
+    last_modified = "last_modified"
+
+
+class ScanConfig(BaseModel):
+    bucket_name: str
+    prefix: str = ""
+    # sub-prefixes of `prefix`, each listed in parallel with its own watermark
+    shards: List[str] = []
+    suffix: Optional[str] = None
+    watermark: WatermarkKind = WatermarkKind.key
+    # objects modified this recently are left for the next scan, as uploads
+    # can become visible after their last-modified time
+    settle_seconds: int = 60
+    interval_minutes: int = Field(5, ge=1)
+    # objects handed out at a time, each batch starting an execution, or
+    # several if the workflow's execution history can't hold the batch
+    batch_size: int = Field(200, ge=1)
+    # bounds the work of one scan, which later scans resume
+    max_objects_per_scan: Optional[int] = None
+    max_workers: int = 8
+    # objects of a batch processed at once, where 0 is unlimited
+    map_concurrency: int = 0
+
+    @property
+    def shard_prefixes(self) -> List[str]:
+        return [self.prefix + shard for shard in self.shards] or [self.prefix]
+
+
+class ListedObject(NamedTuple):
+    key: str
+    last_modified: datetime
+    size: int
+
+
+class ObjectLister(Protocol):
+    def list(
+        self, bucket: str, prefix: str, start_after: Optional[str] = None
+    ) -> Iterator[ListedObject]:
+        """Objects under a prefix in key order, after `start_after`"""
+        ...
+
+
+class S3Lister(ObjectLister):
+    def __init__(self, client: Any = None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from ingest.resources import get_pool
+
+            self._client = get_pool().client("s3")
+        return self._client
+
+    def list(
+        self, bucket: str, prefix: str, start_after: Optional[str] = None
+    ) -> Iterator[ListedObject]:
+        kwargs = {"Bucket": bucket, "Prefix": prefix}
+        if start_after:
+            kwargs["StartAfter"] = start_after
+        for page in self.client.get_paginator("list_objects_v2").paginate(**kwargs):
+            for item in page.get("Contents", []):
+                yield ListedObject(item["Key"], item["LastModified"], item["Size"])
+
+
+class LocalLister(ObjectLister):
+    """Lists files under <root>/<bucket>, the layout LocalObjectStore serves"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def list(
+        self, bucket: str, prefix: str, start_after: Optional[str] = None
+    ) -> Iterator[ListedObject]:
+        base = self.root / bucket
+        keys = [
+            path.relative_to(base).as_posix()
+            for path in base.rglob("*")
+            if path.is_file()
+        ]
+        # S3 lists keys in UTF-8 byte order
+        for key in sorted(keys, key=lambda k: k.encode()):
+            if not key.startswith(prefix):
+                continue
+            if start_after is not None and key.encode() <= start_after.encode():
+                continue
+            stat = (base / key).stat()
+            yield ListedObject(
+                key,
+                datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+                stat.st_size,
+            )
+
+
+class Watermark(BaseModel):
+    last_key: Optional[str] = None
+    last_modified: Optional[datetime] = None
+    # for last_modified watermarks, the cutoff of a listing which stopped
+    # at `last_key`, and is resumed by the next scan
+    cutoff: Optional[datetime] = None
+
+
+class WatermarkStore(Protocol):
+    def load(self) -> Dict[str, Watermark]:
+        """Watermarks by shard prefix"""
+        ...
+
+    def save(self, watermarks: Dict[str, Watermark]) -> None:
+        ...
+
+
+def dump_watermarks(watermarks: Dict[str, Watermark]) -> str:
+    return json.dumps(
+        {prefix: json.loads(w.json()) for prefix, w in watermarks.items()},
+        sort_keys=True,
+    )
+
+
+def parse_watermarks(text: str) -> Dict[str, Watermark]:
+    return {prefix: Watermark(**w) for prefix, w in json.loads(text).items()}
+
+
+class FileWatermarkStore(WatermarkStore):
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def load(self) -> Dict[str, Watermark]:
+        if not self.path.exists():
+            return {}
+        return parse_watermarks(self.path.read_text())
+
+    def save(self, watermarks: Dict[str, Watermark]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(dump_watermarks(watermarks))
+        os.replace(tmp, self.path)
+
+
+class SSMWatermarkStore(WatermarkStore):
+    """Watermarks kept in an SSM parameter"""
+
+    def __init__(self, name: str, client: Any = None):
+        self.name = name
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from ingest.resources import get_pool
+
+            self._client = get_pool().client("ssm")
+        return self._client
+
+    def load(self) -> Dict[str, Watermark]:
+        try:
+            response = self.client.get_parameter(Name=self.name)
+        except self.client.exceptions.ParameterNotFound:
+            return {}
+        return parse_watermarks(response["Parameter"]["Value"])
+
+    def save(self, watermarks: Dict[str, Watermark]) -> None:
+        self.client.put_parameter(
+            Name=self.name,
+            Value=dump_watermarks(watermarks),
+            Type="String",
+            Overwrite=True,
+            # moves to the advanced tier if many shards outgrow 4KB
+            Tier="Intelligent-Tiering",
+        )
+
+
+class ScanReport(BaseModel):
+    objects: int
+    batches: int
+    # objects discovered in each shard
+    shards: Dict[str, int]
+
+
+class BucketScanner:
+    def __init__(
+        self,
+        config: ScanConfig,
+        lister: ObjectLister,
+        store: WatermarkStore,
+        # called with each batch, and the listing it comes from
+        start: Callable[[List[S3Object], str], Any],
+        clock: Callable[[], datetime] = lambda: datetime.now(timezone.utc),
+        # checked between objects, e.g. to stop before a Lambda times out
+        should_stop: Optional[Callable[[], bool]] = None,
+    ):
+        self.config = config
+        self.lister = lister
+        self.store = store
+        self.start = start
+        self.clock = clock
+        self.should_stop = should_stop
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def scan(self) -> ScanReport:
+        """List every shard from its watermark. Errors in one shard don't
+        stop the others, and are raised once they finish."""
+        watermarks = self.store.load()
+        cutoff = self.clock() - timedelta(seconds=self.config.settle_seconds)
+        prefixes = self.config.shard_prefixes
+        counts: Dict[str, int] = {}
+        self.batches = 0
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(self.config.max_workers, len(prefixes)))
+        ) as pool:
+            futures = {
+                prefix: pool.submit(self.scan_shard, prefix, watermarks, cutoff)
+                for prefix in prefixes
+            }
+        errors = []
+        for prefix, future in futures.items():
+            try:
+                counts[prefix] = future.result()
+            except Exception as e:
+                logger.exception(f"Failed to scan {prefix}")
+                errors.append(e)
+        if errors:
+            raise errors[0]
+        return ScanReport(
+            objects=sum(counts.values()), batches=self.batches, shards=counts
+        )
+
+    def matches(self, key: str) -> bool:
+        if key.endswith("/"):
+            # folder placeholders
+            return False
+        return self.config.suffix is None or key.endswith(self.config.suffix)
+
+    def scan_shard(
+        self,
+        prefix: str,
+        watermarks: Dict[str, Watermark],
+        cutoff: datetime,
+    ) -> int:
+        watermark = watermarks.get(prefix, Watermark())
+        by_key = self.config.watermark == WatermarkKind.key
+        # a listing by last modified time which stopped part way through is
+        # resumed after its last key, for the same span of time
+        resuming = False
+        if not by_key and watermark.cutoff is not None:
+            cutoff = watermark.cutoff
+            resuming = True
+        limit = self.config.max_objects_per_scan
+        batch: List[S3Object] = []
+        count = 0
+        last_key = watermark.last_key if by_key or resuming else None
+        # names the listing, which hands out the same objects if it is
+        # repeated after a failure: keys are only listed once by key
+        # watermarks, and once per span of time by last_modified ones
+        listing = prefix
+        if not by_key and watermark.last_modified:
+            listing += f"@{watermark.last_modified.isoformat()}"
+
+        def position() -> Watermark:
+            if by_key:
+                return Watermark(last_key=last_key)
+            return Watermark(
+                last_key=last_key, last_modified=watermark.last_modified, cutoff=cutoff
+            )
+
+        def flush() -> None:
+            self.start(batch, listing)
+            with self._lock:
+                self.batches += 1
+                watermarks[prefix] = position()
+                self.store.save(watermarks)
+            batch.clear()
+
+        stopped = False
+        for listed in self.lister.list(
+            self.config.bucket_name, prefix, start_after=last_key
+        ):
+            if (limit is not None and count >= limit) or (
+                self.should_stop and self.should_stop()
+            ):
+                logger.info(f"Stopping scan of {prefix} at {last_key}")
+                stopped = True
+                break
+            last_key = listed.key
+            if not by_key and not (
+                (
+                    watermark.last_modified is None
+                    or watermark.last_modified < listed.last_modified
+                )
+                and listed.last_modified <= cutoff
+            ):
+                continue
+            if not self.matches(listed.key):
+                continue
+            batch.append(S3Object(bucket=self.config.bucket_name, key=listed.key))
+            count += 1
+            if len(batch) >= self.config.batch_size:
+                flush()
+        if batch:
+            flush()
+        with self._lock:
+            if by_key or stopped:
+                # skips past keys that didn't match
+                watermarks[prefix] = position()
+            else:
+                watermarks[prefix] = Watermark(last_modified=cutoff)
+            self.store.save(watermarks)
+        logger.info(f"Scanned {count} objects from {prefix}")
+        return count
+
+
+def start_executions(starter: Any) -> Callable[[List[S3Object], str], None]:
+    """
+    A scanner callback starting executions with each batch of objects,
+    through an ExecutionStarter. Executions are named after the listing and
+    the objects they hold, so that objects handed out again, by a scan
+    which failed part way through a batch, don't start them again.
+    """
+    from ingest.backpressure import object_items, split_items
+    from ingest.tracing import current_context, get_tracer
+
+    def start(objects: List[S3Object], listing: str) -> None:
+        with get_tracer().span("trigger", kind="trigger", objects=len(objects)):
+            for chunk in split_items(
+                "objects",
+                object_items(objects, trace=current_context()),
+                max_items=starter.config.max_objects_per_execution,
+            ):
+                name = hashlib.sha256(
+                    "\n".join([listing] + [item["key"] for item in chunk]).encode()
+                ).hexdigest()[:64]
+                try:
+                    starter.start(name=name, input=json.dumps({"objects": chunk}))
+                except starter.client.exceptions.ClientError as e:
+                    if e.response["Error"]["Code"] != "ExecutionAlreadyExists":
+                        raise
+                    logger.info(f"Execution {name} was already started")
+
+    return start
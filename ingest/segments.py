@@ -0,0 +1,67 @@
+from typing import Any, List, NamedTuple, Optional, Sequence
+
+from ingest.parallel import Parallel
+from ingest.step import is_collector, step_resources
+
+# Standard workflows fail once their execution history exceeds 25,000 events
+MAX_HISTORY_EVENTS = 25_000
+# share of the history left for the events of retries
+HISTORY_HEADROOM = 0.2
+
+
+class Segment(NamedTuple):
+    """
+    The steps deployed as one workflow. Each collector starts a new
+    segment, fed by the queue which the previous segment sends to.
+    """
+
+    steps: Sequence[Any]
+    # the collector whose queue the segment's output is sent to
+    collector: Optional[Any] = None
+
+
+def split_segments(steps: Sequence[Any]) -> List[Segment]:
+    segments: List[Segment] = []
+    start = 0
+    for i, step in enumerate(steps):
+        if is_collector(step):
+            segments.append(Segment(steps[start:i], step))
+            start = i
+    if start < len(steps) or not segments:
+        segments.append(Segment(steps[start:]))
+    return segments
+
+
+def state_events(step: Any) -> int:
+    """History events recorded by the states of a step which runs once"""
+    if isinstance(step, Parallel):
+        events = 4 + sum(state_events(s) for branch in step.branches for s in branch)
+        return events + (state_events(step.join) if step.join else 0)
+    # a task's entered, scheduled, started, succeeded and exited events,
+    # and those of the Pass state which rejoins caught errors
+    return 5 + (2 if step_resources(step)["catch"] else 0)
+
+
+def objects_per_execution(segment: Segment) -> int:
+    """
+    The most objects an execution of a segment started with a batch of
+    objects can run through its Map, within the execution history limit.
+    Each object's iteration records two events, and those of its steps
+    and of sending it to the segment's collector.
+
+    Collectors packing messages are sent the outputs of every iteration
+    at once, which the Map gathers into the state, so the objects are
+    also bounded by the state's payload limit.
+    """
+    from ingest.backpressure import MAX_INPUT_BYTES
+
+    collector = segment.collector
+    config = step_resources(collector) if collector is not None else {}
+    packed = bool(config.get("pack_messages"))
+    per_object = 2 + sum(state_events(step) for step in segment.steps)
+    if collector is not None and not packed:
+        per_object += 5
+    limit = int(MAX_HISTORY_EVENTS * (1 - HISTORY_HEADROOM)) // per_object
+    if packed:
+        limit = min(limit, MAX_INPUT_BYTES // config["max_item_bytes"])
+    return max(1, limit)
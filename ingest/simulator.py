@@ -0,0 +1,540 @@
+import heapq
+import itertools
+import math
+import random
+from collections import defaultdict, deque
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from pydantic import BaseModel
+
+from ingest.parallel import Parallel
+from ingest.segments import split_segments
+from ingest.step import step_name
+from ingest.scan import WatermarkKind
+from ingest.trigger import S3ScanTrigger, SQSTrigger
+
+
+class Distribution:
+    """A distribution of service times in seconds, or of sizes in bytes"""
+
+    def sample(self, rng: random.Random) -> float:
+        raise NotImplementedError()
+
+
+class Constant(Distribution):
+    def __init__(self, value: float):
+        self.value = value
+
+    def sample(self, rng: random.Random) -> float:
+        return self.value
+
+
+class Exponential(Distribution):
+    def __init__(self, mean: float):
+        self.mean = mean
+
+    def sample(self, rng: random.Random) -> float:
+        return rng.expovariate(1 / self.mean)
+
+
+class LogNormal(Distribution):
+    """Right-skewed service times, typical of calls to other services"""
+
+    def __init__(self, median: float, sigma: float = 0.5):
+        self.median = median
+        self.sigma = sigma
+
+    def sample(self, rng: random.Random) -> float:
+        return rng.lognormvariate(math.log(self.median), self.sigma)
+
+
+class Empirical(Distribution):
+    """Resamples measured service times"""
+
+    def __init__(self, samples: Sequence[float]):
+        if not samples:
+            raise ValueError("Empirical distribution requires samples")
+        self.samples = list(samples)
+
+    def sample(self, rng: random.Random) -> float:
+        return rng.choice(self.samples)
+
+
+def service_times_from_profile(profiler: Any) -> Dict[str, Distribution]:
+    """Service times for each step measured by a StepProfiler"""
+    return {
+        step: Empirical([sample.wall_seconds for sample in samples])
+        for step, samples in profiler.samples.items()
+    }
+
+
+class Arrivals:
+    """When items arrive at the pipeline's trigger"""
+
+    def times(self, rng: random.Random, duration: float) -> Iterator[float]:
+        raise NotImplementedError()
+
+
+class PoissonArrivals(Arrivals):
+    def __init__(self, rate: float):
+        # mean arrivals per second
+        self.rate = rate
+
+    def times(self, rng: random.Random, duration: float) -> Iterator[float]:
+        t = rng.expovariate(self.rate)
+        while t < duration:
+            yield t
+            t += rng.expovariate(self.rate)
+
+
+class ConstantArrivals(Arrivals):
+    def __init__(self, rate: float):
+        self.rate = rate
+
+    def times(self, rng: random.Random, duration: float) -> Iterator[float]:
+        t = 0.0
+        while t < duration:
+            yield t
+            t += 1 / self.rate
+
+
+class BacklogSample(BaseModel):
+    time: float
+    # messages visible or in flight, per queue
+    depths: Dict[str, int]
+    concurrency: int
+
+
+class SimulationReport(BaseModel):
+    items_arrived: int
+    items_completed: int
+    latency_p50: Optional[float]
+    latency_p90: Optional[float]
+    latency_p99: Optional[float]
+    latency_max: Optional[float]
+    backlog: List[BacklogSample]
+    max_backlog: Dict[str, int]
+    final_backlog: Dict[str, int]
+    peak_concurrency: int
+    peak_concurrency_by_function: Dict[str, int]
+    throttled_invocations: int
+    # consumer invocations rejected by reserved concurrency, whose
+    # messages reappear after the visibility timeout
+    throttled_batches: int
+    deferred_batches: int
+    transitions: Dict[str, int]
+
+    @property
+    def total_transitions(self) -> int:
+        return sum(self.transitions.values())
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+
+class AllOf:
+    """Yielded by a process to wait for several child processes"""
+
+    def __init__(self, processes: Sequence[Generator]):
+        self.processes = processes
+
+
+class SimQueue:
+    """An SQS queue and the event source mapping consuming it"""
+
+    def __init__(
+        self,
+        name: str,
+        workflow: int,
+        batch_size: int,
+        max_batching_window: float,
+        max_concurrency: Optional[int] = None,
+        max_running_executions: Optional[int] = None,
+    ):
+        self.name = name
+        self.workflow = workflow
+        self.batch_size = batch_size
+        self.max_batching_window = max_batching_window
+        self.max_concurrency = max_concurrency
+        self.max_running_executions = max_running_executions
+        # (visible since, arrival times of the items the message carries)
+        self.visible: Deque[Tuple[float, List[float]]] = deque()
+        self.in_flight = 0
+        self.consumers = 0
+        self.window_check: Optional[float] = None
+
+    @property
+    def depth(self) -> int:
+        return len(self.visible) + self.in_flight
+
+
+class Simulator:
+    """
+    A discrete-event simulation of a deployed pipeline.
+
+    The pipeline is split into the same workflows PipelineStack creates.
+    Each workflow execution invokes a Lambda per step, sharing the account's
+    concurrency; throttled invocations are retried with the backoff Step
+    Functions applies to LambdaInvoke tasks. Collector queues are consumed
+    in batches of the collector's `batch_size`, waiting up to its
+    `max_batching_window`, with its `max_concurrency` and
+    `max_running_executions` limits. Consumers rejected by their concurrency
+    limit leave the batch invisible for the visibility timeout, and batches
+    deferred by backpressure return after `defer_seconds`.
+
+    Scan triggers pick up the items that arrived since their last scan
+    every `interval_minutes`.
+
+    Partitioned collectors are modelled as a single queue.
+    """
+
+    def __init__(
+        self,
+        pipeline: Any,
+        arrivals: Arrivals,
+        service_times: Optional[Dict[str, Distribution]] = None,
+        default_service_time: Distribution = Constant(0.1),
+        # time for trigger, consumer and queue-send Lambdas
+        framework_service_time: Distribution = Constant(0.05),
+        account_concurrency: int = 1000,
+        # matching the queues PipelineStack creates
+        visibility_timeout: float = 660,
+        defer_seconds: float = 30,
+        # latency added by each state transition
+        transition_latency: float = 0.0,
+        sample_interval: float = 1.0,
+        seed: Optional[int] = None,
+    ):
+        self.pipeline = pipeline
+        self.arrivals = arrivals
+        self.service_times = service_times or {}
+        self.default_service_time = default_service_time
+        self.framework_service_time = framework_service_time
+        self.account_concurrency = account_concurrency
+        self.visibility_timeout = visibility_timeout
+        self.defer_seconds = defer_seconds
+        self.transition_latency = transition_latency
+        self.sample_interval = sample_interval
+        self.rng = random.Random(seed)
+        self.segments = split_segments(pipeline.steps)
+
+    def reset(self) -> None:
+        self.now = 0.0
+        self._events: List[Tuple[float, int, Callable[[], None]]] = []
+        self._counter = itertools.count()
+        self.concurrency = 0
+        self.peak_concurrency = 0
+        self.function_concurrency: Dict[str, int] = defaultdict(int)
+        self.peak_function_concurrency: Dict[str, int] = defaultdict(int)
+        self.running: Dict[int, int] = defaultdict(int)
+        self.transitions: Dict[str, int] = defaultdict(int)
+        self.throttled_invocations = 0
+        self.throttled_batches = 0
+        self.deferred_batches = 0
+        self.latencies: List[float] = []
+        self.backlog: List[BacklogSample] = []
+        # items awaiting a scan trigger's next scan
+        self.unscanned: List[float] = []
+        self.queues: Dict[int, SimQueue] = {}
+        trigger = self.pipeline.trigger
+        if isinstance(trigger, SQSTrigger):
+            self.queues[0] = SimQueue(
+                trigger.queue_name,
+                0,
+                trigger.batch_size,
+                trigger.max_batching_window,
+                trigger.max_concurrency,
+                trigger.max_running_executions,
+            )
+        elif getattr(trigger, "buffer", None):
+            buffer = trigger.buffer
+            self.queues[0] = SimQueue(
+                "S3Buffer",
+                0,
+                buffer.batch_size,
+                buffer.max_batching_window,
+                buffer.max_concurrency,
+                buffer.max_running_executions,
+            )
+        for i, segment in enumerate(self.segments[:-1]):
+            collector = segment.collector
+            # every segment but the last ends at a collector
+            assert collector is not None
+            self.queues[i + 1] = SimQueue(
+                collector.__name__,
+                i + 1,
+                collector.batch_size,
+                collector.max_batching_window,
+                collector.max_concurrency,
+                collector.max_running_executions,
+            )
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> None:
+        heapq.heappush(self._events, (self.now + delay, next(self._counter), callback))
+
+    def start(
+        self, process: Generator, on_done: Optional[Callable[[], None]] = None
+    ) -> None:
+        """Drive a process, which yields delays or AllOf its children"""
+
+        def resume() -> None:
+            try:
+                event = next(process)
+            except StopIteration:
+                if on_done:
+                    on_done()
+                return
+            if isinstance(event, AllOf):
+                remaining = [len(event.processes)]
+
+                def child_done() -> None:
+                    remaining[0] -= 1
+                    if not remaining[0]:
+                        resume()
+
+                if not event.processes:
+                    self.schedule(0, resume)
+                for child in event.processes:
+                    self.start(child, child_done)
+            else:
+                self.schedule(event, resume)
+
+        resume()
+
+    def run(self, duration: float, drain: float = 3600) -> SimulationReport:
+        """
+        Simulate items arriving for `duration` seconds, then continue for up
+        to `drain` seconds for the pipeline to finish processing them.
+        """
+        self.reset()
+        arrived = 0
+        for t in self.arrivals.times(self.rng, duration):
+            arrived += 1
+            self.schedule(t, partial(self.arrive, t))
+        if isinstance(self.pipeline.trigger, S3ScanTrigger):
+            self.schedule(0, lambda: self.scan(duration))
+        self.schedule(0, self.sample)
+        while self._events:
+            time, _, callback = heapq.heappop(self._events)
+            if time > duration + drain:
+                break
+            self.now = time
+            callback()
+        return self.report(arrived)
+
+    def report(self, arrived: int) -> SimulationReport:
+        names = {queue.name: queue for queue in self.queues.values()}
+        return SimulationReport(
+            items_arrived=arrived,
+            items_completed=len(self.latencies),
+            latency_p50=percentile(self.latencies, 0.5),
+            latency_p90=percentile(self.latencies, 0.9),
+            latency_p99=percentile(self.latencies, 0.99),
+            latency_max=max(self.latencies, default=None),
+            backlog=self.backlog,
+            max_backlog={
+                name: max((s.depths[name] for s in self.backlog), default=0)
+                for name in names
+            },
+            final_backlog={name: queue.depth for name, queue in names.items()},
+            peak_concurrency=self.peak_concurrency,
+            peak_concurrency_by_function=dict(self.peak_function_concurrency),
+            throttled_invocations=self.throttled_invocations,
+            throttled_batches=self.throttled_batches,
+            deferred_batches=self.deferred_batches,
+            transitions=dict(self.transitions),
+        )
+
+    def sample(self) -> None:
+        self.backlog.append(
+            BacklogSample(
+                time=self.now,
+                depths={queue.name: queue.depth for queue in self.queues.values()},
+                concurrency=self.concurrency,
+            )
+        )
+        # keep sampling while anything else remains to happen
+        if self._events:
+            self.schedule(self.sample_interval, self.sample)
+
+    def arrive(self, arrived_at: float) -> None:
+        if 0 in self.queues:
+            self.enqueue(self.queues[0], [arrived_at])
+        elif isinstance(self.pipeline.trigger, S3ScanTrigger):
+            self.unscanned.append(arrived_at)
+        else:
+            # an event trigger starts one execution per item
+            self.start(self.trigger(arrived_at))
+
+    def trigger(self, arrived_at: float) -> Generator:
+        yield from self.invoke("Trigger", self.framework_service_time)
+        self.start_execution(0, [arrived_at])
+
+    def scan(self, duration: float) -> None:
+        trigger = self.pipeline.trigger
+        cutoff = self.now
+        if trigger.watermark == WatermarkKind.last_modified:
+            cutoff -= trigger.settle_seconds
+        found = [t for t in self.unscanned if t <= cutoff]
+        self.unscanned = [t for t in self.unscanned if t > cutoff]
+        if found:
+            self.start(self.scanning(found))
+        if self.now < duration or self.unscanned:
+            self.schedule(trigger.interval_minutes * 60, lambda: self.scan(duration))
+
+    def scanning(self, items: List[float]) -> Generator:
+        """A scan starting an execution per batch of the items it finds"""
+        batch_size = self.pipeline.trigger.batch_size
+        yield from self.invoke("Scan", self.framework_service_time)
+        for i in range(0, len(items), batch_size):
+            self.start_execution(0, items[i : i + batch_size])
+
+    def service_time(self, step: Any) -> Distribution:
+        return self.service_times.get(step.__name__, self.default_service_time)
+
+    def invoke(self, function: str, service_time: Distribution) -> Generator:
+        """Invoke a Lambda, retrying while the account is at its concurrency
+        limit with the backoff of Step Functions' LambdaInvoke retries"""
+        attempt = 0
+        while self.concurrency >= self.account_concurrency:
+            self.throttled_invocations += 1
+            yield 2 * 2**attempt
+            attempt += 1
+        self.concurrency += 1
+        self.function_concurrency[function] += 1
+        self.peak_concurrency = max(self.peak_concurrency, self.concurrency)
+        self.peak_function_concurrency[function] = max(
+            self.peak_function_concurrency[function],
+            self.function_concurrency[function],
+        )
+        yield service_time.sample(self.rng)
+        self.concurrency -= 1
+        self.function_concurrency[function] -= 1
+
+    def transition(self, workflow: int, count: int = 1) -> Generator:
+        self.transitions[f"Workflow{workflow}"] += count
+        if self.transition_latency:
+            yield self.transition_latency * count
+
+    def run_steps(self, workflow: int, steps: Sequence[Any]) -> Generator:
+        for step in steps:
+            yield from self.transition(workflow)
+            if isinstance(step, Parallel):
+                yield AllOf(
+                    [self.run_steps(workflow, branch) for branch in step.branches]
+                )
+                if step.join:
+                    yield from self.transition(workflow)
+                    yield from self.invoke(
+                        step_name(step.join), self.service_time(step.join)
+                    )
+            else:
+                yield from self.invoke(step.__name__, self.service_time(step))
+
+    def start_execution(self, workflow: int, items: List[float]) -> None:
+        self.running[workflow] += 1
+
+        def done() -> None:
+            self.running[workflow] -= 1
+
+        self.start(self.execution(workflow, items), done)
+
+    def execution(self, workflow: int, items: List[float]) -> Generator:
+        if (
+            workflow == 0
+            and getattr(self.pipeline.trigger, "map_concurrency", None) is not None
+        ):
+            # a batch of S3 objects, each run through the steps by a Map state
+            yield from self.transition(workflow)
+            yield AllOf([self.item_execution(workflow, [item]) for item in items])
+        else:
+            yield from self.item_execution(workflow, items)
+        # the final Succeed state
+        yield from self.transition(workflow)
+
+    def item_execution(self, workflow: int, items: List[float]) -> Generator:
+        segment = self.segments[workflow]
+        yield from self.run_steps(workflow, segment.steps)
+        if segment.collector:
+            yield from self.transition(workflow)
+            if not segment.collector.native_send:
+                yield from self.invoke(
+                    f"{segment.collector.__name__}Send", self.framework_service_time
+                )
+            self.enqueue(self.queues[workflow + 1], items)
+        else:
+            self.latencies.extend(self.now - arrived_at for arrived_at in items)
+
+    def enqueue(self, queue: SimQueue, items: List[float]) -> None:
+        queue.visible.append((self.now, items))
+        self.poll(queue)
+
+    def poll(self, queue: SimQueue) -> None:
+        """Invoke the queue's consumer with any batch which is full,
+        or whose oldest message has waited for the batching window"""
+        while queue.visible:
+            oldest = queue.visible[0][0]
+            window_expires = oldest + queue.max_batching_window
+            if len(queue.visible) < queue.batch_size and self.now < window_expires:
+                if queue.window_check is None or queue.window_check > window_expires:
+                    queue.window_check = window_expires
+                    self.schedule(
+                        window_expires - self.now, lambda: self.window_expired(queue)
+                    )
+                return
+            batch = [
+                queue.visible.popleft()[1]
+                for _ in range(min(queue.batch_size, len(queue.visible)))
+            ]
+            queue.in_flight += len(batch)
+            if queue.max_concurrency and queue.consumers >= queue.max_concurrency:
+                self.throttled_batches += 1
+                self.schedule(
+                    self.visibility_timeout, partial(self.requeue, queue, batch)
+                )
+                continue
+            queue.consumers += 1
+            self.start(self.consume(queue, batch))
+
+    def window_expired(self, queue: SimQueue) -> None:
+        queue.window_check = None
+        self.poll(queue)
+
+    def requeue(self, queue: SimQueue, batch: List[List[float]]) -> None:
+        queue.in_flight -= len(batch)
+        for items in batch:
+            queue.visible.append((self.now, items))
+        self.poll(queue)
+
+    def consume(self, queue: SimQueue, batch: List[List[float]]) -> Generator:
+        yield from self.invoke(f"{queue.name}Consumer", self.framework_service_time)
+        queue.consumers -= 1
+        if (
+            queue.max_running_executions
+            and self.running[queue.workflow] >= queue.max_running_executions
+        ):
+            self.deferred_batches += 1
+            self.schedule(self.defer_seconds, lambda: self.requeue(queue, batch))
+        else:
+            queue.in_flight -= len(batch)
+            # one execution per batch, tracking every item it carries
+            self.start_execution(
+                queue.workflow, [item for items in batch for item in items]
+            )
+        self.poll(queue)
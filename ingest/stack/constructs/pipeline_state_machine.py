@@ -5,6 +5,8 @@ from aws_cdk import (
     aws_stepfunctions_tasks as tasks,
 )
 
+from ingest.stack.naming import prefixed_state_machine_name
+
 
 class PipelineStateMachine(sf.StateMachine):
     def __init__(
@@ -12,16 +14,15 @@ class PipelineStateMachine(sf.StateMachine):
         scope: core.Construct,
         id: str,
         state_machine_name: str,
-        lambdas: Sequence[tasks.LambdaInvoke],
+        lambdas: Sequence[sf.IChainable],
     ):
-        state_machine_prefix = id[: 79 - len(state_machine_name)]
         definition = sf.Chain.start(lambdas[0])
         for l in lambdas[1:]:
             definition = definition.next(l)
         super().__init__(
             scope,
             state_machine_name,
-            state_machine_name=f"{state_machine_prefix}_{state_machine_name}".lower(),
+            state_machine_name=prefixed_state_machine_name(id, state_machine_name),
             definition=definition.next(
                 sf.Succeed(scope, f"Complete-{state_machine_name}", comment="Complete")
             ),
@@ -1,21 +1,27 @@
 import logging
 
 from pathlib import Path
-from typing import List, Optional, Sequence, Type
+from typing import Any, List, Optional, Sequence, Type, Union
 from aws_cdk import (
     core,
+    aws_dynamodb as dynamodb,
     aws_lambda as lambda_,
     aws_sqs as sqs,
+    aws_stepfunctions as sf,
     aws_stepfunctions_tasks as tasks,
 )
+from ingest.history import PIPELINE_ENV, RUN_END_ENV, RunStatus
+from ingest.tracing import TRACE_KEY
 from ingest.permissions import S3Access
 from ingest.provider import CloudProvider
 from ingest.stack.constructs.step_lambda import StepLambda
 from ingest.stack.constructs.pipeline_state_machine import PipelineStateMachine
 from ingest.stack.constructs.sqs_post_lambda import SQSQueuePostLambda
-from ingest.stack.naming import collector_queue_name
+from ingest.stack.naming import collector_queue_name, collector_queue_names
+from ingest.segments import Segment, objects_per_execution
 
-from ingest.step import Collector
+from ingest.parallel import Parallel
+from ingest.step import is_collector, step_resources
 from ingest.trigger import SQSTrigger
 
 logger = logging.getLogger(__name__)
@@ -33,36 +39,83 @@ class PipelineWorkflow(core.Construct):
         pipeline: Pipeline,
         code_dir: Path,
         requirements_path: Path,
-        steps: Sequence[Type[Step]],
+        steps: Sequence[Union[Type[Step], Parallel]],
         layer: lambda_.LayerVersion,
         collector: Optional[Type[Collector]] = None,
-        target_queue: Optional[sqs.Queue] = None,
-        trigger_queue: Optional[sqs.Queue] = None,
+        target_queues: Sequence[sqs.Queue] = (),
+        trigger_queues: Sequence[sqs.Queue] = (),
+        history_table: Optional[dynamodb.ITable] = None,
         **kwargs,
     ) -> None:
         super().__init__(scope, id, **kwargs)
+        self.pipeline_name = pipeline.name
+        self.app = pipeline.app
+        self.history_table = history_table
 
         lambdas = self.create_lambda_tasks(
             steps=steps,
             code_dir=code_dir,
             requirements_path=requirements_path,
             layer=layer,
+            # runs end with the workflow, or continue as a collector's batch
+            run_end=RunStatus.collected if collector else RunStatus.succeeded,
         )
-        if collector and target_queue:
+        send_task: Optional[tasks.LambdaInvoke] = None
+        # the configuration of the collector which consumes this workflow's outputs
+        target = step_resources(collector) if collector else {}
+        if collector and target_queues and target["native_send"]:
+            queue_name = collector_queue_name(collector)
+            # validated to have a single queue
+            send_task = tasks.SqsSendMessage(
+                self,
+                f"task_send_to_{queue_name}"[:79],
+                queue=target_queues[0],
+                message_body=sf.TaskInput.from_json_path_at("$"),
+                result_path=sf.JsonPath.DISCARD,
+            )
+        elif collector and target_queues:
             queue_name = collector_queue_name(collector)
             # append lambda function to post input to SQS queue
             collector_send_lambda = SQSQueuePostLambda(
-                self, queue_name=queue_name, sqs_queue=target_queue
+                self,
+                queue_name=queue_name,
+                sqs_queues=target_queues,
+                partition_by=target["partition_by"],
+                pack_messages=target["pack_messages"],
+                compress_messages=target["compress_messages"],
+                layer=layer,
+            )
+            send_task = tasks.LambdaInvoke(
+                self,
+                f"task_send_to_{queue_name}"[:79],
+                lambda_function=collector_send_lambda,
+                payload_response_only=True,
             )
 
-            lambdas.append(
-                tasks.LambdaInvoke(
+        # set by triggers which start executions with batches of objects
+        map_concurrency = getattr(pipeline.trigger, "map_concurrency", None)
+        batched = workflow_num == 0 and map_concurrency is not None
+        # packed messages are sent once the Map has collected every output,
+        # which objects_per_execution bounds within the payload limit
+        send_after_map = batched and collector is not None and target["pack_messages"]
+        if send_task and not send_after_map:
+            lambdas.append(send_task)
+        if batched:
+            # executions receive a batch of objects, each run through the steps
+            chain = sf.Chain.start(lambdas[0])
+            for l in lambdas[1:]:
+                chain = chain.next(l)
+            lambdas = [
+                sf.Map(
                     self,
-                    f"task_send_to_{queue_name}"[:79],
-                    lambda_function=collector_send_lambda,
-                    payload_response_only=True,
-                )
-            )
+                    "MapObjects",
+                    items_path="$.objects",
+                    max_concurrency=map_concurrency,
+                    result_path=None if send_after_map else sf.JsonPath.DISCARD,
+                ).iterator(chain)
+            ]
+        if send_task and send_after_map:
+            lambdas.append(send_task)
 
         self.state_machine = PipelineStateMachine(
             self,
@@ -73,60 +126,277 @@ class PipelineWorkflow(core.Construct):
 
         if workflow_num == 0:
             # set trigger to pipeline trigger
-            print("Creating pipeline trigger")
+            logger.debug("Creating pipeline trigger")
             pipeline.trigger.get_construct(provider=CloudProvider.aws)(
                 self,
                 "PipelineTrigger",
                 pipeline_name=pipeline.name,
                 state_machine=self.state_machine,
                 trigger=pipeline.trigger,
+                layer=layer,
+                # bounds the Map of triggers starting executions with batches
+                max_objects_per_execution=objects_per_execution(
+                    Segment(steps, collector)
+                ),
             )
         elif (
-            issubclass(steps[0], Collector) and trigger_queue
+            is_collector(steps[0]) and trigger_queues
         ):  # this should always be true, if workflow_num > 0
-            # set trigger to SQS with collector props
+            # set trigger to SQS with collector props, consuming each shard
             step = steps[0]
-            trigger = SQSTrigger(
-                output_type=step.get_output(),
-                queue_name=collector_queue_name(step),
-                batch_size=step.batch_size,
-                max_batching_window=step.max_batching_window,
-            )
-            trigger.get_construct(provider=CloudProvider.aws)(
-                self,
-                f"SQSTrigger{workflow_num}",
-                pipeline_name=pipeline.name,
-                state_machine=self.state_machine,
-                trigger=trigger,
-                sqs_queue=trigger_queue,
-            )
+            config = step_resources(step)
+            for shard, (queue_name, trigger_queue) in enumerate(
+                zip(collector_queue_names(step), trigger_queues)
+            ):
+                adaptive = config["adaptive_batching"]
+                trigger = SQSTrigger(
+                    output_type=step.get_output(),
+                    queue_name=queue_name,
+                    # adaptive consumers receive the largest batches soon,
+                    # and choose how many records each execution takes
+                    batch_size=(
+                        adaptive.max_batch_size if adaptive else config["batch_size"]
+                    ),
+                    max_batching_window=(
+                        adaptive.min_window
+                        if adaptive
+                        else config["max_batching_window"]
+                    ),
+                    max_concurrency=config["max_concurrency"],
+                    max_running_executions=config["max_running_executions"],
+                    partition_by=config["partition_by"],
+                    adaptive_batching=adaptive,
+                )
+                trigger.get_construct(provider=CloudProvider.aws)(
+                    self,
+                    f"SQSTrigger{workflow_num}"
+                    + (f"_{shard}" if len(trigger_queues) > 1 else ""),
+                    pipeline_name=pipeline.name,
+                    state_machine=self.state_machine,
+                    trigger=trigger,
+                    sqs_queue=trigger_queue,
+                    layer=layer,
+                )
 
     def create_lambda_tasks(
         self,
-        steps: Sequence[Type[Step]],
+        steps: Sequence[Union[Type[Step], Parallel]],
         code_dir: Path,
         requirements_path: Path,
         layer: lambda_.LayerVersion,
-    ) -> List[tasks.LambdaInvoke]:
-        lambdas = []
+        prefix: str = "",
+        run_end: Optional[RunStatus] = None,
+    ) -> List[sf.IChainable]:
+        """Tasks running each step. The last step's functions are
+        configured to record `run_end` in the run history."""
+        lambdas: List[sf.IChainable] = []
         for i, step in enumerate(steps):
+            last = run_end if i == len(steps) - 1 else None
+            if isinstance(step, Parallel):
+                lambdas.append(
+                    self.create_parallel(
+                        step,
+                        f"{prefix}Parallel{i}",
+                        code_dir=code_dir,
+                        requirements_path=requirements_path,
+                        layer=layer,
+                        run_end=last,
+                    )
+                )
+                continue
+
             step_lambda = StepLambda(
                 self,
-                f"Step{i}",
+                f"{prefix}Step{i}",
                 step=step,
                 code_dir=code_dir,
                 default_requirements_path=requirements_path,
                 base_layer=layer,
+                emit_targets=self.emit_targets(step),
             )
-
-            # TODO: Add error handling and retry config
+            self.add_history_environment(step_lambda, last)
 
             lambda_task = tasks.LambdaInvoke(
                 self,
-                step_lambda.lambda_name[:79],
+                f"{prefix}{step_lambda.lambda_name}"[:79],
                 lambda_function=step_lambda,
                 payload_response_only=True,
             )
+            self.add_retries(lambda_task, step)
 
-            lambdas.append(lambda_task)
+            if step_resources(step)["catch"]:
+                lambdas.append(
+                    self.add_catches(
+                        lambda_task,
+                        step,
+                        f"{prefix}Step{i}",
+                        code_dir=code_dir,
+                        requirements_path=requirements_path,
+                        layer=layer,
+                        run_end=last,
+                    )
+                )
+            else:
+                lambdas.append(lambda_task)
         return lambdas
+
+    def add_history_environment(
+        self, step_lambda: StepLambda, run_end: Optional[RunStatus]
+    ):
+        step_lambda.add_environment(PIPELINE_ENV, self.pipeline_name)
+        if run_end:
+            step_lambda.add_environment(RUN_END_ENV, run_end.value)
+
+    def create_parallel(
+        self,
+        step: Parallel,
+        id: str,
+        code_dir: Path,
+        requirements_path: Path,
+        layer: lambda_.LayerVersion,
+        run_end: Optional[RunStatus] = None,
+    ) -> sf.IChainable:
+        """Run each branch in a Parallel state, followed by the join step.
+        Without a join, the Parallel state passes its input through."""
+        parallel = sf.Parallel(
+            self,
+            id,
+            result_path=None if step.join else sf.JsonPath.DISCARD,
+        )
+        for b, branch in enumerate(step.branches):
+            branch_tasks = self.create_lambda_tasks(
+                branch,
+                code_dir=code_dir,
+                requirements_path=requirements_path,
+                layer=layer,
+                prefix=f"{id}Branch{b}",
+                # without a join, the last step of each branch ends the run
+                run_end=None if step.join else run_end,
+            )
+            definition = sf.Chain.start(branch_tasks[0])
+            for task in branch_tasks[1:]:
+                definition = definition.next(task)
+            parallel.branch(definition)
+
+        if step.join is None:
+            return parallel
+        [join_task] = self.create_lambda_tasks(
+            [step.join],
+            code_dir=code_dir,
+            requirements_path=requirements_path,
+            layer=layer,
+            prefix=f"{id}Join",
+            run_end=run_end,
+        )
+        return sf.Chain.start(parallel).next(join_task)
+
+    def add_retries(self, lambda_task: tasks.LambdaInvoke, step: Type[Step]):
+        for policy in step_resources(step)["retry"]:
+            if policy.jitter or policy.max_delay is not None:
+                logger.warning(
+                    f"Retry jitter and max_delay on {step.__name__} are only applied to local runs"
+                )
+            lambda_task.add_retry(
+                errors=list(policy.errors),
+                interval=core.Duration.seconds(policy.interval),
+                backoff_rate=policy.backoff_rate,
+                max_attempts=policy.max_attempts,
+            )
+
+    def add_catches(
+        self,
+        lambda_task: tasks.LambdaInvoke,
+        step: Type[Step],
+        id: str,
+        code_dir: Path,
+        requirements_path: Path,
+        layer: lambda_.LayerVersion,
+        run_end: Optional[RunStatus] = None,
+    ) -> sf.Chain:
+        """Route caught errors to fallback steps (or discard the item),
+        rejoining the main chain after the step."""
+        join = sf.Pass(self, f"{id}_caught_{step.__name__}"[:79])
+        for j, catcher in enumerate(step_resources(step)["catch"]):
+            if catcher.fallback:
+                fallback_lambda = StepLambda(
+                    self,
+                    f"{id}Fallback{j}",
+                    step=catcher.fallback,
+                    code_dir=code_dir,
+                    default_requirements_path=requirements_path,
+                    base_layer=layer,
+                    emit_targets=self.emit_targets(catcher.fallback),
+                )
+                self.add_history_environment(fallback_lambda, run_end)
+                handler = tasks.LambdaInvoke(
+                    self,
+                    f"{id}_fallback{j}_{fallback_lambda.lambda_name}"[:79],
+                    lambda_function=fallback_lambda,
+                    payload_response_only=True,
+                )
+                self.add_retries(handler, catcher.fallback)
+                handler.next(join)
+            else:
+                handler = sf.Succeed(
+                    self,
+                    f"{id}_discard{j}_{step.__name__}"[:79],
+                    comment="Discarded by catch policy",
+                )
+                if self.history_table:
+                    handler = self.record_discard(f"{id}_discard{j}", handler)
+            # keep the original input, so fallbacks receive the step's input
+            lambda_task.add_catch(
+                handler, errors=list(catcher.errors), result_path="$.ingest_error"
+            )
+        return sf.Chain.start(lambda_task).next(join)
+
+    def emit_targets(self, step: Type[Step]) -> List[Any]:
+        """The pipelines of the app which a step emits to"""
+        if not self.app:
+            return []
+        return [self.app.get_pipeline(name) for name in step.emits]
+
+    def record_discard(self, id: str, discard: sf.Succeed) -> sf.IChainable:
+        """
+        Record an item's run as discarded before discarding it, as no step
+        records the end of the run. Items carry the trace context naming
+        their run, unless they were started before history was recorded.
+        """
+        trace_id = f"$.{TRACE_KEY}.trace_id"
+        status = RunStatus.discarded.value
+        update = tasks.DynamoUpdateItem(
+            self,
+            f"{id}_record"[:79],
+            table=self.history_table,
+            key={
+                "pk": tasks.DynamoAttributeValue.from_string(
+                    sf.JsonPath.format("run#{}", sf.JsonPath.string_at(trace_id))
+                ),
+                "sk": tasks.DynamoAttributeValue.from_string("run"),
+            },
+            # updated_at is bumped, so that concurrent conditional writes
+            # of the run's steps merge with the discard rather than
+            # overwrite it
+            update_expression="SET #status = :status, pipeline_status = :pipeline_status REMOVE #error ADD updated_at :tick",
+            # runs without a record are left to the records of their steps
+            condition_expression="attribute_exists(pk)",
+            expression_attribute_names={"#status": "status", "#error": "error"},
+            expression_attribute_values={
+                ":status": tasks.DynamoAttributeValue.from_string(status),
+                ":pipeline_status": tasks.DynamoAttributeValue.from_string(
+                    f"{self.pipeline_name}#{status}"
+                ),
+                ":tick": tasks.DynamoAttributeValue.from_number(0.000001),
+            },
+            result_path=sf.JsonPath.DISCARD,
+        )
+        # recording the history never fails the item
+        update.add_catch(
+            discard, errors=["States.ALL"], result_path=sf.JsonPath.DISCARD
+        )
+        update.next(discard)
+        return (
+            sf.Choice(self, f"{id}_traced"[:79])
+            .when(sf.Condition.is_present(trace_id), update)
+            .otherwise(discard)
+        )
@@ -1,5 +1,6 @@
 import logging
 import os
+from typing import Optional, Sequence
 
 from aws_cdk import (
     core,
@@ -11,7 +12,16 @@ logger = logging.getLogger(__name__)
 
 
 class SQSQueuePostLambda(lambda_.Function):
-    def __init__(self, scope: core.Construct, queue_name: str, sqs_queue: sqs.Queue):
+    def __init__(
+        self,
+        scope: core.Construct,
+        queue_name: str,
+        sqs_queues: Sequence[sqs.Queue],
+        partition_by: Optional[str] = None,
+        pack_messages: bool = False,
+        compress_messages: bool = False,
+        layer: Optional[lambda_.ILayerVersion] = None,
+    ):
         super().__init__(
             scope,
             f"send_to_{queue_name}"[:79],
@@ -20,9 +30,19 @@ class SQSQueuePostLambda(lambda_.Function):
                     os.path.dirname(__file__), "..", "..", "handlers", "sqs_send"
                 ),
             ),
-            environment={"QUEUE_URL": sqs_queue.queue_url},
+            environment={
+                # items are routed to a shard queue by their partition key
+                "QUEUE_URLS": core.Stack.of(scope).to_json_string(
+                    [sqs_queue.queue_url for sqs_queue in sqs_queues]
+                ),
+                **({"PARTITION_BY": partition_by} if partition_by else {}),
+                **({"PACK_MESSAGES": "1"} if pack_messages else {}),
+                **({"COMPRESS_MESSAGES": "1"} if compress_messages else {}),
+            },
             timeout=core.Duration.seconds(10),
             runtime=lambda_.Runtime.PYTHON_3_9,
             handler="handler.handler",
+            layers=[layer] if layer else None,
         )
-        sqs_queue.grant_send_messages(self)
+        for sqs_queue in sqs_queues:
+            sqs_queue.grant_send_messages(self)
@@ -1,7 +1,12 @@
+import hashlib
 import os
 from pathlib import Path
-from typing import Type
-from aws_cdk import core, aws_lambda as lambda_, aws_s3 as s3
+from typing import Any, Dict, Sequence, Type
+from aws_cdk import core, aws_iam as iam, aws_lambda as lambda_, aws_s3 as s3
+
+from ingest.emit import EMIT_TARGETS_ENV, QueueTarget
+from ingest.stack.naming import collector_queue_names, pipeline_state_machine_name
+from ingest.stack.handler import render_handler
 
 
 class StepLambda(lambda_.Function):
@@ -16,29 +21,46 @@ class StepLambda(lambda_.Function):
         code_dir: Path,
         default_requirements_path: Path,
         base_layer: lambda_.ILayerVersion,
+        # the pipelines the step emits to
+        emit_targets: Sequence[Any] = (),
         **kwargs,
     ):
+        from ingest.step import step_name, step_resources
+
         d = code_dir.relative_to(Path(os.path.curdir).resolve())
+        config = step_resources(step)
 
-        if step.requirements_path:
-            reqs = step.requirements_path.relative_to(code_dir)
+        if config["requirements_path"]:
+            reqs = config["requirements_path"].relative_to(code_dir)
         else:
             reqs = default_requirements_path.relative_to(code_dir)
 
-        handler_file = self.get_handler_template_contents().format(
-            handler_module=step.__module__, handler_class=step.__name__
-        )
-        self.lambda_name = step.__name__
+        handler_file = render_handler(step)
+        self.step = step
+        self.lambda_name = step_name(step)
         lambda_prefix = id[: 79 - len(self.lambda_name)]
 
         handler_name = "handler"
+        exclude = ["__pycache__", "cdk.out", ".ingest-build"]
+        # bundling is skipped when an asset with this hash is already staged
+        asset_hash = hashlib.sha256(
+            "".join(
+                [
+                    core.FileSystem.fingerprint(str(d.absolute()), exclude=exclude),
+                    handler_file,
+                    str(reqs),
+                ]
+            ).encode()
+        ).hexdigest()
 
         super().__init__(
             scope,
             f"{lambda_prefix}_{self.lambda_name}",
             code=lambda_.Code.from_asset(
                 str(d.absolute()),
-                exclude=["__pycache__"],
+                exclude=exclude,
+                asset_hash_type=core.AssetHashType.CUSTOM,
+                asset_hash=asset_hash,
                 bundling=core.BundlingOptions(
                     image=lambda_.Runtime.PYTHON_3_9.bundling_image,
                     command=[
@@ -51,22 +73,54 @@ class StepLambda(lambda_.Function):
             handler=f"{handler_name}.handler",
             timeout=core.Duration.minutes(1),
             runtime=lambda_.Runtime.PYTHON_3_9,
+            memory_size=config["memory_size"],
             layers=[base_layer],
         )
 
-        for permission in step.permissions:
+        for permission in config["permissions"]:
             self.grant_permission(permission)
 
-    def get_handler_template_contents(self):
-        template_file_path = os.path.join(
-            os.path.dirname(__file__),
-            "..",
-            "..",
-            "templates",
-            "handler.py.template",
-        )
-        with open(template_file_path, "r") as f:
-            return f.read()
+        if emit_targets:
+            self.grant_emit(emit_targets)
+
+    def grant_emit(self, pipelines: Sequence[Any]):
+        """Allow the step to send items to the pipelines it emits to: to the
+        queues of those starting with a collector, and otherwise to start
+        their first workflow"""
+        from ingest.step import is_collector, step_resources
+
+        stack = core.Stack.of(self)
+        targets: Dict[str, Any] = {}
+        for pipeline in pipelines:
+            first = pipeline.steps[0]
+            if is_collector(first):
+                names = collector_queue_names(first)
+                config = step_resources(first)
+                targets[pipeline.name] = QueueTarget(
+                    queue_urls=[
+                        f"https://sqs.{stack.region}.{stack.url_suffix}/{stack.account}/{name}"
+                        for name in names
+                    ],
+                    partition_by=config["partition_by"],
+                    compress_messages=config["compress_messages"],
+                ).dict()
+                actions = ["sqs:SendMessage"]
+                resources = [
+                    stack.format_arn(service="sqs", resource=name) for name in names
+                ]
+            else:
+                targets[pipeline.name] = stack.format_arn(
+                    service="states",
+                    resource="stateMachine",
+                    resource_name=pipeline_state_machine_name(pipeline.name),
+                    sep=":",
+                )
+                actions = ["states:StartExecution"]
+                resources = [targets[pipeline.name]]
+            self.add_to_role_policy(
+                iam.PolicyStatement(actions=actions, resources=resources)
+            )
+        self.add_environment(EMIT_TARGETS_ENV, stack.to_json_string(targets))
 
     def grant_permission(self, permission: Permission):
         from ingest.permissions import S3Access
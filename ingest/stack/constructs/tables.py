@@ -0,0 +1,56 @@
+from typing import Optional
+from aws_cdk import core, aws_dynamodb as dynamodb
+
+
+def rate_limit_table(
+    scope: core.Construct, id: str, table_name: Optional[str] = None
+) -> dynamodb.ITable:
+    """The table rate limits are shared through, an existing one if named
+    (e.g. to share limits with other pipelines)"""
+    if table_name:
+        return dynamodb.Table.from_table_name(scope, id, table_name)
+    return dynamodb.Table(
+        scope,
+        id,
+        partition_key=dynamodb.Attribute(name="pk", type=dynamodb.AttributeType.STRING),
+        billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+        # buckets and slots are only state, rebuilt as executions resume
+        removal_policy=core.RemovalPolicy.DESTROY,
+    )
+
+
+def history_table(
+    scope: core.Construct, id: str, table_name: Optional[str] = None
+) -> dynamodb.ITable:
+    """The table runs are recorded in (see DynamoDBHistoryStore), an
+    existing one if named"""
+    if table_name:
+        return dynamodb.Table.from_table_attributes(
+            scope, id, table_name=table_name, global_indexes=["by_status", "by_key"]
+        )
+    table = dynamodb.Table(
+        scope,
+        id,
+        partition_key=dynamodb.Attribute(name="pk", type=dynamodb.AttributeType.STRING),
+        sort_key=dynamodb.Attribute(name="sk", type=dynamodb.AttributeType.STRING),
+        billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+    )
+    table.add_global_secondary_index(
+        index_name="by_status",
+        partition_key=dynamodb.Attribute(
+            name="pipeline_status", type=dynamodb.AttributeType.STRING
+        ),
+        sort_key=dynamodb.Attribute(
+            name="started_at", type=dynamodb.AttributeType.NUMBER
+        ),
+    )
+    table.add_global_secondary_index(
+        index_name="by_key",
+        partition_key=dynamodb.Attribute(
+            name="pipeline", type=dynamodb.AttributeType.STRING
+        ),
+        sort_key=dynamodb.Attribute(
+            name="input_key", type=dynamodb.AttributeType.STRING
+        ),
+    )
+    return table
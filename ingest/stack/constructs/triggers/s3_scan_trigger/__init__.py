@@ -0,0 +1,93 @@
+import os
+from typing import Optional
+from aws_cdk import (
+    core,
+    aws_events as events,
+    aws_events_targets as targets,
+    aws_iam as iam,
+    aws_lambda as lambda_,
+    aws_s3 as s3,
+    aws_stepfunctions as sf,
+)
+
+from ingest.backpressure import MAX_OBJECTS_ENV
+from ingest.history import PIPELINE_ENV
+from ingest.stack.constructs.triggers.trigger import TriggerConstruct
+from ingest.stack.naming import pipeline_resource_name
+
+
+class S3ScanTriggerConstruct(TriggerConstruct):
+    from ingest.trigger import S3ScanTrigger
+
+    def __init__(
+        self,
+        scope: core.Construct,
+        id: str,
+        pipeline_name: str,
+        state_machine: sf.StateMachine,
+        trigger: S3ScanTrigger,
+        layer: Optional[lambda_.ILayerVersion] = None,
+        max_objects_per_execution: Optional[int] = None,
+        **kwargs,
+    ):
+        super().__init__(
+            scope,
+            id,
+            pipeline_name=pipeline_name,
+            state_machine=state_machine,
+            trigger=trigger,
+            **kwargs,
+        )
+        parameter_name = (
+            f"/ingest/{pipeline_resource_name(pipeline_name)}/scan_watermarks"
+        )
+        l = lambda_.Function(
+            self,
+            f"s3_scan_{pipeline_name}"[:79],
+            code=lambda_.Code.from_asset(
+                os.path.join(os.path.dirname(__file__), "handler"),
+            ),
+            environment={
+                "STATE_MACHINE_ARN": state_machine.state_machine_arn,
+                "SCAN_CONFIG": trigger.json(exclude={"output_type"}),
+                "WATERMARK_PARAMETER": parameter_name,
+                PIPELINE_ENV: pipeline_name,
+                **(
+                    {MAX_OBJECTS_ENV: str(max_objects_per_execution)}
+                    if max_objects_per_execution
+                    else {}
+                ),
+            },
+            timeout=core.Duration.minutes(15),
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            handler="handler.handler",
+            layers=[layer] if layer else None,
+            # scans must not overlap, as each advances the watermarks
+            reserved_concurrent_executions=1,
+            # an interrupted scan resumes on the next schedule
+            retry_attempts=0,
+        )
+        state_machine.grant_start_execution(l)
+        s3.Bucket.from_bucket_name(
+            self, f"scan_bucket_{pipeline_name}"[:79], trigger.bucket_name
+        ).grant_read(l)
+        l.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["ssm:GetParameter", "ssm:PutParameter"],
+                resources=[
+                    core.Stack.of(self).format_arn(
+                        service="ssm",
+                        resource="parameter",
+                        resource_name=parameter_name.lstrip("/"),
+                    )
+                ],
+            )
+        )
+        events.Rule(
+            self,
+            f"s3_scan_schedule_{pipeline_name}"[:79],
+            schedule=events.Schedule.rate(
+                core.Duration.minutes(trigger.interval_minutes)
+            ),
+            targets=[targets.LambdaFunction(l)],
+        )
@@ -0,0 +1,39 @@
+import logging
+import os
+
+from ingest.backpressure import BackpressureConfig, ExecutionStarter
+from ingest.log import configure_logging
+from ingest.resources import get_pool
+from ingest.scan import (
+    BucketScanner,
+    S3Lister,
+    ScanConfig,
+    SSMWatermarkStore,
+    start_executions,
+)
+
+configure_logging()
+logger = logging.getLogger("ingest.triggers.s3_scan")
+
+# time left for the batch in progress when a scan stops early
+STOP_MARGIN_MS = 60_000
+
+
+def handler(event, context):
+    starter = ExecutionStarter(
+        client=get_pool().client(
+            "stepfunctions", retries={"max_attempts": 3, "mode": "standard"}
+        ),
+        state_machine_arn=os.environ["STATE_MACHINE_ARN"],
+        config=BackpressureConfig.from_env(os.environ),
+    )
+    scanner = BucketScanner(
+        ScanConfig.parse_raw(os.environ["SCAN_CONFIG"]),
+        lister=S3Lister(),
+        store=SSMWatermarkStore(os.environ["WATERMARK_PARAMETER"]),
+        start=start_executions(starter),
+        should_stop=lambda: context.get_remaining_time_in_millis() < STOP_MARGIN_MS,
+    )
+    report = scanner.scan()
+    logger.info(f"Scanned {report.objects} objects in {report.batches} batches")
+    return report.dict()
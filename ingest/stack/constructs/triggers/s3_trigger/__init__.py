@@ -1,17 +1,25 @@
+import logging
 import os
+from typing import Optional
 from aws_cdk import (
     core,
     aws_lambda as lambda_,
     aws_s3 as s3,
     aws_s3_notifications as s3n,
+    aws_sqs as sqs,
     aws_stepfunctions as sf,
 )
 
+from ingest.history import PIPELINE_ENV
+from ingest.stack.constructs.triggers.sqs_trigger import SQSTriggerConstruct
 from ingest.stack.constructs.triggers.trigger import TriggerConstruct
+from ingest.stack.naming import pipeline_resource_name
+
+logger = logging.getLogger(__name__)
 
 
 class S3TriggerConstruct(TriggerConstruct):
-    from ingest.trigger import S3Trigger
+    from ingest.trigger import S3Buffer, S3Trigger
 
     def __init__(
         self,
@@ -20,6 +28,8 @@ class S3TriggerConstruct(TriggerConstruct):
         pipeline_name: str,
         state_machine: sf.StateMachine,
         trigger: S3Trigger,
+        layer: Optional[lambda_.ILayerVersion] = None,
+        max_objects_per_execution: Optional[int] = None,
         **kwargs,
     ):
         super().__init__(
@@ -30,28 +40,99 @@ class S3TriggerConstruct(TriggerConstruct):
             trigger=trigger,
             **kwargs,
         )
+        bucket = s3.Bucket.from_bucket_name(
+            self, f"trigger_bucket_{pipeline_name}"[:79], trigger.bucket_name
+        )
+        if trigger.buffer:
+            destination = self.create_buffer(
+                pipeline_name,
+                state_machine,
+                trigger,
+                trigger.buffer,
+                layer=layer,
+                max_objects_per_execution=max_objects_per_execution,
+            )
+        else:
+            destination = self.create_trigger_lambda(
+                pipeline_name, state_machine, bucket, layer=layer
+            )
+        for event_type in trigger.events:
+            logger.debug(
+                "Adding %s notification for %s with filter %s",
+                event_type,
+                trigger.bucket_name,
+                trigger.notification_key_filter_kwargs,
+            )
+            bucket.add_event_notification(
+                getattr(s3.EventType, event_type),
+                destination,
+                s3.NotificationKeyFilter(**trigger.notification_key_filter_kwargs),
+            )
+
+    def create_trigger_lambda(
+        self,
+        pipeline_name: str,
+        state_machine: sf.StateMachine,
+        bucket: s3.IBucket,
+        layer: Optional[lambda_.ILayerVersion],
+    ) -> s3.IBucketNotificationDestination:
+        """Start an execution per object from a Lambda notified by the bucket"""
         l = lambda_.Function(
             self,
             f"s3_trigger_{pipeline_name}"[:79],
             code=lambda_.Code.from_asset(
                 os.path.join(os.path.dirname(__file__), "handler"),
             ),
-            environment={"STATE_MACHINE_ARN": state_machine.state_machine_arn},
+            environment={
+                "STATE_MACHINE_ARN": state_machine.state_machine_arn,
+                PIPELINE_ENV: pipeline_name,
+            },
             timeout=core.Duration.seconds(30),
             runtime=lambda_.Runtime.PYTHON_3_9,
             handler="handler.handler",
+            # the handler shares the framework's resource pool
+            layers=[layer] if layer else None,
         )
         state_machine.grant_start_execution(l)
-        bucket = s3.Bucket.from_bucket_name(
-            self, f"trigger_bucket_{pipeline_name}"[:79], trigger.bucket_name
-        )
         bucket.grant_read(l)
-        for event_type in trigger.events:
-            print(f"Adding event notification for {event_type}")
-            print(trigger.notification_key_filter_kwargs)
-            print(bucket.bucket_name)
-            bucket.add_event_notification(
-                getattr(s3.EventType, event_type),
-                s3n.LambdaDestination(l),
-                s3.NotificationKeyFilter(**trigger.notification_key_filter_kwargs),
-            )
+        return s3n.LambdaDestination(l)
+
+    def create_buffer(
+        self,
+        pipeline_name: str,
+        state_machine: sf.StateMachine,
+        trigger: S3Trigger,
+        buffer: S3Buffer,
+        layer: Optional[lambda_.ILayerVersion],
+        max_objects_per_execution: Optional[int] = None,
+    ) -> s3.IBucketNotificationDestination:
+        """Queue notifications, starting an execution per batch of objects"""
+        from ingest.trigger import SQSTrigger
+
+        queue_name = f"{pipeline_resource_name(pipeline_name)}_s3_buffer"[:80]
+        queue = sqs.Queue(
+            self,
+            queue_name,
+            queue_name=queue_name,
+            # longer than the consumer's timeout
+            visibility_timeout=core.Duration.minutes(2),
+        )
+        SQSTriggerConstruct(
+            self,
+            "S3Buffer",
+            pipeline_name=pipeline_name,
+            state_machine=state_machine,
+            trigger=SQSTrigger(
+                queue_name=queue_name,
+                output_type=trigger.output_type,
+                batch_size=buffer.batch_size,
+                max_batching_window=buffer.max_batching_window,
+                max_concurrency=buffer.max_concurrency,
+                max_running_executions=buffer.max_running_executions,
+            ),
+            sqs_queue=queue,
+            layer=layer,
+            input_format="s3_objects",
+            max_objects_per_execution=max_objects_per_execution,
+        )
+        return s3n.SqsDestination(queue)
@@ -2,8 +2,11 @@ import json
 import logging
 import os
 from uuid import uuid4
-import boto3
-from botocore.config import Config
+
+from ingest.data_types import objects_from_s3_event
+from ingest.log import configure_logging
+from ingest.resources import get_pool
+from ingest.tracing import current_context, get_tracer, inject
 
 
 def prepare_execution_name(name: str) -> str:
@@ -25,22 +28,24 @@ class StepFunctionValidationException(Exception):
     pass
 
 
-logger = logging.getLogger(__name__)
+configure_logging()
+logger = logging.getLogger("ingest.triggers.s3")
 
 
 def handler(event, context) -> None:
-    client = boto3.client(
-        "stepfunctions", config=Config(retries={"max_attempts": 10, "mode": "standard"})
+    client = get_pool().client(
+        "stepfunctions", retries={"max_attempts": 10, "mode": "standard"}
     )
-    for event in event["Records"]:
-        bucket = event["s3"]["bucket"]["name"]
-        key = event["s3"]["object"]["key"]
+    tracer = get_tracer()
+    for obj in objects_from_s3_event(event):
         try:
-            response = client.start_execution(
-                stateMachineArn=os.environ["STATE_MACHINE_ARN"],
-                name=prepare_execution_name(key),
-                input=json.dumps({"bucket": bucket, "key": key}),
-            )
+            # each object starts a trace of its run
+            with tracer.span("trigger", kind="trigger", key=obj.key):
+                response = client.start_execution(
+                    stateMachineArn=os.environ["STATE_MACHINE_ARN"],
+                    name=prepare_execution_name(obj.key),
+                    input=json.dumps(inject(obj.dict(), current_context())),
+                )
             logger.debug(response)
         except client.exceptions.ClientError as e:
             code = e.response["Error"]["Code"]
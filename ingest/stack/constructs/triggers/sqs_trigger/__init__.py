@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 from aws_cdk import (
     core,
     aws_lambda as lambda_,
@@ -9,6 +10,8 @@ from aws_cdk import (
     aws_stepfunctions as sf,
 )
 
+from ingest.backpressure import ADAPTIVE_BATCHING_ENV, MAX_OBJECTS_ENV
+from ingest.history import PIPELINE_ENV
 from ingest.stack.constructs.triggers.trigger import TriggerConstruct
 
 
@@ -23,6 +26,9 @@ class SQSTriggerConstruct(TriggerConstruct):
         state_machine: sf.StateMachine,
         trigger: SQSTrigger,
         sqs_queue: sqs.Queue,
+        layer: Optional[lambda_.ILayerVersion] = None,
+        input_format: str = "records",
+        max_objects_per_execution: Optional[int] = None,
         **kwargs,
     ):
         super().__init__(
@@ -42,12 +48,40 @@ class SQSTriggerConstruct(TriggerConstruct):
             environment={
                 "STATE_MACHINE_ARN": state_machine.state_machine_arn,
                 "QUEUE_NAME": trigger.queue_name,
+                "QUEUE_URL": sqs_queue.queue_url,
+                **(
+                    {"MAX_RUNNING_EXECUTIONS": str(trigger.max_running_executions)}
+                    if trigger.max_running_executions
+                    else {}
+                ),
+                **(
+                    {"PARTITION_BY": trigger.partition_by}
+                    if trigger.partition_by
+                    else {}
+                ),
+                **(
+                    {ADAPTIVE_BATCHING_ENV: trigger.adaptive_batching.json()}
+                    if trigger.adaptive_batching
+                    else {}
+                ),
+                "INPUT_FORMAT": input_format,
+                **(
+                    {MAX_OBJECTS_ENV: str(max_objects_per_execution)}
+                    if max_objects_per_execution and input_format == "s3_objects"
+                    else {}
+                ),
+                PIPELINE_ENV: pipeline_name,
             },
             timeout=core.Duration.seconds(30),
             runtime=lambda_.Runtime.PYTHON_3_9,
             handler="handler.handler",
+            layers=[layer] if layer else None,
+            # bounds how many batches are consumed concurrently
+            reserved_concurrent_executions=trigger.max_concurrency,
         )
         state_machine.grant_start_execution(l)
+        # required to count running executions
+        state_machine.grant_read(l)
         # sqs_queue = sqs.Queue.from_queue_attributes(
         #     self, "sqs_queue", queue_name=trigger.queue_name
         # )
@@ -57,5 +91,7 @@ class SQSTriggerConstruct(TriggerConstruct):
                 sqs_queue,
                 batch_size=trigger.batch_size,
                 max_batching_window=core.Duration.seconds(trigger.max_batching_window),
+                # deferred records are returned to the queue individually
+                report_batch_item_failures=True,
             )
         )
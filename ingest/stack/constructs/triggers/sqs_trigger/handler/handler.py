@@ -1,10 +1,11 @@
-import datetime
-import json
 import logging
 import os
+from typing import Optional
 from uuid import uuid4
-import boto3
-from botocore.config import Config
+
+from ingest.backpressure import BackpressureConfig, ExecutionStarter
+from ingest.log import configure_logging
+from ingest.resources import get_pool
 
 
 def prepare_execution_name(name: str) -> str:
@@ -20,33 +21,29 @@ def prepare_execution_name(name: str) -> str:
     # return f"{cleaned_name}{suffix}"[-80:]
 
 
-class StepFunctionThrottled(Exception):
-    pass
-
+configure_logging()
+logger = logging.getLogger("ingest.triggers.sqs")
 
-class StepFunctionValidationException(Exception):
-    pass
+# reused across warm invocations, so throttle history carries over
+starter: Optional[ExecutionStarter] = None
 
 
-logger = logging.getLogger(__name__)
+def get_starter() -> ExecutionStarter:
+    global starter
+    if starter is None:
+        starter = ExecutionStarter(
+            client=get_pool().client(
+                "stepfunctions", retries={"max_attempts": 3, "mode": "standard"}
+            ),
+            state_machine_arn=os.environ["STATE_MACHINE_ARN"],
+            config=BackpressureConfig.from_env(os.environ),
+            sqs_client=get_pool().client("sqs"),
+            queue_url=os.environ.get("QUEUE_URL"),
+        )
+    return starter
 
 
-def handler(event, context) -> None:
-    client = boto3.client(
-        "stepfunctions", config=Config(retries={"max_attempts": 10, "mode": "standard"})
+def handler(event, context):
+    return get_starter().process(
+        event["Records"], name=prepare_execution_name(os.environ["QUEUE_NAME"])
     )
-    try:
-        response = client.start_execution(
-            stateMachineArn=os.environ["STATE_MACHINE_ARN"],
-            name=prepare_execution_name(os.environ["QUEUE_NAME"]),
-            input=json.dumps(event),
-        )
-        logger.debug(response)
-    except client.exceptions.ClientError as e:
-        code = e.response["Error"]["Code"]
-        if code == "ThrottlingException":
-            raise StepFunctionThrottled(str(e)) from e
-        elif code == "ValidationException":
-            raise StepFunctionValidationException(str(e)) from e
-        else:
-            raise e
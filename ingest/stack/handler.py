@@ -0,0 +1,31 @@
+import base64
+import json
+import os
+
+from ingest.step import step_class
+
+TEMPLATE_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "templates", "handler.py.template"
+)
+
+
+def encode_params(step) -> str:
+    """Encode a step's parameters for embedding in its handler"""
+    try:
+        params = json.dumps(step.params())
+    except TypeError as e:
+        raise TypeError(
+            f"Parameters of {step.__name__} must be JSON serializable: {e}"
+        ) from e
+    return base64.b64encode(params.encode()).decode()
+
+
+def render_handler(step) -> str:
+    """The source of the Lambda handler module for a step class or instance"""
+    with open(TEMPLATE_PATH, "r") as f:
+        template = f.read()
+    return template.format(
+        handler_module=step.__module__,
+        handler_class=step_class(step).__name__,
+        params=encode_params(step),
+    )
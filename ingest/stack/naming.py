@@ -1,8 +1,39 @@
-from typing import Type
-from ingest.step import Collector
+from typing import Any, Optional
+from ingest.step import step_resources
 
 
-def collector_queue_name(collector: Type[Collector]):
+def collector_queue_name(collector: Any, shard: Optional[int] = None):
     # this needs some protection against reusing
     # the same collector class within one pipeline
-    return f"{collector.__name__}_queue"
+    if shard is None:
+        return f"{collector.__name__}_queue"
+    return f"{collector.__name__}_queue_{shard}"
+
+
+def collector_queue_names(collector: Any):
+    """Names of the queues feeding a collector, one per partition shard"""
+    config = step_resources(collector)
+    if config["partition_by"] is None or config["partition_shards"] <= 1:
+        return [collector_queue_name(collector)]
+    return [
+        collector_queue_name(collector, shard)
+        for shard in range(config["partition_shards"])
+    ]
+
+
+def pipeline_resource_name(pipeline_name: str) -> str:
+    return pipeline_name.replace(" ", "_")
+
+
+def prefixed_state_machine_name(id: str, state_machine_name: str) -> str:
+    state_machine_prefix = id[: 79 - len(state_machine_name)]
+    return f"{state_machine_prefix}_{state_machine_name}".lower()
+
+
+def pipeline_state_machine_name(pipeline_name: str, workflow_num: int = 0) -> str:
+    """Name of the state machine for one of a pipeline's workflows. The
+    first workflow is the one started by the pipeline's trigger."""
+    return prefixed_state_machine_name(
+        f"StateMachine{workflow_num}",
+        f"{pipeline_resource_name(pipeline_name)}{workflow_num}",
+    )
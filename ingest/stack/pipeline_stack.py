@@ -1,21 +1,44 @@
+import hashlib
 import logging
 import os
 from pathlib import Path
 import subprocess
 import sys
-from typing import Sequence, Type
+from typing import List, Sequence, Type, Union
 from aws_cdk import (
     core,
+    aws_dynamodb as dynamodb,
     aws_lambda as lambda_,
     aws_sqs as sqs,
 )
 
+from ingest.history import HISTORY_TABLE_ENV
+from ingest.parallel import Parallel
+from ingest.ratelimit import RATE_LIMIT_TABLE_ENV
 from ingest.stack.constructs.pipeline_workflow import PipelineWorkflow
-from ingest.stack.naming import collector_queue_name
+from ingest.stack.constructs.step_lambda import StepLambda
+from ingest.stack.constructs.tables import history_table, rate_limit_table
+from ingest.segments import split_segments
+from ingest.stack.naming import collector_queue_names
+from ingest.step import step_resources
 
 logger = logging.getLogger(__name__)
 
 
+def source_stamp(source: str) -> str:
+    """A hash of the framework's package source"""
+    digest = hashlib.sha256()
+    root = Path(source).resolve()
+    paths = [root / "setup.py", root / "VERSION"] + sorted(
+        p for p in (root / "ingest").rglob("*") if "__pycache__" not in p.parts
+    )
+    for path in paths:
+        if path.is_file():
+            digest.update(str(path.relative_to(root)).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
 class PipelineStack(core.Stack):
     from ingest.pipeline import Pipeline
     from ingest.step import Step
@@ -27,38 +50,43 @@ class PipelineStack(core.Stack):
         code_dir: Path,
         requirements_path: Path,
         pipeline: Pipeline,
-        steps: Sequence[Type[Step]],
+        steps: Sequence[Union[Type[Step], Step, Parallel]],
         *args,
         **kwargs,
     ):
-        from ingest.step import Collector
-
         super().__init__(scope, id, **kwargs)
 
         layer = self.create_dependencies_layer()
+        history = None
+        if pipeline.history_table:
+            history = history_table(
+                self,
+                "History",
+                pipeline.history_table
+                if isinstance(pipeline.history_table, str)
+                else None,
+            )
 
-        collectors = [
-            (i, step) for i, step in enumerate(steps) if issubclass(step, Collector)
-        ]
-
-        starting_idx = 0
-        trigger_queue = None
-        for i, (idx, collector) in enumerate(
-            collectors or [(len(steps), None)]  # type:ignore
-        ):
-            logger.debug(f"Creating workflow for steps {starting_idx} to {idx}")
-            if collector:
-                target_queue = sqs.Queue(
-                    self,
-                    collector_queue_name(collector),
-                    queue_name=collector_queue_name(collector),
-                    visibility_timeout=core.Duration.minutes(
-                        11
-                    ),  # TODO: make this configurable
-                    receive_message_wait_time=core.Duration.seconds(
-                        10
-                    ),  # TODO: make this configurable
-                )
+        trigger_queues: List[sqs.Queue] = []
+        for i, segment in enumerate(split_segments(steps)):
+            logger.debug(f"Creating workflow {i} for steps {segment.steps}")
+            target_queues = []
+            if segment.collector:
+                # partitioned collectors may be spread over several queues
+                for queue_name in collector_queue_names(segment.collector):
+                    target_queues.append(
+                        sqs.Queue(
+                            self,
+                            queue_name,
+                            queue_name=queue_name,
+                            visibility_timeout=core.Duration.minutes(
+                                11
+                            ),  # TODO: make this configurable
+                            receive_message_wait_time=core.Duration.seconds(
+                                10
+                            ),  # TODO: make this configurable
+                        )
+                    )
             PipelineWorkflow(
                 self,
                 f"Workflow{i}",
@@ -66,30 +94,40 @@ class PipelineStack(core.Stack):
                 pipeline=pipeline,
                 code_dir=code_dir,
                 requirements_path=requirements_path,
-                steps=steps[starting_idx:idx],
+                steps=segment.steps,
                 layer=layer,
-                collector=collector,  # type: ignore
-                target_queue=target_queue,
-                trigger_queue=trigger_queue,
+                collector=segment.collector,  # type: ignore
+                target_queues=target_queues,
+                trigger_queues=trigger_queues,
+                history_table=history,
             )
-            starting_idx = idx
-            trigger_queue = target_queue
-        else:
-            if starting_idx < len(
-                steps
-            ):  # There are remaining steps after the final collector
-                logger.debug(f"Creating workflow for steps {starting_idx} to end")
-                PipelineWorkflow(
-                    self,
-                    f"Workflow{i+1}",
-                    workflow_num=i + 1,
-                    pipeline=pipeline,
-                    code_dir=code_dir,
-                    requirements_path=requirements_path,
-                    steps=steps[starting_idx:],
-                    layer=layer,
-                    trigger_queue=trigger_queue,
-                )
+            trigger_queues = target_queues
+
+        if history is not None:
+            self.record_history(history)
+
+        if pipeline.rate_limited:
+            self.share_rate_limits(pipeline)
+
+    def record_history(self, table: dynamodb.ITable):
+        """Record runs from every function of the pipeline, triggers
+        included, so that each run's trace starts with its trigger"""
+        for construct in self.node.find_all():
+            if isinstance(construct, lambda_.Function):
+                construct.add_environment(HISTORY_TABLE_ENV, table.table_name)
+                table.grant_read_write_data(construct)
+
+    def share_rate_limits(self, pipeline: Pipeline):
+        """Share the rate limits of steps across their concurrent
+        invocations through a table"""
+        table = rate_limit_table(self, "RateLimits", pipeline.rate_limit_table)
+        for construct in self.node.find_all():
+            if (
+                isinstance(construct, StepLambda)
+                and step_resources(construct.step)["rate_limit"]
+            ):
+                construct.add_environment(RATE_LIMIT_TABLE_ENV, table.table_name)
+                table.grant_read_write_data(construct)
 
     def create_dependencies_layer(
         self,
@@ -100,18 +138,26 @@ class PipelineStack(core.Stack):
         except FileExistsError:
             pass
 
-        subprocess.check_call(
-            [
-                sys.executable,
-                "-m",
-                "pip",
-                "install",
-                "--upgrade",
-                os.path.join(os.path.dirname(__file__), "..", ".."),
-                "-t",
-                f"{dir_name}/python/lib/python3.9/site-packages/",
-            ]
-        )
+        # only reinstall the framework when its source has changed
+        source = os.path.join(os.path.dirname(__file__), "..", "..")
+        stamp_path = os.path.join(dir_name, ".stamp")
+        stamp = source_stamp(source)
+        if not os.path.exists(stamp_path) or Path(stamp_path).read_text() != stamp:
+            subprocess.check_call(
+                [
+                    sys.executable,
+                    "-m",
+                    "pip",
+                    "install",
+                    "--upgrade",
+                    source,
+                    "-t",
+                    f"{dir_name}/python/lib/python3.9/site-packages/",
+                ]
+            )
+            Path(stamp_path).write_text(stamp)
+        else:
+            logger.debug("Reusing dependency layer")
         layer = lambda_.LayerVersion(
             self,
             "IngestDependencies",
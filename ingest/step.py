@@ -1,42 +1,146 @@
 from datetime import timedelta
-import json
 from pathlib import Path
-from typing import Optional, Protocol, get_args, Sequence, TypeVar
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Protocol,
+    Sequence,
+    TypeVar,
+)
 
 # from uuid import uuid4
 
 from pydantic import UUID4, BaseModel
 
+from ingest.batching import AdaptiveBatching
 from ingest.cache import BatchCache
+from ingest.log import log_invocation
+from ingest.packing import unpack_body
+from ingest.partitioning import partition_key
 from ingest.permissions import Permission
+from ingest.policies import CatchPolicy, RetryPolicy
+from ingest.ratelimit import RateLimit, rate_limited
+from ingest.registry import (
+    StepKind,
+    StepMetadata,
+    get_base,
+    registry,
+    resolve_types,
+)
+from ingest.resources import StepContext
+from ingest.result_cache import ResultCache, cached_execute, input_digest
 
 I = TypeVar("I", bound=BaseModel)
 O = TypeVar("O", covariant=True, bound=BaseModel)
 I_co = TypeVar("I_co", covariant=True)
 
 
-def get_base(cls):
-    """Utility for retrieving the base class"""
-    if hasattr(cls, "__orig_bases__"):
-        return get_base(cls.__orig_bases__[0])
-    else:
-        return cls
+class hybridmethod:
+    """
+    A method bound to the instance when called on a step instance, and to
+    the class when called on a step class, so that the framework can
+    drive both instance-based and class-based steps.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, objtype=None):
+        return self.func.__get__(objtype if obj is None else obj, objtype)
 
 
 class Step(Protocol[I_co, O]):
+    """
+    Steps may be used as classes, with classmethods, or as instances
+    carrying parameters passed to their constructor. Parameters must be
+    JSON serializable, as deployed handlers rebuild the step from them.
+
+    `setup` runs once before a step instance handles any input: once per
+    warm Lambda container, and once per local runner. Expensive resources
+    (connections, models, sessions) belong there rather than in `execute`.
+    """
+
     permissions: Sequence[Permission] = []
     requirements_path: Optional[Path] = None
+    retry: Sequence[RetryPolicy] = []
+    catch: Sequence[CatchPolicy] = []
+    # cacheable steps must be pure functions of their input. Bump the
+    # version whenever a change to the step alters its output.
+    cacheable: bool = False
+    version: str = "1"
+    result_cache: Optional[ResultCache] = None
+    # names of the pipelines (in the same IngestApp) this step emits items to
+    emits: Sequence[str] = []
+    # Lambda memory in MB, see Pipeline.profile for recommendations
+    memory_size: Optional[int] = None
+    # level of the step's logger, see ingest.log
+    log_level: Optional[str] = None
+    # bounds the rate and concurrency of the step's executions, see
+    # ingest.ratelimit
+    rate_limit: Optional[RateLimit] = None
 
-    @classmethod
-    def get_output(cls) -> O:
-        return get_args(get_base(cls))[1]
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if resolve_types(cls) is not None:
+            register(cls)
 
-    @classmethod
-    def get_input(cls) -> I_co:
-        return get_args(get_base(cls))[0]
+    def __new__(cls, *args, **kwargs):
+        step = super().__new__(cls)
+        step._params = {"args": list(args), "kwargs": kwargs}
+        return step
+
+    @property
+    def __name__(self) -> str:
+        return step_name(self)
+
+    @hybridmethod
+    def params(self) -> Optional[Dict[str, Any]]:
+        """The constructor arguments of a step instance, or None for a class"""
+        return getattr(self, "_params", None)
+
+    @hybridmethod
+    def setup(self) -> None:
+        pass
+
+    @hybridmethod
+    def teardown(self) -> None:
+        """Release what `setup` created. Only run locally, when a runner is
+        closed: deployed containers are shut down without notice, so
+        steps mustn't rely on it to persist state."""
+
+    @hybridmethod
+    def get_output(self) -> O:
+        return step_metadata(self).output_type
+
+    @hybridmethod
+    def get_input(self) -> I_co:
+        return step_metadata(self).input_type
 
     @classmethod
-    def handler(cls, event, context) -> O:
+    def execute(cls, input):
+        raise NotImplementedError()
+
+    @hybridmethod
+    def invoke(self, input, context: Optional[StepContext] = None):
+        """Execute the step, reusing a cached result when the
+        step is cacheable. Steps whose `execute` accepts a `context`
+        argument receive the shared resource pool through it. Executions
+        wait for the step's rate limit, cache hits don't."""
+        # subclasses may declare a context argument the base doesn't
+        run: Callable[..., Any] = self.execute
+        if step_metadata(self).accepts_context:
+            context = context or StepContext()
+            execute = lambda i: run(input=i, context=context)
+        else:
+            execute = lambda i: run(input=i)
+        return cached_execute(self, input, rate_limited(self, execute))
+
+    @hybridmethod
+    def handler(self, event, context) -> O:
         raise NotImplementedError
 
 
@@ -49,13 +153,11 @@ class Transformer(Step[I, O]):
     def execute(cls, input: I) -> O:
         raise NotImplementedError()
 
-    @classmethod
-    def handler(cls, event, context) -> O:
-        print(f"Event: {event}")
-        print(f"Context: {context}")
-        input_data = cls.get_input().parse_obj(event)
-        print(f"Input: {input_data}")
-        result = cls.execute(input=input_data)
+    @hybridmethod
+    def handler(self, event, context) -> O:
+        log_invocation(self, event, context)
+        input_data = self.get_input().parse_obj(event)
+        result = self.invoke(input_data, StepContext(lambda_context=context))
         return result
 
 
@@ -71,34 +173,167 @@ class Collector(Step[I, O]):
 
     batch_size: int = 100
     max_batching_window: int = 60
-    cache: BatchCache
+    # Adjust the batch size and window to the load, within these bounds,
+    # in place of batch_size and max_batching_window
+    adaptive_batching: Optional[AdaptiveBatching] = None
+    max_concurrency: Optional[int] = None
+    max_running_executions: Optional[int] = None
+    # Dotted path of an input field whose value partitions batches, so that
+    # each batch only holds items with the same value. Each partition is
+    # subject to its own batch size and batching window.
+    partition_by: Optional[str] = None
+    # number of queues partitions are spread across when deployed
+    partition_shards: int = 1
+    # Pack the items sent from an execution of the previous workflow into as
+    # few messages as fit, rather than one message per item, optionally
+    # gzipped. Only executions which carry a batch of objects (from a
+    # buffered or scan trigger) send several items, and their outputs share
+    # the Step Functions payload limit.
+    pack_messages: bool = False
+    compress_messages: bool = False
+    # Upper bound on the size of an item sent to the collector. Executions
+    # which carry a batch of objects gather the items of all of them before
+    # packing, within the Step Functions payload limit, so this bounds how
+    # many objects those executions take.
+    max_item_bytes: int = 10_000
+    # Send items to the queue with Step Functions' SQS integration rather
+    # than a Lambda. Requires a single queue, and unpacked messages.
+    native_send: bool = False
+
+    @hybridmethod
+    def partition_key(self, input: I) -> Optional[str]:
+        if self.partition_by is None:
+            return None
+        return partition_key(input, self.partition_by)
 
-    def collect_input(self, input: I) -> None:
-        self.cache.queue_data(data=input)
+    @hybridmethod
+    def collect_input(self, cache: BatchCache, input: I) -> None:
+        cache.queue_data(data=input)
 
-    def ready(self) -> bool:
-        return (
-            self.cache.queue_size >= self.batch_size
-            or self.cache.time_since_first_item()
+    @hybridmethod
+    def ready(self, cache: BatchCache) -> bool:
+        return cache.queue_size > 0 and (
+            cache.queue_size >= self.batch_size
+            or cache.time_since_first_item()
             >= timedelta(seconds=self.max_batching_window)
         )
 
-    def fetch_batch(self) -> Sequence[I]:
-        return self.cache.fetch(self.batch_size)
+    @hybridmethod
+    def fetch_batch(self, cache: BatchCache) -> Sequence[I]:
+        return cache.fetch(self.batch_size)
 
     @classmethod
     def execute(cls, input: Sequence[I]) -> O:
         raise NotImplementedError()
 
-    @classmethod
-    def handler(cls, event, context) -> O:
-        print(event)
-        print(context)
-        input_type = cls.get_input()
-        result = cls.execute(
-            input=[
-                input_type.parse_obj(json.loads(record.get("body")))
+    @hybridmethod
+    def handler(self, event, context) -> O:
+        log_invocation(self, event, context, records=len(event["Records"]))
+        input_type = self.get_input()
+        result = self.invoke(
+            [
+                input_type.parse_obj(item)
                 for record in event["Records"]
-            ]
+                # messages may be packed with several items
+                for item in unpack_body(record.get("body"))
+            ],
+            StepContext(lambda_context=context),
         )
         return result
+
+
+class Join(Step[I, O]):
+    """
+    A step which combines the outputs of the branches of a Parallel
+    step. It receives one output per branch, in branch order.
+    """
+
+    @classmethod
+    def execute(cls, input: Sequence[I]) -> O:
+        raise NotImplementedError()
+
+    @hybridmethod
+    def handler(self, event, context) -> O:
+        input_type = self.get_input()
+        result = self.invoke(
+            [
+                input_type.parse_obj(output)
+                for output in event
+                # branches which discarded the item carry the caught error
+                if "ingest_error" not in output
+            ],
+            StepContext(lambda_context=context),
+        )
+        return result
+
+
+def step_class(step) -> type:
+    return step if isinstance(step, type) else type(step)
+
+
+def step_name(step) -> str:
+    """Instances with parameters are named after their class and a
+    digest of their parameters, so that several instances of a class
+    can be deployed in one pipeline"""
+    name = step_class(step).__name__
+    params = step.params()
+    if params and (params["args"] or params["kwargs"]):
+        name = f"{name}_{input_digest(params)[:8]}"
+    return name
+
+
+def is_collector(step) -> bool:
+    """Pipelines may contain Parallel instances as well as Steps"""
+    metadata = registry.get(step_class(step))
+    if metadata is None:
+        return issubclass(step_class(step), Collector)
+    return metadata.kind == StepKind.collector
+
+
+def step_kind(step: type) -> StepKind:
+    if issubclass(step, Collector):
+        return StepKind.collector
+    if issubclass(step, Join):
+        return StepKind.join
+    return StepKind.transformer
+
+
+def resource_attributes(step: type) -> List[str]:
+    """The configuration attributes declared, with annotations, by the
+    step's class and its bases"""
+    names: Dict[str, None] = {}
+    for base in reversed(step.__mro__):
+        for name in vars(base).get("__annotations__", {}):
+            if not name.startswith("_"):
+                names[name] = None
+    return list(names)
+
+
+def register(step: type) -> Optional[StepMetadata]:
+    return registry.register(
+        step,
+        kind=step_kind(step),
+        resources={
+            name: getattr(step, name)
+            for name in resource_attributes(step)
+            if hasattr(step, name)
+        },
+    )
+
+
+def step_metadata(step) -> StepMetadata:
+    """The registered metadata of a step"""
+    step = step_class(step)
+    metadata = registry.get(step) or register(step)
+    if metadata is None:
+        raise TypeError(f"{step.__name__} does not declare its input and output types")
+    return metadata
+
+
+def step_resources(step) -> Dict[str, Any]:
+    """The registered configuration of a step. Instances may override it
+    with the attributes their constructor sets."""
+    resources = step_metadata(step).resources
+    if isinstance(step, type):
+        return resources
+    return {name: getattr(step, name, value) for name, value in resources.items()}
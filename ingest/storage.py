@@ -0,0 +1,185 @@
+import mmap
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional, Protocol
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# when set, S3Object readers resolve to files under this directory
+# (<root>/<bucket>/<key>) rather than calling S3
+LOCAL_STORAGE_ROOT_ENV = "INGEST_LOCAL_STORAGE_ROOT"
+
+
+class ObjectStore(Protocol):
+    def size(self, bucket: str, key: str) -> int:
+        ...
+
+    def read_range(self, bucket: str, key: str, start: int, end: int) -> bytes:
+        """Read bytes [start, end) of an object"""
+        ...
+
+
+class S3ObjectStore(ObjectStore):
+    def __init__(self, client: Any = None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from ingest.resources import get_pool
+
+            self._client = get_pool().client("s3")
+        return self._client
+
+    def size(self, bucket: str, key: str) -> int:
+        return self.client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+
+    def read_range(self, bucket: str, key: str, start: int, end: int) -> bytes:
+        if end <= start:
+            return b""
+        response = self.client.get_object(
+            Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}"
+        )
+        return response["Body"].read()
+
+
+class LocalObjectStore(ObjectStore):
+    """Serves objects from a local directory, laid out as <root>/<bucket>/<key>"""
+
+    root: Path
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def path(self, bucket: str, key: str) -> Path:
+        return self.root / bucket / key
+
+    def size(self, bucket: str, key: str) -> int:
+        return self.path(bucket, key).stat().st_size
+
+    def read_range(self, bucket: str, key: str, start: int, end: int) -> bytes:
+        if end <= start:
+            return b""
+        with open(self.path(bucket, key), "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+
+def get_default_store() -> ObjectStore:
+    root = os.environ.get(LOCAL_STORAGE_ROOT_ENV)
+    if root:
+        return LocalObjectStore(Path(root))
+    return S3ObjectStore()
+
+
+class S3ObjectReader:
+    """
+    Reads an object in fixed-size chunks using ranged requests, so
+    that only a bounded amount of the object is held in memory at once.
+
+    While a chunk is being consumed, the following chunk is fetched
+    in the background. Objects which need random access can be
+    spilled to local disk and memory-mapped.
+    """
+
+    bucket: str
+    key: str
+    chunk_size: int
+    prefetch: bool
+
+    def __init__(
+        self,
+        bucket: str,
+        key: str,
+        store: Optional[ObjectStore] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        prefetch: bool = True,
+    ):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be greater than 0")
+        self.bucket = bucket
+        self.key = key
+        self.store = store or get_default_store()
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+        self._size: Optional[int] = None
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            self._size = self.store.size(self.bucket, self.key)
+        return self._size
+
+    def read(self, start: int = 0, end: Optional[int] = None) -> bytes:
+        """Read bytes [start, end) of the object. Reads to the end of the
+        object when `end` is not provided."""
+        end = self.size if end is None else min(end, self.size)
+        return self.store.read_range(self.bucket, self.key, start, end)
+
+    def iter_chunks(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Yield the bytes in [start, end) in chunks of at most `chunk_size`"""
+        end = self.size if end is None else min(end, self.size)
+        ranges = [
+            (offset, min(offset + self.chunk_size, end))
+            for offset in range(start, end, self.chunk_size)
+        ]
+        if not self.prefetch or len(ranges) < 2:
+            for range_start, range_end in ranges:
+                yield self.store.read_range(
+                    self.bucket, self.key, range_start, range_end
+                )
+            return
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(
+                self.store.read_range, self.bucket, self.key, *ranges[0]
+            )
+            for next_range in ranges[1:]:
+                chunk = pending.result()
+                pending = executor.submit(
+                    self.store.read_range, self.bucket, self.key, *next_range
+                )
+                yield chunk
+            yield pending.result()
+
+    def iter_lines(self, keepends: bool = False) -> Iterator[bytes]:
+        """Yield the object line by line, without reading it all into memory"""
+        remainder = b""
+        for chunk in self.iter_chunks():
+            *lines, remainder = (remainder + chunk).split(b"\n")
+            for line in lines:
+                yield line + b"\n" if keepends else line.rstrip(b"\r")
+        if remainder:
+            yield remainder
+
+    def spill(self, directory: Optional[Path] = None) -> Path:
+        """Stream the object to a temporary file (in /tmp by default)
+        and return its path. The caller is responsible for removing it."""
+        fd, path = tempfile.mkstemp(
+            dir=directory, suffix=f"-{Path(self.key).name}"[-64:]
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in self.iter_chunks():
+                    f.write(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        return Path(path)
+
+    @contextmanager
+    def mmap(self, directory: Optional[Path] = None) -> Iterator[mmap.mmap]:
+        """Spill the object to local disk and memory-map it read-only.
+        The spilled file is removed on exit."""
+        if self.size == 0:
+            raise ValueError(f"Cannot memory-map empty object {self.key}")
+        path = self.spill(directory=directory)
+        try:
+            with open(path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    yield mapped
+        finally:
+            os.remove(path)
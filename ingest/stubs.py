@@ -0,0 +1,154 @@
+"""
+In-process stand-ins for AWS service clients, for exercising
+framework handlers locally.
+"""
+
+import json
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from ingest.resources import ResourcePool
+
+# Step Functions limits execution inputs to 256KB
+MAX_EXECUTION_INPUT_BYTES = 262_144
+# and SQS message batches to 256KB
+MAX_BATCH_BYTES = 262_144
+
+
+def _client_error(code: str, message: str, operation: str):
+    from botocore.exceptions import ClientError
+
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class StepFunctionsStub:
+    """
+    Mimics the subset of the boto3 Step Functions client used by the
+    trigger handlers. Executions are recorded rather than run, and inputs
+    over the service's size limit are rejected.
+
+    Throttling can be injected either for the next `throttle_next`
+    calls to `start_execution`, or whenever more than
+    `max_starts_per_second` starts land within one second of the
+    stub's clock.
+    """
+
+    def __init__(
+        self,
+        throttle_next: int = 0,
+        max_starts_per_second: Optional[int] = None,
+        clock=datetime.now,
+    ):
+        from botocore.exceptions import ClientError
+
+        self.exceptions = SimpleNamespace(ClientError=ClientError)
+        self.throttle_next = throttle_next
+        self.max_starts_per_second = max_starts_per_second
+        self.clock = clock
+        self.executions: List[Dict] = []
+        self.throttled = 0
+        self._window_start: Optional[datetime] = None
+        self._window_count = 0
+
+    def _rate_exceeded(self) -> bool:
+        if self.max_starts_per_second is None:
+            return False
+        now = self.clock()
+        if (
+            self._window_start is None
+            or (now - self._window_start).total_seconds() >= 1
+        ):
+            self._window_start, self._window_count = now, 0
+        self._window_count += 1
+        return self._window_count > self.max_starts_per_second
+
+    def start_execution(self, stateMachineArn: str, name: str, input: str) -> Dict:
+        if len(input.encode()) > MAX_EXECUTION_INPUT_BYTES:
+            raise _client_error(
+                "ValidationException",
+                f"Execution input of {len(input.encode())} bytes exceeds the limit",
+                "StartExecution",
+            )
+        if self.throttle_next > 0 or self._rate_exceeded():
+            self.throttle_next = max(0, self.throttle_next - 1)
+            self.throttled += 1
+            raise _client_error(
+                "ThrottlingException", "Rate exceeded", "StartExecution"
+            )
+        if any(e["name"] == name for e in self.executions):
+            raise _client_error(
+                "ExecutionAlreadyExists", f"{name} already exists", "StartExecution"
+            )
+        execution = {
+            "executionArn": f"{stateMachineArn}:{name}",
+            "stateMachineArn": stateMachineArn,
+            "name": name,
+            "input": json.loads(input),
+            "status": "RUNNING",
+            "startDate": self.clock(),
+        }
+        self.executions.append(execution)
+        return {"executionArn": execution["executionArn"], "startDate": self.clock()}
+
+    def list_executions(
+        self,
+        stateMachineArn: str,
+        statusFilter: Optional[str] = None,
+        maxResults: int = 100,
+        nextToken: Optional[str] = None,
+    ) -> Dict:
+        matches = [
+            e
+            for e in self.executions
+            if e["stateMachineArn"] == stateMachineArn
+            and (statusFilter is None or e["status"] == statusFilter)
+        ]
+        start = int(nextToken or 0)
+        response: Dict = {"executions": matches[start : start + maxResults]}
+        if start + maxResults < len(matches):
+            response["nextToken"] = str(start + maxResults)
+        return response
+
+    def complete(self, count: Optional[int] = None, status: str = "SUCCEEDED") -> None:
+        """Mark the oldest `count` running executions (or all) as finished"""
+        running = [e for e in self.executions if e["status"] == "RUNNING"]
+        for execution in running[:count]:
+            execution["status"] = status
+
+
+class SQSStub:
+    """Records visibility changes made by the trigger handlers, and the
+    messages sent to queues. Batches over the service's limits are
+    rejected."""
+
+    def __init__(self):
+        self.visibility_changes: List[Dict] = []
+        self.messages: Dict[str, List[str]] = {}
+
+    def send_message_batch(self, QueueUrl: str, Entries: List[Dict]):
+        size = sum(len(entry["MessageBody"].encode()) for entry in Entries)
+        if len(Entries) > 10 or size > MAX_BATCH_BYTES:
+            raise _client_error(
+                "BatchRequestTooLong", f"Batch of {size} bytes", "SendMessageBatch"
+            )
+        self.messages.setdefault(QueueUrl, []).extend(
+            entry["MessageBody"] for entry in Entries
+        )
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+    def change_message_visibility_batch(self, QueueUrl: str, Entries: List[Dict]):
+        self.visibility_changes.extend(Entries)
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+
+class StubResourcePool(ResourcePool):
+    """A resource pool handing out stand-in clients, so that handlers
+    fetching clients from the pool run against the stubs"""
+
+    def __init__(self, clients: Dict[str, Any]):
+        super().__init__()
+        self.clients = clients
+
+    def client(self, service: str, **options) -> Any:
+        return self.clients[service]
@@ -0,0 +1,415 @@
+"""
+Tracing of pipeline runs across steps, queues and workflows.
+
+A trace context is started by the trigger and carried in step payloads
+(under `ingest_trace`) and in the `ingest_trace` attribute of collector
+queue messages. Each step invocation records a span, the child of the
+span which produced its input. A collector's batch starts a trace of its
+own, linked to the trace of every item in the batch, with the time its
+items spent queued.
+
+Tracing is configured by INGEST_TRACE_EXPORT, which should be the same
+for every function of a pipeline:
+
+- unset: tracing is disabled, and payloads carry no trace context
+- "log": spans are logged as JSON lines by the `ingest.trace` logger
+- any other value: the path of a file spans are appended to, as
+  OpenTelemetry (OTLP JSON) lines
+
+Tracing is also enabled by a run history table (see ingest.history).
+Spans carry a `kind` attribute: "trigger", "run" and "batch" spans start
+traces, and "step" spans record step invocations.
+"""
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Protocol,
+    Sequence,
+)
+
+from pydantic import BaseModel
+
+TRACE_KEY = "ingest_trace"
+TRACE_EXPORT_ENV = "INGEST_TRACE_EXPORT"
+
+logger = logging.getLogger("ingest.trace")
+
+
+class TraceContext(BaseModel):
+    trace_id: str
+    # the span which produced the payload carrying the context
+    span_id: str
+    # when the trace was started, for end to end latency
+    started_at: float
+    # when the payload was sent to a queue, for queueing delay
+    sent_at: Optional[float] = None
+
+
+class SpanLink(BaseModel):
+    trace_id: str
+    span_id: str
+
+
+class Span(BaseModel):
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    started_at: float
+    start: float
+    end: Optional[float] = None
+    attributes: Dict[str, Any] = {}
+    links: List[SpanLink] = []
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    @property
+    def context(self) -> TraceContext:
+        """The context passed on with the span's output"""
+        return TraceContext(
+            trace_id=self.trace_id, span_id=self.span_id, started_at=self.started_at
+        )
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """The span in OpenTelemetry's JSON encoding"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(int(self.start * 1e9)),
+            "endTimeUnixNano": str(int((self.end or self.start) * 1e9)),
+            "attributes": otlp_attributes(self.attributes),
+            "links": [
+                {"traceId": link.trace_id, "spanId": link.span_id}
+                for link in self.links
+            ],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if "error" in self.attributes:
+            span["status"] = {"code": 2, "message": str(self.attributes["error"])}
+        return span
+
+
+def otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    encoded = []
+    for key, value in attributes.items():
+        typed: Dict[str, Any]
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        encoded.append({"key": key, "value": typed})
+    return encoded
+
+
+class SpanExporter(Protocol):
+    def export(self, span: Span) -> None:
+        ...
+
+
+class MemoryExporter(SpanExporter):
+    """Keeps spans in memory, for tests and local analysis"""
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def named(self, name: str) -> List[Span]:
+        return [span for span in self.spans if span.name == name]
+
+
+class LogExporter(SpanExporter):
+    """Logs spans, so that they land in CloudWatch when deployed"""
+
+    def export(self, span: Span) -> None:
+        logger.info("Span", extra={"span": span.dict()})
+
+
+class MultiExporter(SpanExporter):
+    def __init__(self, exporters: Sequence[SpanExporter]):
+        self.exporters = exporters
+
+    def export(self, span: Span) -> None:
+        for exporter in self.exporters:
+            exporter.export(span)
+
+
+class FileExporter(SpanExporter):
+    """Appends spans to a file as OTLP JSON lines, which the OpenTelemetry
+    collector's file receiver reads"""
+
+    def __init__(self, path: str, service_name: str = "ingest"):
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": {
+                            "attributes": otlp_attributes(
+                                {"service.name": self.service_name}
+                            )
+                        },
+                        "scopeSpans": [
+                            {"scope": {"name": "ingest"}, "spans": [span.to_otlp()]}
+                        ],
+                    }
+                ]
+            }
+        )
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+def new_id(size: int) -> str:
+    return secrets.token_hex(size)
+
+
+class Tracer:
+    def __init__(
+        self,
+        exporter: Optional[SpanExporter] = None,
+        resource: Optional[Dict[str, Any]] = None,
+    ):
+        self.exporter = exporter
+        # attributes of every span, describing where they were recorded
+        self.resource = resource or {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        parent: Optional[TraceContext] = None,
+        links: Iterable[TraceContext] = (),
+        root: bool = False,
+        **attributes: Any,
+    ) -> Iterator[Optional[Span]]:
+        """Record a span, within the current span unless a parent is
+        given. Without either, or when `root` is set, the span starts a new
+        trace. Disabled tracers record nothing."""
+        exporter = self.exporter
+        if exporter is None:
+            yield None
+            return
+        if not root:
+            parent = parent or current_context()
+        now = time.time()
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else new_id(16),
+            span_id=new_id(8),
+            parent_id=parent.span_id if parent else None,
+            started_at=parent.started_at if parent else now,
+            start=now,
+            attributes={**self.resource, **attributes},
+            links=[SpanLink(trace_id=l.trace_id, span_id=l.span_id) for l in links],
+        )
+        token = _current.set(span.context)
+        try:
+            yield span
+        except Exception as e:
+            span.attributes["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            span.end = time.time()
+            try:
+                exporter.export(span)
+            except Exception:
+                # recording a span never fails the work it describes
+                logger.warning("Failed to export span %s", span.name, exc_info=True)
+
+
+def tracer_from_env(environ: Mapping[str, str]) -> Tracer:
+    from ingest.history import (
+        HISTORY_TABLE_ENV,
+        PIPELINE_ENV,
+        DynamoDBHistoryStore,
+        HistoryExporter,
+    )
+
+    exporters: List[SpanExporter] = []
+    export = environ.get(TRACE_EXPORT_ENV)
+    if export == "log":
+        exporters.append(LogExporter())
+    elif export:
+        exporters.append(FileExporter(export))
+    if environ.get(HISTORY_TABLE_ENV):
+        store = DynamoDBHistoryStore(environ[HISTORY_TABLE_ENV])
+        exporters.append(HistoryExporter(store))
+    if not exporters:
+        return Tracer()
+    resource = {"pipeline": environ[PIPELINE_ENV]} if PIPELINE_ENV in environ else {}
+    exporter = exporters[0] if len(exporters) == 1 else MultiExporter(exporters)
+    return Tracer(exporter, resource=resource)
+
+
+_current: ContextVar[Optional[TraceContext]] = ContextVar("trace", default=None)
+_tracer: ContextVar[Optional[Tracer]] = ContextVar("tracer", default=None)
+_default_tracer: Optional[Tracer] = None
+
+
+def current_context() -> Optional[TraceContext]:
+    return _current.get()
+
+
+def get_tracer() -> Tracer:
+    """The tracer in use, which defaults to one configured by the
+    environment"""
+    global _default_tracer
+    tracer = _tracer.get()
+    if tracer is not None:
+        return tracer
+    if _default_tracer is None:
+        _default_tracer = tracer_from_env(os.environ)
+    return _default_tracer
+
+
+@contextmanager
+def use_tracer(tracer: Tracer) -> Iterator[Tracer]:
+    token = _tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _tracer.reset(token)
+
+
+def extract(payload: Any) -> Optional[TraceContext]:
+    """The trace context carried by a payload. Branch outputs passed to
+    a join all carry the same trace."""
+    if isinstance(payload, list):
+        payload = next((p for p in payload if isinstance(p, dict)), None)
+    if isinstance(payload, dict) and TRACE_KEY in payload:
+        return TraceContext.parse_obj(payload[TRACE_KEY])
+    return None
+
+
+def inject(payload: Dict[str, Any], context: Optional[TraceContext]) -> Dict[str, Any]:
+    if context is not None:
+        payload[TRACE_KEY] = context.dict(exclude_none=True)
+    return payload
+
+
+def message_attributes(context: Optional[TraceContext]) -> Dict[str, Dict]:
+    """SQS message attributes carrying a trace context, stamped with the
+    time it was sent"""
+    if context is None:
+        return {}
+    sent = context.copy(update={"sent_at": time.time()})
+    return {
+        TRACE_KEY: {
+            "DataType": "String",
+            "StringValue": sent.json(exclude_none=True),
+        }
+    }
+
+
+def mark_sent(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Stamp the trace context of an item sent within a packed message"""
+    if TRACE_KEY in payload:
+        payload[TRACE_KEY] = {**payload[TRACE_KEY], "sent_at": time.time()}
+    return payload
+
+
+def record_contexts(records: Iterable[Dict]) -> List[TraceContext]:
+    """
+    The trace contexts of the items in a batch of SQS records. Messages
+    sent by the Lambda integration carry their context in an attribute.
+    Messages sent by Step Functions, and packed messages, carry them in
+    their items.
+    """
+    from ingest.packing import unpack_body
+
+    contexts = []
+    for record in records:
+        attribute = record.get("messageAttributes", {}).get(TRACE_KEY)
+        if attribute:
+            contexts.append(TraceContext.parse_raw(attribute["stringValue"]))
+            continue
+        for item in unpack_body(record.get("body", "null")):
+            context = extract(item)
+            if context is not None:
+                contexts.append(context)
+    return contexts
+
+
+def batch_attributes(
+    contexts: List[TraceContext], now: Optional[float] = None
+) -> Dict[str, Any]:
+    """Attributes of a span which fans in the items of a batch: how long
+    they spent queued, and since their traces started"""
+    now = now or time.time()
+    attributes: Dict[str, Any] = {"items": len(contexts)}
+    queued = [now - c.sent_at for c in contexts if c.sent_at is not None]
+    if queued:
+        attributes["max_queued_seconds"] = max(queued)
+        attributes["mean_queued_seconds"] = sum(queued) / len(queued)
+    if contexts:
+        attributes["max_age_seconds"] = now - min(c.started_at for c in contexts)
+    return attributes
+
+
+def payload_bytes(value: Any) -> int:
+    from ingest.result_cache import canonical_json
+
+    return len(canonical_json(value))
+
+
+def traced_handler(step: Any, event: Any, context: Any) -> Any:
+    """
+    Invoke a step's Lambda handler within a span, returning its
+    serialized output with the span's context. Collector batches are
+    linked to the traces of their items.
+    """
+    from ingest.history import RUN_END_ENV
+
+    tracer = get_tracer()
+    attributes: Dict[str, Any] = {"kind": "step"}
+    if os.environ.get(RUN_END_ENV):
+        attributes["run_end"] = os.environ[RUN_END_ENV]
+    request_id = getattr(context, "aws_request_id", None)
+    if request_id:
+        attributes["request_id"] = request_id
+    links: List[TraceContext] = []
+    if isinstance(event, dict) and "Records" in event and tracer.enabled:
+        links = record_contexts(event["Records"])
+        attributes.update(batch_attributes(links))
+    parent = extract(event)
+    with tracer.span(step.__name__, parent=parent, links=links, **attributes) as span:
+        output = step.handler(event, context).dict(by_alias=True, exclude_unset=True)
+        if span is not None:
+            span.attributes["input_bytes"] = payload_bytes(event)
+            span.attributes["output_bytes"] = payload_bytes(output)
+        return inject(output, current_context())
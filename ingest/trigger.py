@@ -1,8 +1,10 @@
 from typing import List, Optional, Protocol, Type
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
+from ingest.batching import AdaptiveBatching
 from ingest.data_types import S3Object
 from ingest.provider import CloudProvider
+from ingest.scan import ScanConfig
 
 
 class Trigger(Protocol):
@@ -17,10 +19,29 @@ class S3Filter(BaseModel):
     suffix: Optional[str]
 
 
+class S3Buffer(BaseModel):
+    """
+    Queue S3 notifications and start one execution per batch of objects,
+    rather than one per object, smoothing bursts of uploads. Each execution
+    processes its objects concurrently in a Map state. Batches are split
+    across executions, so that each Map stays within the execution
+    history limit for the pipeline's steps.
+    """
+
+    # up to the batch size SQS event sources support
+    batch_size: int = Field(100, ge=1, le=10000)
+    max_batching_window: int = 30
+    max_concurrency: Optional[int] = None
+    max_running_executions: Optional[int] = None
+    # objects of a batch processed at once, where 0 is unlimited
+    map_concurrency: int = 0
+
+
 class S3Trigger(Trigger, BaseModel):
     bucket_name: str
     events: List[str]
     object_filter: S3Filter
+    buffer: Optional[S3Buffer] = None
 
     # def __init__(self, bucket_name: str, events: List[str], object_filter: S3Filter):
     #     self.bucket_name = bucket_name
@@ -39,6 +60,10 @@ class S3Trigger(Trigger, BaseModel):
     def notification_key_filter_kwargs(self):
         return self.object_filter.dict(exclude_unset=True)
 
+    @property
+    def map_concurrency(self) -> Optional[int]:
+        return self.buffer.map_concurrency if self.buffer else None
+
 
 class S3ObjectCreated(S3Trigger):
     bucket_name: str
@@ -46,11 +71,41 @@ class S3ObjectCreated(S3Trigger):
     output_type: Type = S3Object
 
 
+class S3ScanTrigger(Trigger, ScanConfig):
+    """
+    Discovers objects by listing a prefix on a schedule, rather than
+    through notifications, starting an execution per batch of objects.
+    Suits buckets receiving very many small objects, and buckets whose
+    notifications can't be configured.
+    """
+
+    output_type: Type = S3Object
+
+    def get_construct(self, provider: CloudProvider):
+        if provider == CloudProvider.aws:
+            from ingest.stack.constructs.triggers.s3_scan_trigger import (
+                S3ScanTriggerConstruct,
+            )
+
+            return S3ScanTriggerConstruct
+        else:
+            return super().get_construct(provider)
+
+
 class SQSTrigger(Trigger, BaseModel):
     queue_name: str
     batch_size: int
     max_batching_window: int
     output_type: Type
+    # maximum number of concurrent consumers of the queue
+    max_concurrency: Optional[int] = None
+    # defer batches while this many executions of the workflow are running
+    max_running_executions: Optional[int] = None
+    # start one execution per distinct value of this body field in a batch
+    partition_by: Optional[str] = None
+    # group records into executions adaptively, up to batch_size records,
+    # holding partial groups for up to the adaptive window
+    adaptive_batching: Optional[AdaptiveBatching] = None
 
     def get_construct(self, provider: CloudProvider):
         if provider == CloudProvider.aws:
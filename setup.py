@@ -26,7 +26,10 @@ extra_reqs = {
     ],
     "cdk": [
         "aws-cdk.core>=1.148.0",
+        "aws-cdk.aws-dynamodb>=1.148.0",
         "aws-cdk.aws-ec2>=1.148.0",
+        "aws-cdk.aws-events>=1.148.0",
+        "aws-cdk.aws-events-targets>=1.148.0",
         "aws-cdk.aws-s3>=1.148.0",
         "aws-cdk.aws-lambda-event-sources>=1.148.0",
         "aws-cdk.aws-iam>=1.148.0",
@@ -66,6 +69,7 @@ setup(
     install_requires=install_requires,
     tests_require=extra_reqs["dev"],
     extras_require=extra_reqs,
+    entry_points={"console_scripts": ["ingest=ingest.cli:main"]},
     # scripts=["scripts/api", "scripts/format", "scripts/lint", "scripts/typecheck"],
     version=version,
 )
@@ -1,6 +1,6 @@
-from typing import Dict
+from typing import Dict, List, Sequence
 from pydantic import BaseModel
-from ingest.step import Transformer
+from ingest.step import Collector, Join, Transformer
 from ingest.data_types import S3Object
 
 
@@ -24,3 +24,21 @@ class StacToS3(Transformer[StacItem, S3Object]):
         return S3Object(
             bucket=input.properties.get("bucket"), key=input.properties.get("key")
         )
+
+
+class StacCollection(BaseModel):
+    items: List[StacItem]
+
+
+class CollectStac(Collector[StacItem, StacCollection]):
+    batch_size = 2
+
+    @classmethod
+    def execute(cls, input: Sequence[StacItem]) -> StacCollection:
+        return StacCollection(items=list(input))
+
+
+class StacToCollection(Join[StacItem, StacCollection]):
+    @classmethod
+    def execute(cls, input: Sequence[StacItem]) -> StacCollection:
+        return StacCollection(items=list(input))
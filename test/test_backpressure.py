@@ -0,0 +1,257 @@
+import json
+from datetime import datetime
+import pytest
+from ingest.backpressure import (
+    MAX_INPUT_BYTES,
+    MAX_OBJECTS_ENV,
+    BackpressureConfig,
+    ExecutionStarter,
+    StepFunctionThrottled,
+)
+from ingest.packing import pack_items, unpack_body
+from ingest.segments import Segment, objects_per_execution
+from ingest.stubs import SQSStub, StepFunctionsStub
+from test.data_models import CollectStac, S3ToStac, StacToS3
+
+ARN = "arn:aws:states:us-east-1:123456789012:stateMachine:test"
+
+
+class PackCollectStac(CollectStac):
+    pack_messages = True
+
+
+def records(n):
+    return [
+        {"messageId": str(i), "receiptHandle": f"handle-{i}", "body": "{}"}
+        for i in range(n)
+    ]
+
+
+class TestExecutionStarter:
+    def test_retries_throttled_starts(self):
+        """Throttled starts are retried in place"""
+        sfn = StepFunctionsStub(throttle_next=2)
+        starter = ExecutionStarter(sfn, ARN, sleep=lambda _: None)
+        response = starter.process(records(3), name="batch")
+        assert response == {"batchItemFailures": []}
+        assert sfn.throttled == 2
+        assert len(sfn.executions[0]["input"]["Records"]) == 3
+
+    def test_defers_batch_when_throttling_persists(self):
+        """A batch that can't be started is returned to the queue rather
+        than failing the invocation"""
+        sfn, sqs = StepFunctionsStub(throttle_next=100), SQSStub()
+        starter = ExecutionStarter(
+            sfn, ARN, sqs_client=sqs, queue_url="queue", sleep=lambda _: None
+        )
+        response = starter.process(records(12), name="batch")
+        assert len(response["batchItemFailures"]) == 12
+        assert len(sqs.visibility_changes) == 12
+        assert sfn.executions == []
+
+        with pytest.raises(StepFunctionThrottled):
+            starter.start(name="other", input="{}")
+
+    def test_defers_batches_at_running_limit(self):
+        """Batches are started whole while there is headroom, and deferred
+        entirely once the limit is reached"""
+        sfn = StepFunctionsStub()
+        config = BackpressureConfig(max_running_executions=4, running_count_ttl=0)
+        starter = ExecutionStarter(sfn, ARN, config=config)
+
+        for i in range(3):
+            sfn.start_execution(stateMachineArn=ARN, name=f"running{i}", input="{}")
+        response = starter.process(records(8), name="batch")
+        assert len(sfn.executions[-1]["input"]["Records"]) == 8
+        assert response == {"batchItemFailures": []}
+
+        response = starter.process(records(8), name="batch2")
+        assert len(response["batchItemFailures"]) == 8
+
+        sfn.complete()
+        response = starter.process(records(8), name="batch3")
+        assert response == {"batchItemFailures": []}
+
+    def test_large_batches_are_split(self):
+        """Batches of packed messages are spread across executions within
+        the payload limit"""
+        items = [
+            {"id": f"item-{i}", "properties": {"x": "x" * 500}} for i in range(1000)
+        ]
+        bodies = pack_items(items)
+        batch = [
+            {"messageId": str(i), "receiptHandle": "h" * 400, "body": body}
+            for i, body in enumerate(bodies)
+        ]
+        sfn = StepFunctionsStub()
+        response = ExecutionStarter(sfn, ARN).process(batch, name="batch")
+        assert response == {"batchItemFailures": []}
+        assert len(sfn.executions) > 1
+        assert [
+            item["id"]
+            for e in sfn.executions
+            for record in e["input"]["Records"]
+            for item in unpack_body(record["body"])
+        ] == [item["id"] for item in items]
+
+    def test_partitioned_batches(self):
+        """One execution is started per partition of a batch"""
+        sfn = StepFunctionsStub()
+        config = BackpressureConfig(partition_by="collection")
+        batch = [
+            {"messageId": str(i), "body": json.dumps({"collection": c})}
+            for i, c in enumerate(["a", "b", "a"])
+        ]
+        ExecutionStarter(sfn, ARN, config=config).process(batch, name="batch")
+        assert [
+            [json.loads(r["body"])["collection"] for r in e["input"]["Records"]]
+            for e in sfn.executions
+        ] == [["a", "a"], ["b"]]
+
+    def test_defers_whole_partitions(self):
+        """Partitions beyond the headroom are deferred whole"""
+        sfn = StepFunctionsStub()
+        config = BackpressureConfig(
+            partition_by="collection", max_running_executions=2, running_count_ttl=0
+        )
+        sfn.start_execution(stateMachineArn=ARN, name="running", input="{}")
+        batch = [
+            {
+                "messageId": str(i),
+                "receiptHandle": f"handle-{i}",
+                "body": json.dumps({"collection": c}),
+            }
+            for i, c in enumerate(["a", "b", "a", "b"])
+        ]
+        response = ExecutionStarter(sfn, ARN, config=config).process(
+            batch, name="batch"
+        )
+        assert len(sfn.executions[-1]["input"]["Records"]) == 2
+        assert response == {
+            "batchItemFailures": [{"itemIdentifier": "1"}, {"itemIdentifier": "3"}]
+        }
+
+
+def s3_records(keys):
+    return [
+        {
+            "messageId": key,
+            "body": json.dumps(
+                {
+                    "Records": [
+                        {
+                            "eventName": "ObjectCreated:Put",
+                            "s3": {
+                                "bucket": {"name": "fakebucket"},
+                                "object": {"key": key},
+                            },
+                        }
+                    ]
+                }
+            ),
+        }
+        for key in keys
+    ]
+
+
+class TestS3Buffer:
+    def test_objects_from_notifications(self):
+        """Buffered S3 notifications start an execution with their objects,
+        with keys decoded and test events skipped"""
+        sfn = StepFunctionsStub()
+        config = BackpressureConfig(input_format="s3_objects")
+        test_event = {
+            "messageId": "test",
+            "body": json.dumps({"Event": "s3:TestEvent"}),
+        }
+        batch = s3_records(["inbox/a.json", "inbox/my+file%281%29.json"])
+        ExecutionStarter(sfn, ARN, config=config).process(
+            batch + [test_event], name="batch"
+        )
+        assert len(sfn.executions) == 1
+        assert sfn.executions[0]["input"]["objects"] == [
+            {"bucket": "fakebucket", "key": "inbox/a.json"},
+            {"bucket": "fakebucket", "key": "inbox/my file(1).json"},
+        ]
+
+    def test_large_batches_are_split(self):
+        """Objects are spread across executions within the payload limit"""
+        sfn = StepFunctionsStub()
+        config = BackpressureConfig(input_format="s3_objects")
+        keys = [f"inbox/{i:04d}/" + "x" * 2000 for i in range(300)]
+        response = ExecutionStarter(sfn, ARN, config=config).process(
+            s3_records(keys), name="batch"
+        )
+        assert response == {"batchItemFailures": []}
+        assert len(sfn.executions) > 1
+        assert [e["name"] for e in sfn.executions][:2] == ["batch-0", "batch-1"]
+        assert [o["key"] for e in sfn.executions for o in e["input"]["objects"]] == keys
+        assert all(
+            len(json.dumps(e["input"])) <= MAX_INPUT_BYTES for e in sfn.executions
+        )
+
+    def test_running_limit_counts_split_executions(self):
+        """Executions a batch is split into count against the running
+        limit, and those over it are deferred"""
+        sfn = StepFunctionsStub()
+        config = BackpressureConfig(
+            input_format="s3_objects", max_running_executions=1, running_count_ttl=0
+        )
+        keys = [f"inbox/{i:04d}/" + "x" * 2000 for i in range(300)]
+        response = ExecutionStarter(sfn, ARN, config=config).process(
+            s3_records(keys), name="batch"
+        )
+        [execution] = sfn.executions
+        started = [o["key"] for o in execution["input"]["objects"]]
+        assert [f["itemIdentifier"] for f in response["batchItemFailures"]] == [
+            key for key in keys if key not in started
+        ]
+
+    def test_throttling_defers_unstarted_executions(self):
+        """When a batch is throttled part way through, only the records of
+        executions which didn't start are deferred"""
+        now = datetime.now()
+        sfn = StepFunctionsStub(max_starts_per_second=1, clock=lambda: now)
+        config = BackpressureConfig(input_format="s3_objects", throttle_retries=2)
+        keys = [f"inbox/{i:04d}/" + "x" * 2000 for i in range(300)]
+        starter = ExecutionStarter(sfn, ARN, config=config, sleep=lambda _: None)
+        response = starter.process(s3_records(keys), name="batch")
+        [execution] = sfn.executions
+        started = [o["key"] for o in execution["input"]["objects"]]
+        assert [f["itemIdentifier"] for f in response["batchItemFailures"]] == [
+            key for key in keys if key not in started
+        ]
+
+    def test_invalid_inputs_fail_alone(self):
+        """Records too large for an execution fail without the rest of
+        their batch"""
+        sfn = StepFunctionsStub()
+        batch = records(3)
+        batch[1]["body"] = "x" * 300_000
+        response = ExecutionStarter(sfn, ARN).process(batch, name="batch")
+        assert response == {"batchItemFailures": [{"itemIdentifier": "1"}]}
+        assert [
+            r["messageId"] for e in sfn.executions for r in e["input"]["Records"]
+        ] == [
+            "0",
+            "2",
+        ]
+
+    def test_history_bounds_objects(self):
+        """Executions hold no more objects than their Map can run within
+        the workflow's execution history limit"""
+        segment = Segment([S3ToStac, StacToS3, S3ToStac, StacToS3], CollectStac)
+        # two events per iteration, five per task and the send
+        assert objects_per_execution(segment) == 20_000 // 27
+        # packed items are gathered from every object within the payload limit
+        packed = segment._replace(collector=PackCollectStac)
+        assert objects_per_execution(packed) == 25
+        sfn = StepFunctionsStub()
+        config = BackpressureConfig.from_env(
+            {"INPUT_FORMAT": "s3_objects", MAX_OBJECTS_ENV: "2"}
+        )
+        keys = [f"inbox/{i}.json" for i in range(5)]
+        ExecutionStarter(sfn, ARN, config=config).process(
+            s3_records(keys), name="batch"
+        )
+        assert [len(e["input"]["objects"]) for e in sfn.executions] == [2, 2, 1]
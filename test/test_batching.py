@@ -0,0 +1,185 @@
+import time
+from typing import Sequence
+
+import pytest
+from pydantic import ValidationError
+
+from ingest.backpressure import (
+    ADAPTIVE_BATCHING_ENV,
+    BackpressureConfig,
+    ExecutionStarter,
+)
+from ingest.batching import AdaptiveBatching, BatchController
+from ingest.data_types import S3Object
+from ingest.pipeline import Pipeline
+from ingest.runner import LocalRunner
+from ingest.step import Collector
+from ingest.stubs import SQSStub, StepFunctionsStub
+from ingest.trigger import S3Filter, S3ObjectCreated
+from test.data_models import S3ToStac, StacCollection, StacItem
+
+ARN = "arn:aws:states:us-east-1:123456789012:stateMachine:test"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class AdaptiveCollectStac(Collector[StacItem, StacCollection]):
+    adaptive_batching = AdaptiveBatching(
+        min_batch_size=1, max_batch_size=8, min_window=1, max_window=5
+    )
+
+    @classmethod
+    def execute(cls, input: Sequence[StacItem]) -> StacCollection:
+        return StacCollection(items=list(input))
+
+
+def records(n, age=0.0, receive_count=1):
+    sent = str(int((time.time() - age) * 1000))
+    return [
+        {
+            "messageId": str(i),
+            "receiptHandle": f"handle-{i}",
+            "body": "{}",
+            "attributes": {
+                "SentTimestamp": sent,
+                "ApproximateReceiveCount": str(receive_count),
+            },
+        }
+        for i in range(n)
+    ]
+
+
+class TestBatchController:
+    def test_backlog_grows_batches(self):
+        """Batches double while a backlog builds, up to the largest batch
+        which executes within the latency target"""
+        clock = FakeClock()
+        config = AdaptiveBatching(
+            min_batch_size=1, max_batch_size=1000, min_window=1, latency_target=61
+        )
+        controller = BatchController(config, clock=clock)
+        sizes = []
+        for _ in range(12):
+            clock.now += 1
+            controller.observe(
+                depth=10_000,
+                batch_size=controller.batch_size,
+                execute_seconds=0.5 * controller.batch_size,
+            )
+            sizes.append(controller.batch_size)
+        assert sizes[:4] == [2, 4, 8, 16]
+        # half a second per item leaves room for 120 in 60 seconds
+        assert sizes[-1] == 120
+        assert controller.window == config.min_window
+
+    def test_batch_bytes_bound_batches(self):
+        """Batches grow no larger than fits within the byte bound, for items
+        of the observed size"""
+        clock = FakeClock()
+        config = AdaptiveBatching(min_batch_size=1, max_batch_size=1000)
+        controller = BatchController(config, clock=clock, max_bytes=250_000)
+        for _ in range(12):
+            clock.now += 1
+            controller.observe(
+                depth=10_000,
+                batch_size=controller.batch_size,
+                batch_bytes=5_000 * controller.batch_size,
+            )
+        assert controller.batch_size == 50
+
+    def test_trickle_shrinks_batches(self):
+        """At a trickle, batches shrink to what arrives within the window"""
+        clock = FakeClock()
+        config = AdaptiveBatching(
+            min_batch_size=1, max_batch_size=1000, max_window=5, smoothing=1
+        )
+        controller = BatchController(config, clock=clock)
+        controller.batch_size = 64
+        for _ in range(10):
+            controller.arrived(2)
+            clock.now += 1
+            controller.observe(depth=0, batch_size=10)
+        assert controller.batch_size == 10
+        assert controller.window == 5
+
+
+class TestAdaptiveBatching:
+    def test_batching_window_bounds(self):
+        """Batches of over 10 need a batching window of at least a second"""
+        AdaptiveBatching(max_batch_size=10, min_window=0)
+        with pytest.raises(ValidationError):
+            AdaptiveBatching(max_batch_size=11, min_window=0)
+
+    def test_local_runner(self):
+        """The local runner grows batches of a collector fed faster than
+        its smallest batches drain, within its bounds"""
+        pipeline = Pipeline(
+            "TestAdaptiveBatching",
+            trigger=S3ObjectCreated(
+                bucket_name="fakebucket", object_filter=S3Filter(prefix="inbox/")
+            ),
+            steps=[S3ToStac, AdaptiveCollectStac],
+        )
+        with LocalRunner(pipeline) as runner:
+            outputs = [
+                runner.process(S3Object(bucket="fakebucket", key=f"inbox/{i}"))
+                for i in range(40)
+            ]
+            results = [output for output in outputs if output] + runner.close()
+        sizes = [len(result.items) for result in results]
+        assert sum(sizes) == 40
+        assert sizes[0] == 1
+        assert max(sizes) == 8
+
+    def test_consumer_holds_partial_batches(self):
+        """The consumer starts an execution per adaptive batch, and holds
+        a fresh partial batch on the queue for the rest of its window"""
+        config = BackpressureConfig.from_env(
+            {
+                ADAPTIVE_BATCHING_ENV: AdaptiveBatching(
+                    min_batch_size=2, max_batch_size=8, max_window=30
+                ).json()
+            }
+        )
+        sfn, sqs = StepFunctionsStub(), SQSStub()
+        starter = ExecutionStarter(
+            sfn, ARN, config=config, sqs_client=sqs, queue_url="queue"
+        )
+        response = starter.process(records(5), name="batch")
+        assert [len(e["input"]["Records"]) for e in sfn.executions] == [2, 2]
+        assert response == {"batchItemFailures": [{"itemIdentifier": "4"}]}
+        [change] = sqs.visibility_changes
+        assert 0 < change["VisibilityTimeout"] <= 30
+
+        # once the window has passed, partial batches are started
+        starter.process(records(1, age=60, receive_count=2), name="batch2")
+        assert len(sfn.executions[-1]["input"]["Records"]) == 1
+
+    def test_consumer_bounds_batches_by_bytes(self):
+        """Adaptive batches of large records are cut to the payload limit,
+        and started at once rather than held as partial batches, and the
+        batch size follows"""
+        config = BackpressureConfig(
+            adaptive_batching=AdaptiveBatching(
+                min_batch_size=100, max_batch_size=1000, max_window=30
+            )
+        )
+        sfn = StepFunctionsStub()
+        starter = ExecutionStarter(sfn, ARN, config=config)
+        batch = records(100)
+        for record in batch:
+            record["body"] = "x" * 10_000
+        response = starter.process(batch, name="batch")
+        # only the remainder of the records is a partial batch
+        held = [failure["itemIdentifier"] for failure in response["batchItemFailures"]]
+        started = [len(e["input"]["Records"]) for e in sfn.executions]
+        assert len(started) == 4
+        assert sum(started) + len(held) == 100
+        assert held == [str(i) for i in range(sum(started), 100)]
+        assert starter.batching.batch_size < 30
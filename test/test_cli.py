@@ -0,0 +1,79 @@
+import io
+import json
+from pathlib import Path
+from ingest.app import IngestApp
+from ingest.cli import main
+from ingest.pipeline import Pipeline
+from ingest.trigger import S3ObjectCreated, S3Filter
+from test.data_models import CollectStac, S3ToStac
+
+app = IngestApp(
+    "TestCLI",
+    Path("."),
+    Path("."),
+    pipelines=[
+        Pipeline(
+            "Items",
+            trigger=S3ObjectCreated(
+                bucket_name="fakebucket",
+                object_filter=S3Filter(prefix="inbox", suffix=".json"),
+            ),
+            steps=[S3ToStac],
+        ),
+        Pipeline(
+            "Collections",
+            trigger=S3ObjectCreated(
+                bucket_name="fakebucket",
+                object_filter=S3Filter(prefix="inbox", suffix=".json"),
+            ),
+            steps=[S3ToStac, CollectStac],
+        ),
+    ],
+)
+APP = "test.test_cli:app"
+
+
+def objects(*keys):
+    return [{"bucket": "fakebucket", "key": key} for key in keys]
+
+
+class TestCLI:
+    def test_run_files(self, tmp_path, capsys):
+        """Inputs are read from JSON and JSON lines files matched by globs"""
+        (tmp_path / "a.json").write_text(json.dumps(objects("a", "b")))
+        (tmp_path / "b.json").write_text("\n".join(json.dumps(o) for o in objects("c")))
+        main(["--app", APP, "run", "--pipeline", "Items", str(tmp_path / "*.json")])
+        lines = capsys.readouterr().out.splitlines()
+        assert [json.loads(line)["id"] for line in lines] == [
+            "fakebucket-a",
+            "fakebucket-b",
+            "fakebucket-c",
+        ]
+
+    def test_run_stdin(self, monkeypatch, capsys):
+        """Buffered batches are written once flushed"""
+        stdin = "\n".join(json.dumps(o) for o in objects("a", "b", "c"))
+        monkeypatch.setattr("sys.stdin", io.StringIO(stdin))
+        main(["--app", APP, "run", "--pipeline", "Collections"])
+        lines = capsys.readouterr().out.splitlines()
+        assert [len(json.loads(line)["items"]) for line in lines] == [2, 1]
+
+    def test_bench(self, tmp_path, capsys):
+        (tmp_path / "inputs.json").write_text(json.dumps(objects("a", "b", "c")))
+        main(
+            [
+                "--app",
+                APP,
+                "bench",
+                "--pipeline",
+                "Collections",
+                "--repeat",
+                "2",
+                "--json",
+                str(tmp_path / "inputs.json"),
+            ]
+        )
+        report = json.loads(capsys.readouterr().out)
+        assert report["items"] == 6
+        assert report["results"] == 3
+        assert report["latency_max"] is not None
@@ -0,0 +1,160 @@
+from pathlib import Path
+from typing import List, Sequence
+import pytest
+from ingest.app import IngestApp
+from ingest.data_types import S3Object
+from ingest.emit import QueueTarget, StepFunctionsEmitter, emit
+from ingest.pipeline import Pipeline
+from ingest.step import Transformer
+from ingest.packing import unpack_body
+from ingest.stubs import SQSStub, StepFunctionsStub
+from ingest.trigger import S3Buffer, S3ObjectCreated, S3Filter, SQSTrigger
+from ingest.runner import LocalRunner
+from test.data_models import CollectStac, S3ToStac, StacCollection, StacItem
+
+ARN = "arn:aws:states:us-east-1:123456789012:stateMachine:child"
+
+
+class EmitItems(Transformer[StacItem, StacItem]):
+    emits = ["Child"]
+
+    @classmethod
+    def execute(cls, input: StacItem) -> StacItem:
+        emit(
+            "Child",
+            [StacItem(id=f"{input.id}-{i}", properties={}) for i in range(3)],
+        )
+        return input
+
+
+class RecordItem(Transformer[StacItem, StacItem]):
+    seen: List[str] = []
+
+    @classmethod
+    def execute(cls, input: StacItem) -> StacItem:
+        cls.seen.append(input.id)
+        return input
+
+
+class RecordBatch(CollectStac):
+    batches: List[List[str]] = []
+
+    @classmethod
+    def execute(cls, input: Sequence[StacItem]) -> StacCollection:
+        cls.batches.append([item.id for item in input])
+        return super().execute(input)
+
+
+def child_pipeline():
+    return Pipeline(
+        "Child",
+        trigger=SQSTrigger(
+            queue_name="child",
+            batch_size=1,
+            max_batching_window=1,
+            output_type=StacItem,
+        ),
+        steps=[RecordItem],
+    )
+
+
+def parent_pipeline():
+    return Pipeline(
+        "Parent",
+        trigger=S3ObjectCreated(
+            bucket_name="fakebucket",
+            object_filter=S3Filter(prefix="inbox", suffix=".json"),
+        ),
+        steps=[S3ToStac, EmitItems],
+    )
+
+
+class TestEmit:
+    def test_local_emit_runs_child_pipeline(self):
+        """Items emitted by a step run through the target pipeline in-process"""
+        RecordItem.seen = []
+        parent = parent_pipeline()
+        IngestApp("app", Path("."), Path("."), pipelines=[parent, child_pipeline()])
+        parent.run(S3Object(bucket="fakebucket", key="a"))
+        assert RecordItem.seen == [f"fakebucket-a-{i}" for i in range(3)]
+
+    def test_local_emit_closes_child_pipelines(self):
+        """Closing a runner flushes the batches its emitted items left in
+        the pipelines they ran through"""
+        RecordBatch.batches = []
+        parent = parent_pipeline()
+        child = child_pipeline()
+        child.steps = [RecordBatch]
+        IngestApp("app", Path("."), Path("."), pipelines=[parent, child])
+        with LocalRunner(parent) as runner:
+            runner.run(S3Object(bucket="fakebucket", key="a"))
+            assert RecordBatch.batches == [["fakebucket-a-0", "fakebucket-a-1"]]
+        assert RecordBatch.batches[1:] == [["fakebucket-a-2"]]
+        assert child._runner is None
+
+    def test_unknown_target(self):
+        """Steps may only emit to pipelines in the same app"""
+        with pytest.raises(ValueError):
+            IngestApp("app", Path("."), Path("."), pipelines=[parent_pipeline()])
+
+    def test_batched_target(self):
+        """Steps may not emit to pipelines which run batches of objects"""
+        child = Pipeline(
+            "Child",
+            trigger=S3ObjectCreated(
+                bucket_name="fakebucket",
+                object_filter=S3Filter(prefix="inbox"),
+                buffer=S3Buffer(),
+            ),
+            steps=[S3ToStac],
+        )
+        with pytest.raises(ValueError, match="batches of objects"):
+            IngestApp("app", Path("."), Path("."), pipelines=[parent_pipeline(), child])
+
+    def test_step_functions_emitter(self):
+        """One execution is started per emitted item, retrying throttled starts"""
+        sfn = StepFunctionsStub(throttle_next=2)
+        emitter = StepFunctionsEmitter({"Child": ARN}, client=sfn)
+        emitter.emit("Child", [StacItem(id=str(i), properties={}) for i in range(5)])
+        assert sorted(e["input"]["id"] for e in sfn.executions) == [
+            str(i) for i in range(5)
+        ]
+        with pytest.raises(KeyError):
+            emitter.emit("Other", [])
+
+    def test_retried_emits_start_once(self):
+        """Items emitted again by a retried step don't start their
+        executions again"""
+        sfn = StepFunctionsStub()
+        emitter = StepFunctionsEmitter({"Child": ARN}, client=sfn)
+        items = [StacItem(id=str(i), properties={}) for i in range(3)]
+        emitter.emit("Child", items[:2])
+        emitter.emit("Child", items)
+        assert sorted(e["input"]["id"] for e in sfn.executions) == ["0", "1", "2"]
+
+    def test_queue_targets(self):
+        """Items for pipelines starting with a collector are packed into
+        batches of messages on its queues"""
+        sqs = SQSStub()
+        target = QueueTarget(
+            queue_urls=["queue-0", "queue-1"], partition_by="properties.collection"
+        )
+        emitter = StepFunctionsEmitter({"Child": target}, sqs_client=sqs)
+        items = [
+            StacItem(id=str(i), properties={"collection": str(i % 2), "x": "x" * 5000})
+            for i in range(100)
+        ]
+        emitter.emit("Child", items)
+        received = [
+            (url, item)
+            for url, bodies in sqs.messages.items()
+            for body in bodies
+            for item in unpack_body(body)
+        ]
+        assert sorted(int(item["id"]) for _, item in received) == list(range(100))
+        # each collection's items are sent to one queue
+        assert (
+            len({(url, item["properties"]["collection"]) for url, item in received})
+            == 2
+        )
+        assert sum(map(len, sqs.messages.values())) < 10
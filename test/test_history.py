@@ -0,0 +1,140 @@
+import json
+import time
+
+import pytest
+from ingest.backpressure import object_inputs
+from ingest.data_types import S3Object
+from ingest.history import (
+    HistoryExporter,
+    RunRecord,
+    RunStatus,
+    SQLiteHistoryStore,
+)
+from ingest.pipeline import Pipeline
+from ingest.runner import LocalRunner
+from ingest.step import Transformer
+from ingest.tracing import TRACE_KEY, Tracer, traced_handler, use_tracer
+from ingest.trigger import S3Filter, S3ObjectCreated
+from test.data_models import CollectStac, S3ToStac, StacItem
+
+
+class FailingS3ToStac(Transformer[S3Object, StacItem]):
+    @classmethod
+    def execute(cls, input: S3Object) -> StacItem:
+        if input.key.startswith("bad/"):
+            raise RuntimeError("unreadable")
+        return S3ToStac.execute(input)
+
+
+class FailingExporter:
+    def export(self, span):
+        raise RuntimeError("table unavailable")
+
+
+def run(run_id, status, key, started_at, pipeline="P"):
+    return RunRecord(
+        run_id=run_id,
+        pipeline=pipeline,
+        status=status,
+        input_key=key,
+        started_at=started_at,
+        updated_at=started_at,
+    )
+
+
+class TestHistory:
+    def test_queries(self):
+        """Runs are found by pipeline, status, key prefix and time"""
+        store = SQLiteHistoryStore()
+        now = time.time()
+        store.put_run(run("1", RunStatus.failed, "inbox/a", now - 60))
+        store.put_run(run("2", RunStatus.failed, "inbox/b", now - 7200))
+        store.put_run(run("3", RunStatus.succeeded, "inbox/c", now - 30))
+        store.put_run(run("4", RunStatus.failed, "other/d", now - 10))
+        store.put_run(run("5", RunStatus.failed, "inbox/e", now, pipeline="Q"))
+        failed = store.query(
+            pipeline="P", status=RunStatus.failed, key_prefix="inbox/", since=now - 3600
+        )
+        assert [r.run_id for r in failed] == ["1"]
+        assert [r.run_id for r in store.query(pipeline="P")] == ["4", "3", "1", "2"]
+        assert [r.run_id for r in store.query(key_prefix="inbox/", limit=2)] == [
+            "5",
+            "3",
+        ]
+
+    def test_records_merge(self):
+        """Runs only move towards a final status, whatever order their
+        records arrive in"""
+        store = SQLiteHistoryStore()
+        store.put_run(run("1", RunStatus.succeeded, None, 10))
+        store.put_run(run("1", RunStatus.running, "inbox/a", 5))
+        record = store.get_run("1")
+        assert record.status == RunStatus.succeeded
+        assert record.input_key == "inbox/a"
+        assert record.started_at == 5
+        store.put_run(run("1", RunStatus.failed, None, 20))
+        assert store.get_run("1").status == RunStatus.succeeded
+
+    def test_retried_failures(self):
+        """A failure is superseded by the success of a retry, or by a
+        discard, leaving its error on the failed step"""
+        store = SQLiteHistoryStore()
+        failed = run("1", RunStatus.failed, "inbox/a", 5)
+        failed.error, failed.ended_at = "RuntimeError: throttled", 6
+        store.put_run(failed)
+        assert store.get_run("1").status == RunStatus.failed
+        store.put_run(run("1", RunStatus.succeeded, None, 10))
+        record = store.get_run("1")
+        assert record.status == RunStatus.succeeded
+        assert record.error is None
+        store.put_run(failed.copy(update={"run_id": "2"}))
+        store.put_run(run("2", RunStatus.discarded, None, 10))
+        assert store.get_run("2").status == RunStatus.discarded
+
+    def test_local_runs(self):
+        """Local runs record their runs and steps"""
+        store = SQLiteHistoryStore()
+        pipeline = Pipeline(
+            "TestHistory",
+            trigger=S3ObjectCreated(
+                bucket_name="fakebucket", object_filter=S3Filter(prefix="inbox/")
+            ),
+            steps=[FailingS3ToStac, CollectStac],
+        )
+        with LocalRunner(pipeline, tracer=Tracer(HistoryExporter(store))) as runner:
+            runner.run(S3Object(bucket="fakebucket", key="inbox/a"))
+            with pytest.raises(RuntimeError):
+                runner.run(S3Object(bucket="fakebucket", key="bad/b"))
+        [failed] = store.query(pipeline="TestHistory", status=RunStatus.failed)
+        assert failed.input_key == "bad/b"
+        assert "unreadable" in failed.error
+        [collected] = store.query(status=RunStatus.collected)
+        assert collected.input_key == "inbox/a"
+        [step] = store.steps(collected.run_id)
+        assert step.step == "FailingS3ToStac"
+        assert step.input_bytes > 0 and step.output_bytes > 0
+        # the batch flushed when the runner closed is a run of its own
+        [batch] = store.query(status=RunStatus.succeeded)
+        assert [s.step for s in store.steps(batch.run_id)] == ["CollectStac"]
+
+    def test_export_failures(self):
+        """Steps succeed even when their history can't be written"""
+        with use_tracer(Tracer(FailingExporter())):
+            output = traced_handler(
+                S3ToStac, S3Object(bucket="fakebucket", key="inbox/a").dict(), None
+            )
+        assert output["id"] == "fakebucket-inbox/a"
+
+    def test_batched_objects(self):
+        """Each object of a batch is a run of its own, so that the
+        iterations of a Map don't contend for one record"""
+        store = SQLiteHistoryStore()
+        objects = [S3Object(bucket="fakebucket", key=f"inbox/{i}") for i in range(3)]
+        tracer = Tracer(HistoryExporter(store), resource={"pipeline": "P"})
+        with use_tracer(tracer), tracer.span("trigger", kind="trigger") as trigger:
+            [input] = object_inputs(objects, trace=trigger.context)
+        items = json.loads(input)["objects"]
+        assert len({item[TRACE_KEY]["trace_id"] for item in items}) == 3
+        runs = store.query(pipeline="P")
+        assert sorted(r.input_key for r in runs) == [o.key for o in objects]
+        assert trigger.trace_id not in {r.run_id for r in runs}
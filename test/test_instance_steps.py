@@ -0,0 +1,88 @@
+from typing import List, Sequence
+from ingest.data_types import S3Object
+from ingest.pipeline import Pipeline
+from ingest.runner import LocalRunner
+from ingest.stack.handler import render_handler
+from ingest.step import Collector, Transformer
+from ingest.trigger import S3ObjectCreated, S3Filter
+from test.data_models import StacCollection, StacItem
+
+
+class Tag(Transformer[S3Object, StacItem]):
+    setups = 0
+    teardowns = 0
+
+    def __init__(self, tag: str):
+        self.tag = tag
+        self.session = None
+
+    def setup(self):
+        Tag.setups += 1
+        self.session = f"session-{self.tag}"
+
+    def teardown(self):
+        Tag.teardowns += 1
+        self.session = None
+
+    def execute(self, input: S3Object) -> StacItem:
+        return StacItem(id=input.key, properties={"session": self.session})
+
+
+class CollectSome(Collector[StacItem, StacCollection]):
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+
+    def execute(self, input: Sequence[StacItem]) -> StacCollection:
+        return StacCollection(items=list(input))
+
+
+def pipeline(*steps):
+    return Pipeline(
+        "TestInstances",
+        trigger=S3ObjectCreated(
+            bucket_name="fakebucket",
+            object_filter=S3Filter(prefix="inbox", suffix=".json"),
+        ),
+        steps=steps,
+    )
+
+
+def objects(*keys: str) -> List[S3Object]:
+    return [S3Object(bucket="fakebucket", key=key) for key in keys]
+
+
+class TestInstanceSteps:
+    def test_setup_once_per_runner(self):
+        """Instances are set up once, before their first input, and torn
+        down when the runner closes"""
+        Tag.setups = Tag.teardowns = 0
+        with LocalRunner(pipeline(Tag(tag="a"), CollectSome(batch_size=3))) as runner:
+            assert Tag.setups == 0
+            assert runner.process(objects("1")[0]) is None
+            assert runner.process(objects("2")[0]) is None
+            result = runner.process(objects("3")[0])
+            assert Tag.setups == 1
+        assert Tag.teardowns == 1
+        assert [item.properties["session"] for item in result.items] == [
+            "session-a"
+        ] * 3
+
+    def test_instance_names(self):
+        """Instances with different parameters are named apart"""
+        assert Tag(tag="a").__name__ != Tag(tag="b").__name__
+        assert Tag(tag="a").__name__.startswith("Tag_")
+        assert Tag.__name__ == "Tag"
+        assert Tag(tag="a").get_input() is S3Object
+
+    def test_rendered_handler(self):
+        """Deployed handlers rebuild the instance from its parameters and
+        set it up when the container starts"""
+        Tag.setups = 0
+        namespace = {}
+        exec(render_handler(Tag(tag="deployed")), namespace)
+        assert Tag.setups == 1
+        assert namespace["chandler"].tag == "deployed"
+        for key in ["a", "b"]:
+            output = namespace["handler"]({"bucket": "fakebucket", "key": key}, {})
+            assert output == {"id": key, "properties": {"session": "session-deployed"}}
+        assert Tag.setups == 1
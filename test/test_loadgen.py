@@ -0,0 +1,88 @@
+import pytest
+from ingest.data_types import S3Object
+from ingest.loadgen import LoadGenerator
+from ingest.pipeline import Pipeline
+from ingest.simulator import ConstantArrivals
+from ingest.step import Transformer
+from ingest.trigger import S3Buffer, S3Filter, S3ObjectCreated, SQSTrigger
+from test.data_models import S3ToStac, StacItem, StacToS3
+
+
+class ObjectSize(Transformer[S3Object, StacItem]):
+    @classmethod
+    def execute(cls, input: S3Object) -> StacItem:
+        return StacItem(id=input.key, properties={"size": input.open().size})
+
+
+def s3_pipeline(buffer=None, steps=(S3ToStac,)):
+    return Pipeline(
+        "TestLoad",
+        trigger=S3ObjectCreated(
+            bucket_name="fakebucket",
+            object_filter=S3Filter(prefix="inbox/", suffix=".json"),
+            buffer=buffer,
+        ),
+        steps=list(steps),
+    )
+
+
+class TestLoadGenerator:
+    def test_s3_trigger(self):
+        """Every generated object completes, through the S3 trigger handler
+        and the local runner, and steps can read the objects"""
+        generator = LoadGenerator(
+            s3_pipeline(steps=[ObjectSize]), ConstantArrivals(rate=100)
+        )
+        report = generator.run(duration=0.2)
+        assert report.items == report.items_completed == report.results == 20
+        assert report.executions == report.invocations == 20
+        assert report.errors == report.throttled_starts == 0
+        assert report.latency_max < 1
+
+    def test_throttled_invocations_are_retried(self):
+        """Throttled S3 trigger invocations are retried, as Lambda retries
+        asynchronous invocations"""
+        generator = LoadGenerator(
+            s3_pipeline(),
+            ConstantArrivals(rate=100),
+            max_starts_per_second=10,
+            redelivery_delay=0.5,
+        )
+        report = generator.run(duration=0.2)
+        assert report.throttled_starts > 0
+        assert report.failed_invocations > 0
+        assert report.items_completed + report.dropped_events == 20
+
+    def test_buffered_trigger(self):
+        """Buffered S3 triggers start an execution per batch of objects"""
+        buffer = S3Buffer(batch_size=10, max_batching_window=1)
+        report = LoadGenerator(s3_pipeline(buffer), ConstantArrivals(rate=100)).run(
+            duration=0.2
+        )
+        assert report.items_completed == 20
+        assert report.executions == report.invocations == 2
+
+    def test_sqs_trigger(self):
+        """SQS triggers receive batches of the sample items"""
+        pipeline = Pipeline(
+            "TestLoadSQS",
+            trigger=SQSTrigger(
+                queue_name="items",
+                batch_size=5,
+                max_batching_window=1,
+                output_type=StacItem,
+            ),
+            steps=[StacToS3],
+        )
+        items = [
+            StacItem(id=str(i), properties={"bucket": "fakebucket", "key": str(i)})
+            for i in range(3)
+        ]
+        report = LoadGenerator(pipeline, ConstantArrivals(rate=100), items=items).run(
+            duration=0.1
+        )
+        assert report.items_completed == report.results == report.items
+        assert report.invocations == -(-report.items // 5)
+
+        with pytest.raises(ValueError):
+            LoadGenerator(pipeline, ConstantArrivals(rate=1))
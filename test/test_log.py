@@ -0,0 +1,72 @@
+import io
+import json
+
+import pytest
+from ingest.log import LogConfig, Payload, configure_logging, step_logger, truncate
+from test.data_models import CollectStac, S3ToStac
+
+
+class Expensive:
+    """Counts how often it is serialized"""
+
+    serialized = 0
+
+    def __repr__(self):
+        Expensive.serialized += 1
+        return "expensive"
+
+
+@pytest.fixture
+def stream():
+    stream = io.StringIO()
+    yield stream
+    configure_logging(LogConfig())
+
+
+def lines(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+class TestLogging:
+    def test_json_lines(self, stream):
+        """Records are JSON, with any extra fields"""
+        configure_logging(LogConfig(), stream=stream)
+        step_logger(S3ToStac).info("Done %s", "now", extra={"items": 3})
+        [line] = lines(stream)
+        assert line["message"] == "Done now"
+        assert line["items"] == 3
+        assert line["logger"] == "ingest.steps.S3ToStac"
+
+    def test_payloads_are_lazy_and_truncated(self, stream):
+        """Payloads are only serialized when emitted, and are truncated"""
+        configure_logging(LogConfig(max_payload_chars=10), stream=stream)
+        logger = step_logger(S3ToStac)
+        logger.debug("Event %s", Payload(Expensive()))
+        assert Expensive.serialized == 0
+        logger.info("Event", extra={"payload": Payload({"key": "x" * 100})})
+        assert lines(stream)[0]["payload"] == truncate(
+            json.dumps({"key": "x" * 100}), 10
+        )
+        assert truncate("abc", 10) == "abc"
+
+    def test_step_levels(self, stream):
+        """Steps log at their configured level"""
+        configure_logging(
+            LogConfig.from_env({"INGEST_STEP_LOG_LEVELS": "CollectStac=WARNING"}),
+            stream=stream,
+        )
+        step_logger(CollectStac).info("hidden")
+        step_logger(S3ToStac).info("shown")
+        assert [line["message"] for line in lines(stream)] == ["shown"]
+
+    def test_handler_sampling(self, stream):
+        """Invocations are logged without their payload, unless sampled"""
+        event = {"bucket": "fakebucket", "key": "a"}
+        configure_logging(LogConfig(), stream=stream)
+        S3ToStac.handler(event, None)
+        configure_logging(LogConfig(payload_sample_rate=1), stream=stream)
+        S3ToStac.handler(event, None)
+        first, second = lines(stream)
+        assert "payload" not in first
+        assert json.loads(second["payload"]) == event
+        assert second["sampled"]
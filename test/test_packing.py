@@ -0,0 +1,59 @@
+import json
+
+import pytest
+from ingest.backpressure import BackpressureConfig, ExecutionStarter
+from ingest.packing import MessageTooLarge, pack_items, unpack_body
+from ingest.stubs import StepFunctionsStub
+from test.data_models import CollectStac
+
+
+def items(n, size=100):
+    return [
+        {"id": str(i), "properties": {"collection": "ab"[i % 2], "pad": "x" * size}}
+        for i in range(n)
+    ]
+
+
+class TestPacking:
+    def test_round_trip(self):
+        """Packed messages stay within the limit and unpack to their items"""
+        bodies = pack_items(items(100, size=1000), max_bytes=10_000)
+        # nine items per message
+        assert len(bodies) == 12
+        assert all(len(body) <= 10_000 for body in bodies)
+        assert [i for body in bodies for i in unpack_body(body)] == items(100, 1000)
+        # unpacked messages hold a single item
+        assert unpack_body(json.dumps(items(1)[0])) == items(1)
+
+    def test_compression(self):
+        """Compressed messages hold many more items"""
+        bodies = pack_items(items(1000, size=1000), compress=True, max_bytes=10_000)
+        assert len(bodies) < 20
+        assert all(len(body) <= 10_000 for body in bodies)
+        assert [i for body in bodies for i in unpack_body(body)] == items(1000, 1000)
+
+    def test_oversized_item(self):
+        with pytest.raises(MessageTooLarge):
+            pack_items(items(1, size=20_000), max_bytes=10_000)
+
+    def test_partitioned_packing(self):
+        """Each message holds one partition, which consumers partition by"""
+        bodies = pack_items(items(10), partition_by="properties.collection")
+        assert len(bodies) == 2
+        sfn = StepFunctionsStub()
+        config = BackpressureConfig(partition_by="properties.collection")
+        records = [{"messageId": str(i), "body": b} for i, b in enumerate(bodies)]
+        ExecutionStarter(sfn, "arn", config=config).process(records, name="batch")
+        assert len(sfn.executions) == 2
+
+    def test_collector_unpacks(self):
+        """Collectors receive the items of packed and unpacked messages"""
+        stac_items = [{"id": str(i), "properties": {}} for i in range(5)]
+        event = {
+            "Records": [
+                {"body": pack_items(stac_items[:4], compress=True)[0]},
+                {"body": json.dumps(stac_items[4])},
+            ]
+        }
+        collection = CollectStac.handler(event, None)
+        assert [item.id for item in collection.items] == list("01234")
@@ -0,0 +1,87 @@
+import threading
+import pytest
+from ingest.data_types import S3Object
+from ingest.parallel import Parallel
+from ingest.pipeline import Pipeline
+from ingest.trigger import S3ObjectCreated, S3Filter
+from test.data_models import (
+    CollectStac,
+    S3ToStac,
+    StacItem,
+    StacToCollection,
+    StacToS3,
+)
+
+
+def trigger():
+    return S3ObjectCreated(
+        bucket_name="fakebucket",
+        object_filter=S3Filter(prefix="inbox", suffix=".json"),
+    )
+
+
+class Renamed(S3ToStac):
+    @classmethod
+    def execute(cls, input: S3Object) -> StacItem:
+        item = super().execute(input)
+        item.id = f"renamed-{item.id}"
+        return item
+
+
+class TestParallel:
+    obj = S3Object(bucket="fakebucket", key="inbox/a.json")
+
+    def test_join(self):
+        """Branch outputs are passed to the join step, in branch order"""
+        pipe = Pipeline(
+            "TestParallel",
+            trigger=trigger(),
+            steps=[Parallel([[S3ToStac], [Renamed]], join=StacToCollection)],
+        )
+        result = pipe.run(self.obj)
+        assert [item.id for item in result.items] == [
+            "fakebucket-inbox/a.json",
+            "renamed-fakebucket-inbox/a.json",
+        ]
+
+    def test_pass_through(self):
+        """Without a join, the input passes through to the following step"""
+        pipe = Pipeline(
+            "TestParallel",
+            trigger=trigger(),
+            steps=[S3ToStac, Parallel([[StacToS3], [StacToS3]]), StacToS3],
+        )
+        assert pipe.run(self.obj) == self.obj
+
+    def test_branches_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        class Waits(S3ToStac):
+            @classmethod
+            def execute(cls, input: S3Object) -> StacItem:
+                barrier.wait()
+                return super().execute(input)
+
+        pipe = Pipeline(
+            "TestParallel",
+            trigger=trigger(),
+            steps=[Parallel([[Waits], [Waits]], join=StacToCollection)],
+        )
+        assert len(pipe.run(self.obj).items) == 2
+
+    def test_branch_validation(self):
+        """Every edge within the branches is type checked"""
+        with pytest.raises(TypeError):
+            Parallel([[S3ToStac], [StacToS3]])
+        with pytest.raises(TypeError):
+            Parallel([[S3ToStac, S3ToStac], [S3ToStac]])
+        with pytest.raises(TypeError):
+            Parallel([[S3ToStac, StacToS3], [S3ToStac]], join=StacToCollection)
+        with pytest.raises(TypeError):
+            Parallel([[S3ToStac, CollectStac], [S3ToStac]])
+        with pytest.raises(TypeError):
+            Pipeline(
+                "TestParallel",
+                trigger=trigger(),
+                steps=[Parallel([[S3ToStac], [S3ToStac]]), StacToS3],
+            )
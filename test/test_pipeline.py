@@ -1,7 +1,7 @@
 import pytest
 from ingest.pipeline import Pipeline
 from ingest.trigger import S3ObjectCreated, S3Filter
-from test.data_models import S3ToStac, StacToS3
+from test.data_models import CollectStac, S3ToStac, StacToS3
 
 
 class TestPipeline:
@@ -43,3 +43,21 @@ class TestPipeline:
                 ),
                 steps=[StacToS3, S3ToStac],
             )
+
+    def test_native_send_validation(self):
+        """Collectors fed by the native SQS integration must have a single
+        queue and unpacked messages"""
+
+        class PackedNativeCollect(CollectStac):
+            native_send = True
+            pack_messages = True
+
+        with pytest.raises(ValueError):
+            Pipeline(
+                "TestCreate",
+                trigger=S3ObjectCreated(
+                    bucket_name="fakebucket",
+                    object_filter=S3Filter(prefix="inbox", suffix=".json"),
+                ),
+                steps=[S3ToStac, PackedNativeCollect],
+            )
@@ -0,0 +1,77 @@
+import pytest
+from ingest.data_types import S3Object
+from ingest.pipeline import Pipeline
+from ingest.policies import CatchPolicy, RetryPolicy, run_with_policies
+from ingest.step import Transformer
+from ingest.trigger import S3ObjectCreated, S3Filter
+from test.data_models import S3ToStac, StacItem, StacToS3
+
+
+class TransientError(Exception):
+    pass
+
+
+class Flaky(Transformer[S3Object, StacItem]):
+    failures = 0
+    retry = [RetryPolicy(errors=["TransientError"], interval=1, max_attempts=2)]
+
+    @classmethod
+    def execute(cls, input: S3Object) -> StacItem:
+        if cls.failures:
+            cls.failures -= 1
+            raise TransientError()
+        return S3ToStac.execute(input)
+
+
+def trigger():
+    return S3ObjectCreated(
+        bucket_name="fakebucket",
+        object_filter=S3Filter(prefix="inbox", suffix=".json"),
+    )
+
+
+class TestPolicies:
+    obj = S3Object(bucket="fakebucket", key="inbox/a.json")
+
+    def test_retry(self):
+        """Matching errors are retried in place, with backoff"""
+        delays = []
+        Flaky.failures = 2
+        result = run_with_policies(Flaky, self.obj, sleep=delays.append)
+        assert result.id == "fakebucket-inbox/a.json"
+        assert delays == [1, 2]
+
+        Flaky.failures = 3
+        with pytest.raises(TransientError):
+            run_with_policies(Flaky, self.obj, sleep=delays.append)
+
+    def test_catch_fallback(self):
+        """Caught errors are routed to a fallback step"""
+
+        class WithFallback(Flaky):
+            retry = []
+            catch = [CatchPolicy(fallback=S3ToStac)]
+
+        WithFallback.failures = 1
+        pipe = Pipeline("TestCatch", trigger=trigger(), steps=[WithFallback, StacToS3])
+        assert pipe.run(self.obj) == self.obj
+
+    def test_catch_discard(self):
+        """Caught errors without a fallback discard the item"""
+
+        class Discarding(Flaky):
+            retry = []
+            catch = [CatchPolicy(errors=["TransientError"])]
+
+        Discarding.failures = 1
+        pipe = Pipeline("TestCatch", trigger=trigger(), steps=[Discarding, StacToS3])
+        assert pipe.run(self.obj) is None
+
+    def test_fallback_validation(self):
+        """Fallback steps must match the types of the step they replace"""
+
+        class BadFallback(Flaky):
+            catch = [CatchPolicy(fallback=StacToS3)]
+
+        with pytest.raises(TypeError):
+            Pipeline("TestCatch", trigger=trigger(), steps=[BadFallback, StacToS3])
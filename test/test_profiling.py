@@ -0,0 +1,69 @@
+from ingest.data_types import S3Object
+from ingest.pipeline import Pipeline
+from ingest.profiling import MB, Sample, StepProfiler
+from ingest.step import Transformer
+from ingest.trigger import S3ObjectCreated, S3Filter
+from test.data_models import StacItem
+
+
+class PadItem(Transformer[S3Object, StacItem]):
+    @classmethod
+    def execute(cls, input: S3Object) -> StacItem:
+        return StacItem(id=input.key, properties={"pad": "x" * int(input.key)})
+
+
+class ExpandItem(Transformer[StacItem, StacItem]):
+    memory_size = 256
+
+    @classmethod
+    def execute(cls, input: StacItem) -> StacItem:
+        # holds memory proportional to the size of the input
+        buffer = bytearray(len(input.properties["pad"]) * 100)
+        return StacItem(id=input.id, properties={"size": len(buffer)})
+
+
+def sample(input_bytes, peak_bytes):
+    return Sample(input_bytes, peak_bytes, 0, 0.1, 0.1)
+
+
+class TestStepProfiler:
+    def test_profile_pipeline(self):
+        """Profiling reports the memory used by each step, and flags those
+        whose memory grows with their input"""
+        pipeline = Pipeline(
+            "TestProfile",
+            trigger=S3ObjectCreated(
+                bucket_name="fakebucket",
+                object_filter=S3Filter(prefix="inbox", suffix=".json"),
+            ),
+            steps=[PadItem, ExpandItem],
+        )
+        inputs = [
+            S3Object(bucket="fakebucket", key=str(n))
+            for n in (10_000, 100_000, 500_000, 1_000_000)
+        ]
+        report = pipeline.profile(inputs)
+        steps = {s.step: s for s in report.steps}
+
+        assert steps["ExpandItem"].samples == 4
+        assert steps["ExpandItem"].max_peak_mb >= 100_000_000 / MB
+        assert steps["ExpandItem"].grows_with_input
+        assert steps["ExpandItem"].configured_memory_mb == 256
+        assert steps["ExpandItem"].recommended_memory_mb >= 128 + 64
+        assert steps["PadItem"].configured_memory_mb is None
+        assert "ExpandItem" in report.format()
+
+    def test_recommendation(self):
+        """Recommendations are rounded up to a valid Lambda memory size"""
+        profiler = StepProfiler(headroom=1.5, runtime_overhead_mb=64)
+        assert profiler.recommend([sample(100, 1 * MB)]) == 128
+        assert profiler.recommend([sample(100, 100 * MB)]) == 256
+        assert profiler.recommend([sample(100, 20_000 * MB)]) == 10240
+
+    def test_constant_memory(self):
+        """Steps using the same memory for any input are not flagged"""
+        profiler = StepProfiler()
+        samples = [sample(size, 10 * MB) for size in (10, 100, 1000)]
+        assert not profiler.grows_with_input(samples)
+        samples = [sample(size, size * MB) for size in (10, 100, 1000)]
+        assert profiler.grows_with_input(samples)
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+from ingest.data_types import S3Object
+from ingest.pipeline import Pipeline
+from ingest.ratelimit import (
+    MemoryRateLimitBackend,
+    RateLimit,
+    RateLimiter,
+    RateLimitExceeded,
+    SQLiteRateLimitBackend,
+)
+from ingest.runner import LocalRunner
+from ingest.trigger import S3Filter, S3ObjectCreated
+from test.data_models import S3ToStac, StacItem
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class InFlight(S3ToStac):
+    running = 0
+    peak = 0
+    lock = threading.Lock()
+
+    @classmethod
+    def execute(cls, input: S3Object) -> StacItem:
+        with cls.lock:
+            cls.running += 1
+            cls.peak = max(cls.peak, cls.running)
+        time.sleep(0.01)
+        with cls.lock:
+            cls.running -= 1
+        return super().execute(input)
+
+
+class TestRateLimit:
+    @pytest.mark.parametrize("backend", ["memory", "sqlite"])
+    def test_token_bucket(self, backend, tmp_path):
+        """Executions are admitted at the limit's rate, after a burst"""
+        if backend == "memory":
+            backend = MemoryRateLimitBackend()
+        else:
+            backend = SQLiteRateLimitBackend(tmp_path / "limits.db")
+        clock = FakeClock()
+        limit = RateLimit(per_second=10, burst=5, backend=backend)
+        limiter = RateLimiter(limit, key="api", sleep=clock.sleep, clock=clock)
+        for _ in range(25):
+            with limiter.acquire():
+                pass
+        # the first five are a burst, the other twenty take two seconds
+        assert clock.now - 1000 == pytest.approx(2.0)
+
+    def test_max_wait(self):
+        clock = FakeClock()
+        limit = RateLimit(per_second=1, burst=1, max_wait=0.5)
+        limiter = RateLimiter(limit, key="api", sleep=clock.sleep, clock=clock)
+        with limiter.acquire():
+            pass
+        with pytest.raises(RateLimitExceeded):
+            with limiter.acquire():
+                pass
+
+    def test_shared_slots(self, tmp_path):
+        """In-flight slots are shared across backends on the same file,
+        and leases of executions which never finish expire"""
+        path = tmp_path / "limits.db"
+        first, second = SQLiteRateLimitBackend(path), SQLiteRateLimitBackend(path)
+        token = first.acquire_slot("db", 1, lease_seconds=10, now=0)
+        assert token is not None
+        assert second.acquire_slot("db", 1, lease_seconds=10, now=5) is None
+        first.release_slot("db", token)
+        assert second.acquire_slot("db", 1, lease_seconds=10, now=5) is not None
+        assert first.acquire_slot("db", 1, lease_seconds=10, now=16) is not None
+
+    def test_local_runner(self):
+        """The local runner holds steps to their limits, across the
+        branches of concurrent runs"""
+        InFlight.rate_limit = RateLimit(
+            max_in_flight=2, backend=MemoryRateLimitBackend()
+        )
+        pipeline = Pipeline(
+            "TestRateLimit",
+            trigger=S3ObjectCreated(
+                bucket_name="fakebucket", object_filter=S3Filter(prefix="inbox/")
+            ),
+            steps=[InFlight],
+        )
+        runners = [LocalRunner(pipeline) for _ in range(6)]
+        threads = [
+            threading.Thread(
+                target=runner.run, args=(S3Object(bucket="b", key=str(i)),)
+            )
+            for i, runner in enumerate(runners)
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            InFlight.rate_limit = None
+        assert InFlight.peak <= 2
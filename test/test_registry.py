@@ -0,0 +1,90 @@
+import pytest
+from ingest.data_types import S3Object
+from ingest.pipeline import Pipeline
+from ingest.registry import StepKind, registry
+from ingest.step import Collector, Transformer, step_metadata, step_resources
+from ingest.trigger import S3ObjectCreated, S3Filter
+from test.data_models import CollectStac, S3ToStac, StacItem, StacToS3
+
+
+class DatedStacItem(StacItem):
+    datetime: str
+
+
+class S3ToDatedStac(Transformer[S3Object, DatedStacItem]):
+    @classmethod
+    def execute(cls, input: S3Object) -> DatedStacItem:
+        return DatedStacItem(id=input.key, properties={}, datetime="2022-01-01")
+
+
+class DatedStacToS3(Transformer[DatedStacItem, S3Object]):
+    @classmethod
+    def execute(cls, input: DatedStacItem) -> S3Object:
+        return S3Object(bucket="fakebucket", key=input.id)
+
+
+def pipeline(*steps):
+    return Pipeline(
+        "TestRegistry",
+        trigger=S3ObjectCreated(
+            bucket_name="fakebucket",
+            object_filter=S3Filter(prefix="inbox", suffix=".json"),
+        ),
+        steps=steps,
+    )
+
+
+class TestRegistry:
+    def test_metadata(self):
+        """Steps are registered with their resolved types when defined"""
+        metadata = step_metadata(S3ToStac)
+        assert metadata.input_type is S3Object
+        assert metadata.output_type is StacItem
+        assert metadata.kind == StepKind.transformer
+
+        metadata = step_metadata(CollectStac)
+        assert metadata.kind == StepKind.collector
+        assert metadata.resources["batch_size"] == 2
+        assert registry.find("test.data_models.CollectStac") is CollectStac
+
+    def test_generic_bases_are_not_registered(self):
+        """Only steps with concrete input and output types are registered"""
+        assert Transformer not in registry
+        assert Collector not in registry
+        assert S3ToStac in registry
+
+    def test_subclasses_inherit_types(self):
+        class Versioned(S3ToStac):
+            version = "2"
+
+        assert Versioned.get_input() is S3Object
+        assert Versioned.get_output() is StacItem
+        assert (
+            step_metadata(Versioned).version_hash
+            != step_metadata(S3ToStac).version_hash
+        )
+
+    def test_resources(self):
+        """Resources hold every configuration attribute a step declares,
+        including those of its own bases, and instances override them"""
+
+        class Retention(Transformer[S3Object, StacItem]):
+            retention_days: int = 30
+
+        class Archive(Retention):
+            memory_size = 512
+
+            def __init__(self, retention_days: int):
+                self.retention_days = retention_days
+
+        resources = step_metadata(Archive).resources
+        assert resources["memory_size"] == 512
+        assert resources["retention_days"] == 30
+        assert step_resources(Archive(retention_days=7))["retention_days"] == 7
+
+    def test_subclass_compatible_types(self):
+        """A step may receive a subclass of its input type, but not a
+        superclass"""
+        pipeline(S3ToDatedStac, StacToS3)
+        with pytest.raises(TypeError):
+            pipeline(S3ToStac, DatedStacToS3)
@@ -0,0 +1,62 @@
+from ingest.data_types import S3Object
+from ingest.pipeline import Pipeline
+from ingest.resources import ResourcePool, StepContext, get_pool, use_pool
+from ingest.runner import LocalRunner
+from ingest.step import Transformer, step_metadata
+from ingest.trigger import S3ObjectCreated, S3Filter
+from test.data_models import S3ToStac, StacItem
+
+
+class UsePool(Transformer[S3Object, StacItem]):
+    pools = []
+
+    @classmethod
+    def execute(cls, input: S3Object, context: StepContext) -> StacItem:
+        cls.pools.append(context.resources)
+        return StacItem(id=input.key, properties={})
+
+
+class TestResourcePool:
+    def test_clients_are_shared(self):
+        """Clients are created once per service and configuration"""
+        pool = ResourcePool(max_pool_connections=25, region_name="us-east-1")
+        s3 = pool.client("s3")
+        assert pool.client("s3") is s3
+        assert s3.meta.config.max_pool_connections == 25
+        assert pool.client("s3", retries={"max_attempts": 3}) is not s3
+        assert pool.http() is pool.http()
+
+    def test_registered_resources(self):
+        """Registered resources are created on first use and closed with
+        the pool"""
+        created, closed = [], []
+        pool = ResourcePool()
+        pool.register("db", lambda: created.append("db") or "connection", closed.append)
+        assert created == []
+        assert pool.get("db") == pool.get("db") == "connection"
+        assert created == ["db"]
+        pool.close()
+        assert closed == ["connection"]
+
+    def test_steps_receive_context(self):
+        """Steps accepting a context argument receive the runner's pool"""
+        assert step_metadata(UsePool).accepts_context
+        assert not step_metadata(S3ToStac).accepts_context
+        UsePool.pools = []
+        pool = ResourcePool()
+        pipeline = Pipeline(
+            "TestResources",
+            trigger=S3ObjectCreated(
+                bucket_name="fakebucket",
+                object_filter=S3Filter(prefix="inbox", suffix=".json"),
+            ),
+            steps=[UsePool],
+        )
+        with LocalRunner(pipeline, resources=pool) as runner:
+            runner.run(S3Object(bucket="fakebucket", key="a"))
+        assert UsePool.pools == [pool]
+
+        with use_pool(pool):
+            assert get_pool() is pool
+        UsePool.invoke(S3Object(bucket="fakebucket", key="b"))
+        assert UsePool.pools[-1] is get_pool()
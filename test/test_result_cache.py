@@ -0,0 +1,74 @@
+from ingest.data_types import S3Object
+from ingest.result_cache import (
+    DiskResultCache,
+    InMemoryKeyValueStore,
+    KeyValueResultCache,
+    MemoryResultCache,
+    result_key,
+)
+from ingest.step import Transformer
+from test.data_models import S3ToStac, StacItem
+
+
+class CountingStep(Transformer[S3Object, StacItem]):
+    cacheable = True
+    calls = 0
+
+    @classmethod
+    def execute(cls, input: S3Object) -> StacItem:
+        cls.calls += 1
+        return S3ToStac.execute(input)
+
+
+class TestResultCache:
+    obj = S3Object(bucket="fakebucket", key="inbox/a.json")
+
+    def test_cache_hit_skips_execution(self):
+        """Cacheable steps only execute once for a given input"""
+
+        class Cached(CountingStep):
+            result_cache = MemoryResultCache()
+
+        first = Cached.invoke(self.obj)
+        second = Cached.invoke(S3Object(key="inbox/a.json", bucket="fakebucket"))
+        assert first == second
+        assert Cached.calls == 1
+
+        Cached.invoke(S3Object(bucket="fakebucket", key="inbox/b.json"))
+        assert Cached.calls == 2
+
+    def test_version_changes_key(self):
+        """Bumping a step's version invalidates its cached results"""
+
+        class Bumped(CountingStep):
+            version = "2"
+
+        assert result_key(CountingStep, self.obj) != result_key(Bumped, self.obj)
+
+    def test_memory_lru_and_ttl(self):
+        cache = MemoryResultCache(max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        assert cache.get("b") is None
+        assert cache.get("a") == "1"
+
+        expiring = MemoryResultCache(ttl=0)
+        expiring.set("a", "1")
+        assert expiring.get("a") is None
+
+    def test_disk_cache(self, tmp_path):
+        cache = DiskResultCache(tmp_path, max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        assert DiskResultCache(tmp_path).get("a") == "1"
+        cache.set("c", "3")
+        assert len(list(tmp_path.iterdir())) == 2
+
+    def test_key_value_cache(self):
+        store = InMemoryKeyValueStore()
+        KeyValueResultCache(store).set("a", "1")
+        KeyValueResultCache(store, ttl=-1).set("b", "2")
+        assert KeyValueResultCache(store).get("a") == "1"
+        assert KeyValueResultCache(store).get("b") is None
@@ -0,0 +1,167 @@
+import threading
+import pytest
+from ingest.checkpoint import SQLiteCheckpointStore
+from ingest.data_types import S3Object
+from ingest.pipeline import Pipeline
+from ingest.runner import LocalRunner
+from ingest.step import Transformer
+from ingest.trigger import S3ObjectCreated, S3Filter
+from test.data_models import (
+    CollectStac,
+    S3ToStac,
+    StacCollection,
+    StacItem,
+)
+
+
+class CountingS3ToStac(S3ToStac):
+    calls = 0
+
+    @classmethod
+    def execute(cls, input: S3Object) -> StacItem:
+        cls.calls += 1
+        return super().execute(input)
+
+
+class CountCollection(Transformer[StacCollection, StacCollection]):
+    crash = False
+
+    @classmethod
+    def execute(cls, input: StacCollection) -> StacCollection:
+        if cls.crash:
+            raise RuntimeError("crashed")
+        return input
+
+
+def objects(*keys):
+    return [S3Object(bucket="fakebucket", key=key) for key in keys]
+
+
+@pytest.fixture
+def pipeline():
+    CountingS3ToStac.calls = 0
+    CountCollection.crash = False
+    return Pipeline(
+        "TestRunner",
+        trigger=S3ObjectCreated(
+            bucket_name="fakebucket",
+            object_filter=S3Filter(prefix="inbox", suffix=".json"),
+        ),
+        steps=[CountingS3ToStac, CollectStac, CountCollection],
+    )
+
+
+class TestLocalRunner:
+    def test_collector_batches(self, pipeline):
+        """Collectors execute once their batch is full"""
+        a, b = objects("a", "b")
+        assert pipeline.run(a) == StacItem(
+            id="fakebucket-a", properties={"bucket": "fakebucket", "key": "a"}
+        )
+        result = pipeline.run(b)
+        assert [item.id for item in result.items] == ["fakebucket-a", "fakebucket-b"]
+
+    def test_resume_collector_buffer(self, pipeline, tmp_path):
+        """Partially filled batches are restored from a checkpoint, and
+        inputs which were already collected are skipped"""
+        a, b = objects("a", "b")
+        LocalRunner(pipeline, SQLiteCheckpointStore(tmp_path / "run.db")).run(a)
+
+        runner = LocalRunner(pipeline, SQLiteCheckpointStore(tmp_path / "run.db"))
+        assert runner.queue_size(1) == 1
+        runner.run(a)
+        assert runner.queue_size(1) == 1
+        assert len(runner.run(b).items) == 2
+        assert CountingS3ToStac.calls == 2
+
+    def test_resume_after_crash(self, pipeline, tmp_path):
+        """Rerunning after a failure in a late step doesn't recompute
+        earlier steps"""
+        a, b = objects("a", "b")
+        CountCollection.crash = True
+        runner = LocalRunner(pipeline, SQLiteCheckpointStore(tmp_path / "run.db"))
+        runner.run(a)
+        with pytest.raises(RuntimeError):
+            runner.run(b)
+
+        CountCollection.crash = False
+        runner = LocalRunner(pipeline, SQLiteCheckpointStore(tmp_path / "run.db"))
+        assert all(isinstance(r, StacItem) for r in runner.run_all([a, b]))
+        [result] = runner.resume()
+        assert len(result.items) == 2
+        assert CountingS3ToStac.calls == 2
+
+    def test_timer_flush(self, pipeline):
+        """Partial batches are flushed once their batching window expires,
+        without waiting for further input"""
+
+        class QuickCollect(CollectStac):
+            max_batching_window = 0.05
+
+        pipeline.steps = [CountingS3ToStac, QuickCollect, CountCollection]
+        flushed = threading.Event()
+        results = []
+
+        def on_result(result):
+            results.append(result)
+            flushed.set()
+
+        with LocalRunner(pipeline, on_result=on_result) as runner:
+            runner.run(objects("a")[0])
+            assert flushed.wait(timeout=5)
+        assert [len(result.items) for result in results] == [1]
+
+    def test_timer_survives_failed_flush(self, pipeline):
+        """A batch which fails when flushed by the timer doesn't stop later
+        batches from being flushed"""
+
+        class QuickCollect(CollectStac):
+            max_batching_window = 0.05
+
+        pipeline.steps = [CountingS3ToStac, QuickCollect, CountCollection]
+        flushed = threading.Event()
+        CountCollection.crash = True
+        with LocalRunner(pipeline, on_result=lambda _: flushed.set()) as runner:
+            runner.run(objects("a")[0])
+            while runner.queue_size(1):
+                assert not flushed.wait(timeout=0.01)
+            CountCollection.crash = False
+            runner.run(objects("b")[0])
+            assert flushed.wait(timeout=5)
+
+    def test_pipeline_close(self, pipeline):
+        """Batches flushed by the timer under Pipeline.run are returned
+        when the pipeline is closed, with those flushed by closing it"""
+
+        class QuickCollect(CollectStac):
+            max_batching_window = 0.05
+
+        pipeline.steps = [CountingS3ToStac, QuickCollect, CountCollection]
+        pipeline.run(objects("a")[0])
+        while pipeline._runner.queue_size(1):
+            threading.Event().wait(0.01)
+        pipeline.run(objects("b")[0])
+        results = pipeline.close()
+        assert [len(result.items) for result in results] == [1, 1]
+
+    def test_flush_on_close(self, pipeline):
+        """Closing a runner flushes partially filled batches"""
+        runner = LocalRunner(pipeline)
+        runner.run(objects("a")[0])
+        [result] = runner.close()
+        assert len(result.items) == 1
+        assert runner.queue_size(1) == 0
+
+    def test_partitioned_batches(self, pipeline):
+        """Partitioned collectors only batch items sharing a key"""
+
+        class ByKey(CollectStac):
+            partition_by = "properties.key"
+
+        pipeline.steps = [CountingS3ToStac, ByKey, CountCollection]
+        runner = LocalRunner(pipeline)
+        runner.run_all(objects("a", "b"))
+        assert runner.queue_size(1) == 2
+        result = runner.run(S3Object(bucket="otherbucket", key="a"))
+        assert [item.id for item in result.items] == ["fakebucket-a", "otherbucket-a"]
+        assert runner.queue_size(1) == 1
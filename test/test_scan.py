@@ -0,0 +1,198 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from ingest.backpressure import (
+    BackpressureConfig,
+    ExecutionStarter,
+    StepFunctionThrottled,
+)
+from ingest.scan import (
+    BucketScanner,
+    FileWatermarkStore,
+    LocalLister,
+    ScanConfig,
+    start_executions,
+)
+from ingest.stubs import StepFunctionsStub
+
+NOW = datetime(2022, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def put(root, key, modified=NOW - timedelta(hours=1)):
+    path = root / "fakebucket" / key
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("{}")
+    os.utime(path, (modified.timestamp(), modified.timestamp()))
+
+
+def scanner(tmp_path, batches, **config):
+    return BucketScanner(
+        ScanConfig(bucket_name="fakebucket", **config),
+        lister=LocalLister(tmp_path / "bucket"),
+        store=FileWatermarkStore(tmp_path / "watermarks.json"),
+        start=lambda objects, listing: batches.append([o.key for o in objects]),
+        clock=lambda: NOW,
+    )
+
+
+class TestBucketScanner:
+    def test_key_watermark(self, tmp_path):
+        """Each scan lists only the keys after the last one seen"""
+        root, batches = tmp_path / "bucket", []
+        for i in range(5):
+            put(root, f"inbox/2022/{i}.json")
+        put(root, "inbox/2022/5.txt")
+        put(root, "other/0.json")
+        report = scanner(
+            tmp_path, batches, prefix="inbox/", suffix=".json", batch_size=2
+        ).scan()
+        assert report.objects == 5
+        assert batches == [
+            ["inbox/2022/0.json", "inbox/2022/1.json"],
+            ["inbox/2022/2.json", "inbox/2022/3.json"],
+            ["inbox/2022/4.json"],
+        ]
+
+        put(root, "inbox/2022/6.json")
+        batches.clear()
+        scanner(tmp_path, batches, prefix="inbox/", suffix=".json").scan()
+        assert batches == [["inbox/2022/6.json"]]
+
+    def test_shards(self, tmp_path):
+        """Shards are listed in parallel, each with its own watermark"""
+        root, batches = tmp_path / "bucket", []
+        for shard in "abc":
+            for i in range(3):
+                put(root, f"inbox/{shard}/{i}.json")
+        report = scanner(
+            tmp_path, batches, prefix="inbox/", shards=["a/", "b/", "c/"]
+        ).scan()
+        assert report.shards == {"inbox/a/": 3, "inbox/b/": 3, "inbox/c/": 3}
+        watermarks = FileWatermarkStore(tmp_path / "watermarks.json").load()
+        assert watermarks["inbox/b/"].last_key == "inbox/b/2.json"
+
+        put(root, "inbox/b/3.json")
+        batches.clear()
+        scanner(tmp_path, batches, prefix="inbox/", shards=["a/", "b/", "c/"]).scan()
+        assert batches == [["inbox/b/3.json"]]
+
+    def test_last_modified_watermark(self, tmp_path):
+        """Objects modified since the last scan are found whatever their key,
+        leaving recent uploads to settle until the next scan"""
+        root, batches = tmp_path / "bucket", []
+        put(root, "inbox/b.json", modified=NOW - timedelta(hours=2))
+        put(root, "inbox/c.json", modified=NOW - timedelta(seconds=10))
+        scanner(tmp_path, batches, watermark="last_modified").scan()
+        assert batches == [["inbox/b.json"]]
+
+        put(root, "inbox/a.json", modified=NOW + timedelta(minutes=1))
+        batches.clear()
+        later = scanner(tmp_path, batches, watermark="last_modified")
+        later.clock = lambda: NOW + timedelta(minutes=5)
+        later.scan()
+        assert batches == [["inbox/a.json", "inbox/c.json"]]
+
+    def test_last_modified_resumes(self, tmp_path):
+        """Listings by last modified time which stop part way through are
+        resumed after their last key, without handing out objects again"""
+        root, batches = tmp_path / "bucket", []
+        for i in range(5):
+            put(root, f"inbox/{i}.json")
+        stops = iter([False, False, True])
+        first = scanner(tmp_path, batches, watermark="last_modified")
+        first.should_stop = lambda: next(stops, False)
+        first.scan()
+        assert batches == [["inbox/0.json", "inbox/1.json"]]
+        watermark = FileWatermarkStore(tmp_path / "watermarks.json").load()[""]
+        assert watermark.last_key == "inbox/1.json"
+
+        batches.clear()
+        later = scanner(
+            tmp_path, batches, watermark="last_modified", max_objects_per_scan=2
+        )
+        later.clock = lambda: NOW + timedelta(minutes=5)
+        later.scan()
+        later.scan()
+        assert batches == [["inbox/2.json", "inbox/3.json"], ["inbox/4.json"]]
+
+        # once complete, only objects modified since the first cutoff
+        put(root, "inbox/0.json", modified=NOW + timedelta(minutes=1))
+        batches.clear()
+        later.scan()
+        assert batches == [["inbox/0.json"]]
+
+    def test_resumes_after_limit_or_failure(self, tmp_path):
+        """Scans bounded by max_objects_per_scan, or interrupted by an
+        error, resume after the last batch handed out"""
+        root, batches = tmp_path / "bucket", []
+        for i in range(6):
+            put(root, f"inbox/{i}.json")
+        scanner(tmp_path, batches, batch_size=2, max_objects_per_scan=3).scan()
+        assert batches == [["inbox/0.json", "inbox/1.json"], ["inbox/2.json"]]
+
+        def fail(objects, listing):
+            if "inbox/5.json" in [o.key for o in objects]:
+                raise RuntimeError("start failed")
+            batches.append([o.key for o in objects])
+
+        failing = scanner(tmp_path, batches, batch_size=2)
+        failing.start = fail
+        with pytest.raises(RuntimeError):
+            failing.scan()
+        assert batches[-1] == ["inbox/3.json", "inbox/4.json"]
+
+        batches.clear()
+        scanner(tmp_path, batches, batch_size=2).scan()
+        assert batches == [["inbox/5.json"]]
+
+    def test_start_executions(self, tmp_path):
+        """Deployed scans start an execution with each batch of objects"""
+        put(tmp_path / "bucket", "inbox/0.json")
+        sfn = StepFunctionsStub()
+        s = scanner(tmp_path, [])
+        s.start = start_executions(ExecutionStarter(sfn, "arn"))
+        s.scan()
+        assert sfn.executions[0]["input"] == {
+            "objects": [{"bucket": "fakebucket", "key": "inbox/0.json"}]
+        }
+
+    def test_repeated_batches_start_once(self, tmp_path):
+        """Executions started before a scan failed aren't started again
+        when the scan repeats the batch"""
+        for i in range(5):
+            put(tmp_path / "bucket", f"inbox/{i}.json")
+        sfn = StepFunctionsStub()
+        config = BackpressureConfig(max_objects_per_execution=2, throttle_retries=1)
+        starter = ExecutionStarter(sfn, "arn", config=config, sleep=lambda _: None)
+        s = scanner(tmp_path, [])
+        s.start = start_executions(starter)
+        original = sfn.start_execution
+
+        def throttle_second(**kwargs):
+            if len(sfn.executions) == 1:
+                sfn.throttle_next = 1
+            return original(**kwargs)
+
+        sfn.start_execution = throttle_second
+        with pytest.raises(StepFunctionThrottled):
+            s.scan()
+        sfn.start_execution = original
+        s.scan()
+        assert [[o["key"] for o in e["input"]["objects"]] for e in sfn.executions] == [
+            ["inbox/0.json", "inbox/1.json"],
+            ["inbox/2.json", "inbox/3.json"],
+            ["inbox/4.json"],
+        ]
+
+    def test_executions_hold_bounded_batches(self, tmp_path):
+        """Batches larger than a workflow's execution history can hold are
+        split across executions"""
+        for i in range(5):
+            put(tmp_path / "bucket", f"inbox/{i}.json")
+        sfn = StepFunctionsStub()
+        s = scanner(tmp_path, [])
+        config = BackpressureConfig(max_objects_per_execution=2)
+        s.start = start_executions(ExecutionStarter(sfn, "arn", config=config))
+        s.scan()
+        assert [len(e["input"]["objects"]) for e in sfn.executions] == [2, 2, 1]
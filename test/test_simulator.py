@@ -0,0 +1,125 @@
+from ingest.pipeline import Pipeline
+from ingest.segments import split_segments
+from ingest.simulator import Constant, ConstantArrivals, Simulator
+from ingest.step import Transformer
+from ingest.trigger import S3Buffer, S3Filter, S3ObjectCreated, S3ScanTrigger
+from test.data_models import CollectStac, S3ToStac, StacCollection
+
+
+class PublishCollection(Transformer[StacCollection, StacCollection]):
+    @classmethod
+    def execute(cls, input: StacCollection) -> StacCollection:
+        return input
+
+
+class CollectSlowly(CollectStac):
+    batch_size = 100
+    max_batching_window = 30
+
+
+class CollectNatively(CollectStac):
+    native_send = True
+
+
+class CollectOneAtATime(CollectStac):
+    batch_size = 1
+    max_batching_window = 0
+    max_concurrency = 1
+
+
+def pipeline(collector, buffer=None):
+    return Pipeline(
+        "TestSimulator",
+        trigger=S3ObjectCreated(
+            bucket_name="fakebucket",
+            object_filter=S3Filter(prefix="inbox", suffix=".json"),
+            buffer=buffer,
+        ),
+        steps=[S3ToStac, collector, PublishCollection],
+    )
+
+
+class TestSimulator:
+    def test_segments(self):
+        """Pipelines are split into a workflow per collector, as deployed"""
+        segments = split_segments([S3ToStac, CollectStac, PublishCollection])
+        assert segments[0].steps == [S3ToStac]
+        assert segments[0].collector is CollectStac
+        assert segments[1].steps == [CollectStac, PublishCollection]
+        assert segments[1].collector is None
+        assert len(split_segments([S3ToStac])) == 1
+
+    def test_full_batches(self):
+        """Every item completes, with executions and transitions per workflow"""
+        report = Simulator(pipeline(CollectStac), ConstantArrivals(rate=1), seed=1).run(
+            duration=10
+        )
+        assert report.items_arrived == report.items_completed == 10
+        # a batch of two completes shortly after its second item arrives
+        assert report.latency_max < 2
+        # S3ToStac, send and succeed for each of 10 executions
+        assert report.transitions["Workflow0"] == 30
+        # CollectStac, PublishCollection and succeed for each of 5 batches
+        assert report.transitions["Workflow1"] == 15
+        assert report.final_backlog == {"CollectStac": 0}
+
+    def test_batching_window(self):
+        """Partial batches wait for the batching window"""
+        report = Simulator(pipeline(CollectSlowly), ConstantArrivals(rate=1)).run(
+            duration=10
+        )
+        assert report.items_completed == 10
+        assert 30 <= report.latency_max < 31
+        assert report.max_backlog["CollectSlowly"] == 10
+
+    def test_consumer_concurrency(self):
+        """Batches rejected by a consumer's concurrency limit are delayed
+        by the visibility timeout"""
+        report = Simulator(
+            pipeline(CollectOneAtATime),
+            ConstantArrivals(rate=1),
+            service_times={"S3ToStac": Constant(0.01)},
+            framework_service_time=Constant(3),
+            visibility_timeout=60,
+        ).run(duration=10)
+        assert report.items_completed == 10
+        assert report.throttled_batches > 0
+        assert report.latency_max > 60
+        assert report.peak_concurrency_by_function["CollectOneAtATimeConsumer"] == 1
+
+    def test_buffered_trigger(self):
+        """A buffered S3 trigger starts an execution per batch of objects,
+        mapping over them"""
+        buffer = S3Buffer(batch_size=5, max_batching_window=10)
+        report = Simulator(
+            pipeline(CollectStac, buffer=buffer), ConstantArrivals(rate=1), seed=1
+        ).run(duration=10)
+        assert report.items_completed == 10
+        # Map and succeed for each of 2 executions, and S3ToStac and send
+        # for each of their 10 objects
+        assert report.transitions["Workflow0"] == 24
+        assert report.final_backlog == {"S3Buffer": 0, "CollectStac": 0}
+
+    def test_scan_trigger(self):
+        """A scan trigger starts executions for the items found by each scan"""
+        scan_pipeline = Pipeline(
+            "TestSimulatorScan",
+            trigger=S3ScanTrigger(
+                bucket_name="fakebucket", interval_minutes=1, batch_size=50
+            ),
+            steps=[S3ToStac],
+        )
+        report = Simulator(scan_pipeline, ConstantArrivals(rate=1)).run(duration=100)
+        assert report.items_completed == 100
+        # items wait for the scan after they arrive
+        assert 59 < report.latency_max < 61
+        assert report.peak_concurrency_by_function["Scan"] == 1
+
+    def test_native_send(self):
+        """The native SQS integration sends items without a Lambda"""
+        report = Simulator(pipeline(CollectNatively), ConstantArrivals(rate=1)).run(
+            duration=10
+        )
+        assert report.items_completed == 10
+        assert report.transitions["Workflow0"] == 30
+        assert "CollectNativelySend" not in report.peak_concurrency_by_function
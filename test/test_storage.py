@@ -0,0 +1,50 @@
+import pytest
+from ingest.data_types import S3Object
+from ingest.storage import LOCAL_STORAGE_ROOT_ENV, LocalObjectStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    (tmp_path / "fakebucket" / "inbox").mkdir(parents=True)
+    (tmp_path / "fakebucket" / "inbox" / "data.txt").write_bytes(
+        b"".join(f"line {i}\n".encode() for i in range(100))
+    )
+    return LocalObjectStore(tmp_path)
+
+
+class TestS3ObjectReader:
+    obj = S3Object(bucket="fakebucket", key="inbox/data.txt")
+
+    def test_chunked_read(self, store):
+        """Objects are streamed in chunks no larger than the chunk size"""
+        reader = self.obj.open(store=store, chunk_size=64)
+        chunks = list(reader.iter_chunks())
+        assert all(len(chunk) <= 64 for chunk in chunks)
+        assert (
+            b"".join(chunks) == store.path("fakebucket", "inbox/data.txt").read_bytes()
+        )
+
+    def test_ranged_read(self, store):
+        """Arbitrary byte ranges can be read without fetching the whole object"""
+        reader = self.obj.open(store=store, chunk_size=7)
+        assert reader.read(0, 7) == b"line 0\n"
+        assert b"".join(reader.iter_chunks(7, 21)) == b"line 1\nline 2\n"
+
+    def test_iter_lines(self, store):
+        """Lines split across chunk boundaries are reassembled"""
+        lines = list(self.obj.open(store=store, chunk_size=5).iter_lines())
+        assert lines == [f"line {i}".encode() for i in range(100)]
+
+    def test_mmap(self, store, tmp_path):
+        """Objects can be spilled to disk and memory-mapped"""
+        spill_dir = tmp_path / "spill"
+        spill_dir.mkdir()
+        with self.obj.open(store=store, chunk_size=16).mmap(spill_dir) as mapped:
+            assert mapped[:7] == b"line 0\n"
+            assert len(mapped) == store.size("fakebucket", "inbox/data.txt")
+        assert list(spill_dir.iterdir()) == []
+
+    def test_default_local_store(self, store, monkeypatch):
+        """The local backend is used when a local storage root is configured"""
+        monkeypatch.setenv(LOCAL_STORAGE_ROOT_ENV, str(store.root))
+        assert self.obj.open().read(0, 6) == b"line 0"
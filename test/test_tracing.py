@@ -0,0 +1,121 @@
+import json
+
+from ingest.backpressure import ExecutionStarter
+from ingest.data_types import S3Object
+from ingest.packing import pack_items
+from ingest.pipeline import Pipeline
+from ingest.runner import LocalRunner
+from ingest.stubs import StepFunctionsStub
+from ingest.tracing import (
+    TRACE_KEY,
+    FileExporter,
+    MemoryExporter,
+    Tracer,
+    message_attributes,
+    traced_handler,
+    use_tracer,
+)
+from ingest.trigger import S3Filter, S3ObjectCreated
+from test.data_models import CollectStac, S3ToStac
+
+
+def pipeline():
+    return Pipeline(
+        "TestTracing",
+        trigger=S3ObjectCreated(
+            bucket_name="fakebucket", object_filter=S3Filter(prefix="inbox/")
+        ),
+        steps=[S3ToStac, CollectStac],
+    )
+
+
+def objects(*keys):
+    return [S3Object(bucket="fakebucket", key=key) for key in keys]
+
+
+class TestTracing:
+    def test_local_runs(self):
+        """Each input is traced through its steps, and collector batches
+        are linked to the traces of their items"""
+        exporter = MemoryExporter()
+        with LocalRunner(pipeline(), tracer=Tracer(exporter)) as runner:
+            runner.run_all(objects("a", "b"))
+        runs = exporter.named("run")
+        assert len({run.trace_id for run in runs}) == 2
+        for run in runs:
+            [step] = [
+                s for s in exporter.named("S3ToStac") if s.trace_id == run.trace_id
+            ]
+            assert step.parent_id == run.span_id
+        [batch] = exporter.named("batch")
+        assert batch.trace_id not in {run.trace_id for run in runs}
+        assert {link.trace_id for link in batch.links} == {r.trace_id for r in runs}
+        assert batch.attributes["items"] == 2
+        assert batch.attributes["max_queued_seconds"] >= 0
+        [collector] = exporter.named("CollectStac")
+        assert collector.parent_id == batch.span_id
+
+    def test_disabled(self):
+        """Untraced runs carry no trace context"""
+        output = traced_handler(S3ToStac, objects("a")[0].dict(), None)
+        assert TRACE_KEY not in output
+
+    def test_handlers_propagate(self):
+        """Triggers start traces which step handlers continue, and
+        collector handlers link the traces of the messages they receive"""
+        exporter = MemoryExporter()
+        sfn = StepFunctionsStub()
+        with use_tracer(Tracer(exporter)):
+            ExecutionStarter(sfn, "arn").process(
+                [{"messageId": "0", "body": json.dumps(objects("a")[0].dict())}],
+                name="batch",
+            )
+            input = sfn.executions[0]["input"]
+            [trigger] = exporter.named("trigger")
+            assert input[TRACE_KEY]["span_id"] == trigger.span_id
+
+            item = traced_handler(S3ToStac, {**objects("a")[0].dict(), **input}, None)
+            [step] = exporter.named("S3ToStac")
+            assert step.parent_id == trigger.span_id
+            assert item[TRACE_KEY]["span_id"] == step.span_id
+
+            trace = item.pop(TRACE_KEY)
+            attributes = message_attributes(step.context)
+            records = [
+                {
+                    "body": json.dumps(item),
+                    "messageAttributes": {
+                        TRACE_KEY: {"stringValue": attributes[TRACE_KEY]["StringValue"]}
+                    },
+                },
+                # packed messages carry the context in their items
+                {"body": pack_items([{**item, TRACE_KEY: trace}])[0]},
+            ]
+            traced_handler(CollectStac, {"Records": records}, None)
+        [collector] = exporter.named("CollectStac")
+        assert [link.span_id for link in collector.links] == [step.span_id] * 2
+        assert collector.trace_id != step.trace_id
+        assert collector.attributes["max_queued_seconds"] >= 0
+
+    def test_file_export(self, tmp_path):
+        """Spans are written as OTLP JSON lines"""
+        path = tmp_path / "spans.jsonl"
+        with LocalRunner(pipeline(), tracer=Tracer(FileExporter(str(path)))) as runner:
+            runner.run(objects("a")[0])
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        spans = [
+            span
+            for line in lines
+            for resource in line["resourceSpans"]
+            for scope in resource["scopeSpans"]
+            for span in scope["spans"]
+        ]
+        # the partial batch is flushed when the runner closes
+        assert [span["name"] for span in spans] == [
+            "S3ToStac",
+            "run",
+            "CollectStac",
+            "batch",
+        ]
+        assert spans[0]["parentSpanId"] == spans[1]["spanId"]
+        assert int(spans[1]["endTimeUnixNano"]) >= int(spans[1]["startTimeUnixNano"])